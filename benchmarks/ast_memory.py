@@ -0,0 +1,55 @@
+"""Compare the heap used by ASTNode trees and compact ASTArena trees.
+
+Usage: python benchmarks/ast_memory.py [statements]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'compiler'))
+
+from lexer import lex
+from parser import Parser
+
+def generate_program(statements):
+    lines = []
+    for i in range(statements // 4):
+        lines.append(f"@ink dive_{i}(depth: Float, gravity: Float = 9.8) -> Float ~")
+        lines.append(f"    let pressure_{i} = depth * gravity * {i} + {i}.5;")
+        lines.append(f"    print(\"Depth {{{{depth}}}}\");")
+        lines.append(f"    return pressure_{i} / 2;")
+        lines.append("~")
+    return "\n".join(lines) + "\n"
+
+def count_nodes(node):
+    count = 0
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node.children)
+    return count
+
+def measure(tokens, compact):
+    tracemalloc.start()
+    start = time.perf_counter()
+    ast = Parser(tokens, compact=compact).parse()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return ast, current, peak, elapsed
+
+def main():
+    statements = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    tokens = lex(generate_program(statements))
+    print(f"{statements} statements, {len(tokens)} tokens")
+    for label, compact in (("ASTNode", False), ("ASTArena", True)):
+        ast, retained, peak, elapsed = measure(tokens, compact)
+        nodes = count_nodes(ast)
+        print(f"{label:>9}: {nodes} nodes, retained {retained / 1e6:8.2f} MB "
+              f"({retained / nodes:6.1f} B/node), peak {peak / 1e6:8.2f} MB, parse {elapsed:.2f}s")
+        del ast
+
+if __name__ == "__main__":
+    main()
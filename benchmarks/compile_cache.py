@@ -0,0 +1,39 @@
+"""Compare a cold front end (lex + parse) with a warm .ksc cache load.
+
+Usage: python benchmarks/compile_cache.py [statements]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'compiler'))
+
+from parser import parse
+from cache import CompilationCache, cache_key
+from ast_memory import generate_program, count_nodes
+
+def main():
+    statements = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    source = generate_program(statements)
+    with tempfile.TemporaryDirectory() as directory:
+        cache = CompilationCache(directory)
+
+        start = time.perf_counter()
+        ast = parse(source)
+        cold = time.perf_counter() - start
+        cache.store(source, ast)
+        size = os.path.getsize(cache.path(cache_key(source)))
+
+        start = time.perf_counter()
+        cached = cache.load(source)
+        warm = time.perf_counter() - start
+
+        print(f"{statements} statements, {count_nodes(ast)} nodes, .ksc file {size / 1e6:.2f} MB")
+        print(f"lex + parse: {cold:.3f}s")
+        print(f"cache load:  {warm:.3f}s ({cold / warm:.1f}x faster)")
+        print(cache.report())
+        return 0 if cached is not None and count_nodes(cached) == count_nodes(ast) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""Throughput benchmarks for the front end: lex, Parser.parse and pretty_print_ast.
+
+Every stage runs in a fresh process so its peak RSS is its own; the best of
+--repeat runs is reported. Results can be saved as a baseline and later
+compared against one, failing when throughput drops past a threshold.
+
+Usage: python benchmarks/frontend.py [--size 1MB] [--seed 0] [--repeat 3]
+                                     [--save [FILE]] [--compare [FILE]] [--threshold 10]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+COMPILER_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'compiler')
+sys.path.insert(0, COMPILER_DIRECTORY)
+
+from generator import parse_size, write_program
+from ast_memory import count_nodes
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "frontend.json")
+
+# stage -> (unit counted, throughput metric) as stored in baselines
+STAGES = {
+    "lex": ("tokens", "tokens_per_second"),
+    "parse": ("nodes", "nodes_per_second"),
+    "pretty_print": ("nodes", "nodes_per_second"),
+}
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+def run_stage(stage, path):
+    """Measure one stage on the program at path. Runs inside a worker process."""
+    from lexer import lex
+    from parser import Parser
+    from ast_nodes import pretty_print_ast
+
+    with open(path) as f:
+        source = f.read()
+    if stage == "lex":
+        start = time.perf_counter()
+        tokens = lex(source)
+        elapsed = time.perf_counter() - start
+        count = len(tokens)
+    else:
+        tokens = lex(source)
+        if stage == "parse":
+            start = time.perf_counter()
+            ast = Parser(tokens).parse()
+            elapsed = time.perf_counter() - start
+        else:
+            ast = Parser(tokens).parse()
+            with open(os.devnull, "w") as devnull:
+                start = time.perf_counter()
+                pretty_print_ast(ast, stream=devnull)
+                elapsed = time.perf_counter() - start
+        count = count_nodes(ast)
+    return {"count": count, "seconds": elapsed, "peak_rss_mb": peak_rss_mb()}
+
+def measure(stage, path, repeat):
+    context = multiprocessing.get_context("spawn")
+    best = None
+    for _ in range(repeat):
+        with context.Pool(1) as pool:
+            result = pool.apply(run_stage, (stage, path))
+        if best is None or result["seconds"] < best["seconds"]:
+            best = result
+    unit, metric = STAGES[stage]
+    return {unit: best["count"], "seconds": round(best["seconds"], 6),
+            metric: round(best["count"] / best["seconds"], 1), "peak_rss_mb": round(best["peak_rss_mb"], 1)}
+
+def run_benchmarks(size, seed, repeat):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "program.ks")
+        write_program(path, size, seed)
+        results = {stage: measure(stage, path, repeat) for stage in STAGES}
+    return {
+        "size": size,
+        "seed": seed,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+def compare(current, baseline, threshold):
+    """Return a description of every stage whose throughput fell more than threshold percent."""
+    if (current["size"], current["seed"]) != (baseline["size"], baseline["seed"]):
+        raise ValueError(f"Baseline was recorded for size {baseline['size']} seed {baseline['seed']}, "
+                         f"not size {current['size']} seed {current['seed']}")
+    regressions = []
+    for stage, (unit, metric) in STAGES.items():
+        if stage not in baseline["results"]:
+            continue
+        before = baseline["results"][stage][metric]
+        after = current["results"][stage][metric]
+        change = (after - before) / before * 100
+        print(f"{stage:>12}: {before:14,.0f} -> {after:14,.0f} {metric} ({change:+.1f}%)")
+        if change < -threshold:
+            regressions.append(f"{stage} {metric} dropped {-change:.1f}% (threshold {threshold}%)")
+    return regressions
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark lex, parse and pretty_print_ast")
+    arg_parser.add_argument("--size", default="1MB", help="size of the generated program (1KB to 500MB)")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--repeat", type=int, default=3, help="runs per stage; the fastest counts")
+    arg_parser.add_argument("--save", nargs="?", const=DEFAULT_BASELINE, metavar="FILE", help="write the results as a baseline")
+    arg_parser.add_argument("--compare", nargs="?", const=DEFAULT_BASELINE, metavar="FILE",
+                            help="fail if throughput regressed against a baseline")
+    arg_parser.add_argument("--threshold", type=float, default=10.0, help="allowed throughput drop in percent")
+    args = arg_parser.parse_args()
+
+    current = run_benchmarks(parse_size(args.size), args.seed, args.repeat)
+    print(f"{current['size']} bytes, seed {current['seed']}, Python {current['python']}")
+    for stage, (unit, metric) in STAGES.items():
+        result = current["results"][stage]
+        print(f"{stage:>12}: {result[unit]:10} {unit} in {result['seconds']:.3f}s, "
+              f"{result[metric]:14,.0f} {metric}, peak RSS {result['peak_rss_mb']:.1f} MB")
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(current, f, indent=2)
+            f.write("\n")
+        print(f"baseline saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""Seeded generator of synthetic KrakenScript programs for benchmarking.
+
+Programs mix @ink functions with default parameters, deeply nested
+arithmetic, long strings and comments, and nested if/for blocks. The same
+seed and size always produce the same program.
+
+Usage: python benchmarks/generator.py SIZE [--seed N] [-o FILE]
+       e.g. python benchmarks/generator.py 50MB -o /tmp/large.ks
+"""
+import argparse
+import random
+import sys
+
+# Names are checked against the lexer's keyword rule, which also matches
+# keyword prefixes: nothing here may start with let, if, for, print, ...
+NAMES = ["depth", "tide", "kraken", "abyss", "reef", "swell", "coral", "gill",
+         "squid", "trench", "ink", "brine", "hull", "anchor", "maelstrom", "siren"]
+TYPES = ["Int", "Float", "String", "Bool"]
+WORDS = ["the", "kraken", "stirs", "beneath", "black", "water", "and", "ships",
+         "vanish", "without", "a", "trace", "tentacles", "rise", "from", "abyssal", "depths"]
+OPERATORS = ["+", "-", "*", "/"]
+
+SIZE_UNITS = {"": 1, "B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+def parse_size(text):
+    """'1KB', '500MB', '2048' -> a byte count."""
+    text = text.strip().upper()
+    digits = text.rstrip("KMGB")
+    unit = text[len(digits):]
+    if unit in ("K", "M", "G"):
+        unit += "B"
+    if unit not in SIZE_UNITS or not digits:
+        raise ValueError(f"Invalid size: {text!r}")
+    return int(float(digits) * SIZE_UNITS[unit])
+
+class ProgramGenerator:
+    def __init__(self, seed=0, block_depth=3, expression_depth=6):
+        self.random = random.Random(seed)
+        self.block_depth = block_depth
+        self.expression_depth = expression_depth
+        self.arities = []  # Parameter count of every function generated so far
+        self.constants = 0
+
+    def name(self):
+        return f"{self.random.choice(NAMES)}_{self.random.randrange(100)}"
+
+    def literal(self):
+        if self.random.random() < 0.6:
+            return str(self.random.randrange(10000))
+        return f"{self.random.randrange(1000)}.{self.random.randrange(100)}"
+
+    def string(self, words=None):
+        count = words or self.random.randrange(3, 30)
+        return '"' + " ".join(self.random.choice(WORDS) for _ in range(count)) + '"'
+
+    def comment(self):
+        lines = ["    " + " ".join(self.random.choice(WORDS) for _ in range(self.random.randrange(4, 14)))
+                 for _ in range(self.random.randrange(1, 6))]
+        return "(*\n" + "\n".join(lines) + "\n*)"
+
+    def operand(self, names):
+        if names and self.random.random() < 0.5:
+            return self.random.choice(names)
+        return self.literal()
+
+    def expression(self, names, depth=None):
+        depth = self.random.randrange(self.expression_depth + 1) if depth is None else depth
+        if depth == 0:
+            if self.arities and self.random.random() < 0.05:
+                index = self.random.randrange(len(self.arities))
+                args = ", ".join(self.operand(names) for _ in range(self.arities[index]))
+                return f"dive_{index}({args})"
+            return self.operand(names)
+        left = self.expression(names, depth - 1)
+        right = self.expression(names, self.random.randrange(depth))
+        expression = f"{left} {self.random.choice(OPERATORS)} {right}"
+        return f"({expression})" if self.random.random() < 0.6 else expression
+
+    def block(self, names, indent, depth):
+        lines = []
+        names = list(names)
+        for _ in range(self.random.randrange(2, 7)):
+            pad = "    " * indent
+            roll = self.random.random()
+            if roll < 0.35:
+                name = self.name()
+                keyword = "let" if self.random.random() < 0.8 else "const"
+                if keyword == "const":
+                    # Constants cannot be declared again, so they never reuse a name
+                    name = f"{name}_k{self.constants}"
+                    self.constants += 1
+                lines.append(f"{pad}{keyword} {name} = {self.expression(names)};")
+                names.append(name)
+            elif roll < 0.5:
+                lines.append(f"{pad}print({self.string() if self.random.random() < 0.4 else self.expression(names)});")
+            elif roll < 0.65 and depth < self.block_depth:
+                condition = self.random.choice(["true", "false"]) if self.random.random() < 0.3 else self.expression(names, 1)
+                lines.append(f"{pad}if {condition} ~")
+                lines.extend(self.block(names, indent + 1, depth + 1))
+                lines.append(f"{pad}~")
+            elif roll < 0.8 and depth < self.block_depth:
+                variable = self.name()
+                collection = (f"range({self.random.randrange(1, 50)})" if self.random.random() < 0.5
+                              else "[" + ", ".join(self.literal() for _ in range(self.random.randrange(1, 8))) + "]")
+                lines.append(f"{pad}for {variable} in {collection} ~")
+                lines.extend(self.block(names + [variable], indent + 1, depth + 1))
+                lines.append(f"{pad}~")
+            elif roll < 0.9:
+                lines.append(pad + self.comment().replace("\n", "\n" + pad))
+            else:
+                lines.append(f"{pad}let {self.name()} = {self.string(self.random.randrange(20, 80))};")
+        return lines
+
+    def function(self):
+        params = [f"{self.random.choice(NAMES)}_p{i}" for i in range(self.random.randrange(0, 5))]
+        declared = []
+        for index, param in enumerate(params):
+            declaration = f"{param}: {self.random.choice(TYPES)}"
+            if index == len(params) - 1 and self.random.random() < 0.4:
+                declaration += f" = {self.literal()}"
+            declared.append(declaration)
+        lines = [f"@ink dive_{len(self.arities)}({', '.join(declared)}) -> {self.random.choice(TYPES)} ~"]
+        lines.extend(self.block(params, 1, 1))
+        lines.append(f"    return {self.expression(params)};")
+        lines.append("~")
+        self.arities.append(len(params))
+        return "\n".join(lines) + "\n\n"
+
+    def top_level(self):
+        roll = self.random.random()
+        if roll < 0.6 or not self.arities:
+            return self.function()
+        if roll < 0.8:
+            return self.comment() + "\n"
+        return "\n".join(self.block([], 0, 1)) + "\n\n"
+
+    def pieces(self, size):
+        """Yield top-level chunks of source until about size bytes were produced."""
+        written = 0
+        while written < size:
+            piece = self.top_level()
+            written += len(piece)
+            yield piece
+
+def generate(size, seed=0):
+    return "".join(ProgramGenerator(seed).pieces(size))
+
+def write_program(path, size, seed=0):
+    """Stream a generated program straight to a file, for sizes that should not sit in memory twice."""
+    with open(path, "w") as f:
+        for piece in ProgramGenerator(seed).pieces(size):
+            f.write(piece)
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Generate a synthetic KrakenScript program")
+    arg_parser.add_argument("size", help="approximate size, e.g. 1KB, 10MB, 500MB")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("-o", "--output", help="file to write (default: stdout)")
+    args = arg_parser.parse_args()
+    size = parse_size(args.size)
+    if args.output:
+        write_program(args.output, size, args.seed)
+    else:
+        for piece in ProgramGenerator(args.seed).pieces(size):
+            sys.stdout.write(piece)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
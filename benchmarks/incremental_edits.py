@@ -0,0 +1,59 @@
+"""Compare per-edit latency of IncrementalDocument with a full lex and parse.
+
+Simulates typing in the middle of a generated program: each edit inserts or
+deletes one character inside a numeric literal.
+
+Usage: python benchmarks/incremental_edits.py [statements] [edits]
+"""
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'compiler'))
+
+from lexer import lex
+from parser import Parser
+from incremental import IncrementalDocument
+from ast_memory import generate_program
+
+def main():
+    statements = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    edits = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    source = generate_program(statements)
+    random.seed(0)
+
+    start = time.perf_counter()
+    document = IncrementalDocument(source)
+    print(f"{statements} statements, {len(document.items)} top-level items, "
+          f"initial parse {time.perf_counter() - start:.3f}s")
+
+    latencies = []
+    for _ in range(edits):
+        # Type a digit into, or delete one from, the "* N +" literal of a random function
+        offset = document.source.index(" + ", random.randrange(len(document.source) // 2)) - 1
+        start = time.perf_counter()
+        if random.random() < 0.5 and document.source[offset - 1].isdigit():
+            document.edit(offset, 1, "")
+        else:
+            document.edit(offset + 1, 0, "7")
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    ast = Parser(lex(document.source)).parse_program()
+    full = time.perf_counter() - start
+    if document.error is not None or [(t.type, t.value, t.line, t.column) for t in document.tokens] != \
+            [(t.type, t.value, t.line, t.column) for t in lex(document.source)] or \
+            len(document.ast.children) != len(ast.children):
+        print("incremental result differs from a full parse")
+        return 1
+
+    median = statistics.median(latencies)
+    print(f"incremental edit: median {median * 1e3:.3f} ms, max {max(latencies) * 1e3:.3f} ms "
+          f"({document.last_edit.relexed_tokens} tokens re-lexed, {document.last_edit.reparsed_items} items re-parsed)")
+    print(f"full reparse:     {full * 1e3:.3f} ms ({full / median:.0f}x slower)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
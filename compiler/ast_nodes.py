@@ -1,3 +1,5 @@
+import sys
+from array import array
 from enum import Enum, auto
 
 class ASTNodeType(Enum):
@@ -17,8 +19,18 @@ class ASTNodeType(Enum):
     BLOCK = auto()
     FUNCTION_CALL = auto()
     BINARY_OPERATION = auto()
+    ARRAY_LITERAL = auto()
+    UNARY_OPERATION = auto()
+    ASSIGNMENT = auto()
+    TEMPLATE_STRING = auto()
+    ANNOTATION = auto()
+    IMPORT = auto()
 
 class ASTNode:
+    # Source position of the node's first token, set only when parsing with positions=True
+    line = None
+    column = None
+
     def __init__(self, node_type, value=None):
         self.type = node_type
         self.value = value
@@ -30,48 +42,147 @@ class ASTNode:
     def __repr__(self):
         return f"ASTNode({self.type}, {self.value}, children={self.children})"
 
-def pretty_print_ast(node, indent=0):
-    indent_str = "  " * indent
-    if node.type == ASTNodeType.FUNCTION_DECLARATION:
-        print(f"{indent_str}{node.type}: {node.value}")
-        for child in node.children:
-            pretty_print_ast(child, indent + 1)
-    elif node.type == ASTNodeType.PARAMETERS:
-        print(f"{indent_str}{node.type}")
-        for child in node.children:
-            pretty_print_ast(child, indent + 1)
-    elif node.type == ASTNodeType.PARAMETER:
-        param_type = node.children[0].value
-        default_value = f" = {node.children[1].value}" if len(node.children) > 1 else ""
-        print(f"{indent_str}{node.type}: {node.value}: {param_type}{default_value}")
-    elif node.type == ASTNodeType.RETURN_TYPE:
-        print(f"{indent_str}{node.type}: {node.value}")
-    elif node.type == ASTNodeType.BLOCK:
-        print(f"{indent_str}{node.type}")
-        if node.children:
-            for child in node.children:
-                pretty_print_ast(child, indent + 1)
+# EXPRESSION nodes carry raw token values: numbers, quoted strings, the
+# boolean words and bare identifier names. These helpers tell them apart.
+def is_name(value):
+    return isinstance(value, str) and not value.startswith('"') and value not in ("true", "false")
+
+def literal_value(value):
+    """Return the runtime value of a literal EXPRESSION value."""
+    if isinstance(value, str):
+        if value.startswith('"'):
+            return value[1:-1]
+        if value == "true":
+            return True
+        if value == "false":
+            return False
+    return value
+
+# Compact AST node types indexed by the codes stored in ASTArena.types
+NODE_TYPES_BY_CODE = tuple(ASTNodeType)
+NODE_TYPE_CODES = {node_type: code for code, node_type in enumerate(NODE_TYPES_BY_CODE)}
+
+class ASTArena:
+    """Flat storage for a whole AST in typed arrays.
+
+    Each node is a row: a type code, an index into an interned value table, and
+    first-child/last-child/next-sibling links. Appending a child is O(1) and no
+    per-node Python object is kept; ArenaNode views are created on access.
+    """
+    def __init__(self):
+        self.types = array('B')
+        self.value_indices = array('l')
+        self.first_child = array('l')
+        self.last_child = array('l')
+        self.next_sibling = array('l')
+        self.values = []
+        self.value_table = {}
+
+    def __len__(self):
+        return len(self.types)
+
+    def new_node(self, node_type, value=None):
+        key = (value.__class__, value)
+        value_index = self.value_table.get(key)
+        if value_index is None:
+            value_index = self.value_table[key] = len(self.values)
+            self.values.append(value)
+        index = len(self.types)
+        self.types.append(NODE_TYPE_CODES[node_type])
+        self.value_indices.append(value_index)
+        self.first_child.append(-1)
+        self.last_child.append(-1)
+        self.next_sibling.append(-1)
+        return ArenaNode(self, index)
+
+    def add_child(self, parent, child):
+        last = self.last_child[parent]
+        if last == -1:
+            self.first_child[parent] = child
+        else:
+            self.next_sibling[last] = child
+        self.last_child[parent] = child
+
+    def child_indices(self, index):
+        child = self.first_child[index]
+        next_sibling = self.next_sibling
+        while child != -1:
+            yield child
+            child = next_sibling[child]
+
+class ArenaNode:
+    """ASTNode-compatible view of one node stored in an ASTArena."""
+    __slots__ = ('arena', 'index')
+
+    def __init__(self, arena, index):
+        self.arena = arena
+        self.index = index
+
+    @property
+    def type(self):
+        return NODE_TYPES_BY_CODE[self.arena.types[self.index]]
+
+    @property
+    def value(self):
+        return self.arena.values[self.arena.value_indices[self.index]]
+
+    @property
+    def children(self):
+        # A fresh list of views; use add_child to modify the tree
+        arena = self.arena
+        return [ArenaNode(arena, child) for child in arena.child_indices(self.index)]
+
+    def add_child(self, child):
+        if not isinstance(child, ArenaNode) or child.arena is not self.arena:
+            raise TypeError("Compact AST nodes can only adopt nodes from the same arena")
+        self.arena.add_child(self.index, child.index)
+
+    def __eq__(self, other):
+        return isinstance(other, ArenaNode) and other.arena is self.arena and other.index == self.index
+
+    def __hash__(self):
+        return hash((id(self.arena), self.index))
+
+    def __repr__(self):
+        return f"ASTNode({self.type}, {self.value}, children={self.children})"
+
+# Node types printed without their value, and types whose children are not printed as nodes
+UNVALUED_TYPES = {ASTNodeType.PARAMETERS, ASTNodeType.BLOCK, ASTNodeType.RETURN_STATEMENT, ASTNodeType.PRINT_STATEMENT,
+                  ASTNodeType.ASSIGNMENT}
+LEAF_TYPES = {ASTNodeType.PARAMETER, ASTNodeType.RETURN_TYPE, ASTNodeType.EXPRESSION}
+# Lines collected before each write to the output stream
+PRINT_BUFFER_LINES = 4096
+
+def pretty_print_ast(node, indent=0, stream=None):
+    """Write an indented outline of the tree to stream (stdout by default).
+
+    Uses an explicit stack, so arbitrarily deep trees print fine, and writes
+    in batches of lines instead of once per node.
+    """
+    stream = stream or sys.stdout
+    type_names = {node_type: str(node_type) for node_type in ASTNodeType}
+    lines = []
+    stack = [(node, indent)]
+    while stack:
+        node, indent = stack.pop()
+        indent_str = "  " * indent
+        node_type = node.type
+        if node_type == ASTNodeType.PARAMETER:
+            children = node.children
+            default_value = f" = {children[1].value}" if len(children) > 1 else ""
+            lines.append(f"{indent_str}{type_names[node_type]}: {node.value}: {children[0].value}{default_value}")
+        elif node_type in UNVALUED_TYPES:
+            lines.append(f"{indent_str}{type_names[node_type]}")
         else:
-            print(f"{indent_str}  Empty")
-    elif node.type == ASTNodeType.RETURN_STATEMENT:
-        print(f"{indent_str}{node.type}")
-        for child in node.children:
-            pretty_print_ast(child, indent + 1)
-    elif node.type == ASTNodeType.BINARY_OPERATION:
-        print(f"{indent_str}{node.type}: {node.value}")
-        for child in node.children:
-            pretty_print_ast(child, indent + 1)
-    elif node.type == ASTNodeType.EXPRESSION:
-        print(f"{indent_str}{node.type}: {node.value}")
-    elif node.type in [ASTNodeType.VARIABLE_DECLARATION, ASTNodeType.CONSTANT_DECLARATION]:
-        print(f"{indent_str}{node.type}: {node.value}")
-        for child in node.children:
-            pretty_print_ast(child, indent + 1)
-    elif node.type == ASTNodeType.PRINT_STATEMENT:
-        print(f"{indent_str}{node.type}")
-        for child in node.children:
-            pretty_print_ast(child, indent + 1)
-    else:
-        print(f"{indent_str}{node.type}: {node.value}")
-        for child in node.children:
-            pretty_print_ast(child, indent + 1)
\ No newline at end of file
+            lines.append(f"{indent_str}{type_names[node_type]}: {node.value}")
+        if node_type not in LEAF_TYPES:
+            children = node.children
+            if not children and node_type == ASTNodeType.BLOCK:
+                lines.append(f"{indent_str}  Empty")
+            for child in reversed(children):
+                stack.append((child, indent + 1))
+        if len(lines) >= PRINT_BUFFER_LINES:
+            stream.write("\n".join(lines) + "\n")
+            lines.clear()
+    if lines:
+        stream.write("\n".join(lines) + "\n")
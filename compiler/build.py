@@ -0,0 +1,366 @@
+import glob
+import hashlib
+import marshal
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from cache import CompilationCache, FORMAT_VERSION, cache_key, dump_ast, load_ast
+from modules import Interface, Module, check_module, find_module, imported_names, module_name
+
+# Bump whenever the layout of the incremental build manifest changes
+MANIFEST_VERSION = 1
+
+class FileResult:
+    """Outcome of compiling one file.
+
+    data holds the AST in the compact .ksc layout rather than an ASTNode
+    graph, which is what crosses the process boundary; ast decodes it on
+    demand. cached files were already up to date and carry no data.
+    """
+    __slots__ = ('path', 'key', 'data', 'error', 'elapsed', 'cached')
+
+    def __init__(self, path, key=None, data=None, error=None, elapsed=0.0, cached=False):
+        self.path = path
+        self.key = key
+        self.data = data
+        self.error = error
+        self.elapsed = elapsed
+        self.cached = cached
+
+    @property
+    def ast(self):
+        return load_ast(self.data, self.key) if self.data is not None else None
+
+class BuildReport:
+    def __init__(self, results, elapsed, jobs):
+        self.results = results
+        self.elapsed = elapsed
+        self.jobs = jobs
+
+    @property
+    def errors(self):
+        return [result for result in self.results if result.error is not None]
+
+    @property
+    def cached(self):
+        return sum(1 for result in self.results if result.cached)
+
+    @property
+    def files_per_second(self):
+        return len(self.results) / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return (f"{len(self.results)} files ({self.cached} cached, {len(self.errors)} errors) "
+                f"in {self.elapsed:.3f}s with {self.jobs} jobs ({self.files_per_second:,.0f} files/s)")
+
+def collect_sources(paths):
+    """Expand files, directories (searched recursively for .ks files) and glob patterns.
+
+    The result is sorted and free of duplicates, so builds always process
+    and report files in the same order.
+    """
+    found = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                found.update(os.path.join(root, name) for name in files if name.endswith(".ks"))
+        elif os.path.isfile(path):
+            found.add(path)
+        else:
+            matches = glob.glob(path, recursive=True)
+            if not matches:
+                raise FileNotFoundError(f"No such file, directory or pattern: {path}")
+            for match in matches:
+                if os.path.isdir(match):
+                    found.update(collect_sources([match]))
+                else:
+                    found.add(match)
+    return sorted(os.path.normpath(path) for path in found)
+
+def compile_file(path, cache_directory=None):
+    from parser import parse
+
+    start = time.perf_counter()
+    try:
+        with open(path, encoding="utf-8") as f:
+            source = f.read()
+        key = cache_key(source)
+        if cache_directory is not None and CompilationCache(cache_directory).contains(key):
+            return FileResult(path, key, elapsed=time.perf_counter() - start, cached=True)
+        data = dump_ast(parse(source), key)
+    except Exception as e:  # Reported per file; one bad script must not stop the build
+        return FileResult(path, error=f"{type(e).__name__}: {e}", elapsed=time.perf_counter() - start)
+    return FileResult(path, key, data, elapsed=time.perf_counter() - start)
+
+def compile_chunk(paths, cache_directory=None):
+    """Worker entry point: one task compiles a whole chunk to amortize the IPC round trip."""
+    return [compile_file(path, cache_directory) for path in paths]
+
+def build(paths, jobs=None, chunk_size=None, cache=None):
+    """Lex and parse every source under paths, in parallel when jobs > 1.
+
+    Results come back in sorted path order regardless of which worker
+    finished first. With a cache, up-to-date files are skipped and fresh
+    results are written to it.
+    """
+    sources = collect_sources(paths)
+    jobs = jobs or os.cpu_count() or 1
+    if chunk_size is None:
+        # A few chunks per worker keeps them busy without one straggler chunk at the end
+        chunk_size = max(1, min(64, len(sources) // (jobs * 4)))
+    chunks = [sources[i:i + chunk_size] for i in range(0, len(sources), chunk_size)]
+    cache_directory = cache.directory if cache is not None else None
+
+    start = time.perf_counter()
+    results = []
+    if jobs == 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            results.extend(compile_chunk(chunk, cache_directory))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for chunk_results in executor.map(compile_chunk, chunks, [cache_directory] * len(chunks)):
+                results.extend(chunk_results)
+
+    if cache is not None:
+        for result in results:
+            if result.cached:
+                cache.hits += 1
+            elif result.data is not None:
+                cache.misses += 1
+                cache.write(result.key, result.data, evict=False)
+        cache.evict()
+    return BuildReport(results, time.perf_counter() - start, jobs)
+
+class ModuleBuildReport:
+    def __init__(self, modules, results, errors, parsed, checked, elapsed):
+        self.modules = modules
+        self.results = results  # A FileResult for each module parsed or checked by this build
+        self.errors = errors  # A FileResult for each module with an error, rebuilt or not
+        self.parsed = parsed
+        self.checked = checked
+        self.elapsed = elapsed
+
+    def summary(self):
+        return (f"{self.modules} modules ({self.parsed} parsed, {self.checked} checked, "
+                f"{len(self.errors)} errors) in {self.elapsed:.3f}s")
+
+def module_roots(paths):
+    """Directories imports are found in: each directory given, or the fixed part of a file path or pattern."""
+    roots = []
+    for path in paths:
+        if not os.path.isdir(path):
+            path = os.path.dirname(path)
+            while glob.has_magic(path):
+                path = os.path.dirname(path)
+        path = os.path.normpath(path or os.curdir)
+        if path not in roots:
+            roots.append(path)
+    return roots
+
+class ModuleBuild:
+    """Parses and checks the modules under paths, and those they import, redoing only what changed.
+
+    A manifest in the cache directory records, per module, the size and
+    modification time of its file, hashes of its source and its Interface,
+    where its imports were found and the interface hash of every import it
+    was last checked against. A file that looks untouched is not even read.
+    A module is parsed again when its source changed, and checked again when
+    it was parsed or an import's interface hash moved, so editing a function
+    body costs one parse and one check however large the tree is. Without a
+    cache nothing is remembered and every module is rebuilt. records, if
+    given, are the manifest entries a previous build left in memory and are
+    used instead of reading the manifest.
+    """
+    def __init__(self, paths, cache=None, records=None):
+        self.paths = paths
+        self.roots = module_roots(paths)
+        self.cache = cache
+        self.manifest = None
+        if cache is not None:
+            digest = hashlib.sha256("\0".join(map(os.path.abspath, self.roots)).encode()).hexdigest()
+            self.manifest = os.path.join(cache.directory, f"modules-{digest[:16]}.manifest")
+        self.records = records  # Path -> manifest entry
+        self.modules = {}  # Path -> Module, for the modules parsed during this build
+        self.results = []
+        self.parsed = 0
+        self.changed = False
+        self.relinked = False  # Whether any module's imports may have changed
+
+    def run(self):
+        start = time.perf_counter()
+        if self.records is None:
+            self.records = self.load_manifest()
+        records = self.records
+        pending = collect_sources(self.paths)
+        seen = set(pending)
+        while pending:
+            path = pending.pop()
+            record = self.refresh(path, records.get(path))
+            if record is None:
+                records.pop(path, None)  # An imported file that no longer exists
+                continue
+            records[path] = record
+            for dependency in record['imports'].values():
+                if dependency is not None and dependency not in seen:
+                    seen.add(dependency)
+                    pending.append(dependency)
+        for path in records.keys() - seen:
+            del records[path]
+            self.changed = self.relinked = True
+
+        if self.relinked:
+            cyclic = self.cycles()
+            for path, record in records.items():
+                record['cyclic'] = path in cyclic
+        checked = sum(self.check(path) for path in sorted(records))
+        if self.changed and self.manifest is not None:
+            self.save_manifest()
+        if self.cache is not None and self.cache.stores:
+            self.cache.evict()
+        errors = [FileResult(path, error=record['error']) for path, record in sorted(records.items()) if record['error']]
+        return ModuleBuildReport(len(records), self.results, errors, self.parsed, checked, time.perf_counter() - start)
+
+    def refresh(self, path, record):
+        """The up-to-date manifest entry for path, parsing the file if its source changed; None if it is gone."""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if record is not None and record['mtime'] == stat.st_mtime_ns and record['size'] == stat.st_size:
+            return record
+        with open(path, encoding="utf-8") as f:
+            source = f.read()
+        digest = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        self.changed = True
+        if record is not None and record['source'] == digest:
+            record['mtime'], record['size'] = stat.st_mtime_ns, stat.st_size  # Touched, not edited
+            return record
+        record = {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'source': digest, 'interface': None,
+                  'digest': None, 'imports': {}, 'checked': None, 'cyclic': False, 'error': None}
+        self.parsed += 1
+        self.relinked = True
+        self.parse(path, source, record)
+        return record
+
+    def parse(self, path, source, record):
+        from parser import parse
+
+        try:
+            ast = self.cache.load(source) if self.cache is not None else None
+            if ast is None:
+                ast = parse(source)
+                if self.cache is not None:
+                    key = cache_key(source)
+                    self.cache.write(key, dump_ast(ast, key), evict=False)  # Evicted once, after the build
+        except Exception as e:  # Reported per module; one bad module must not stop the build
+            record.update(interface=None, digest=None, imports={}, checked=None, error=f"{type(e).__name__}: {e}")
+            self.results.append(FileResult(path, error=record['error']))
+            return None
+        imports = {}
+        for name in imported_names(ast):
+            try:
+                imports[name] = find_module(name, self.roots)
+            except ImportError:
+                imports[name] = None
+        interface = Interface.of(ast)
+        record.update(interface=interface.to_dict(), digest=interface.digest, imports=imports)
+        module = self.modules[path] = Module(module_name(path, self.roots), path, ast, imports, interface)
+        return module
+
+    def digest(self, path):
+        record = self.records.get(path) if path is not None else None
+        return record['digest'] if record is not None else None
+
+    def cycles(self):
+        """Paths of the modules in, or importing something in, a cycle of imports.
+
+        Modules whose imports all lie outside a cycle are peeled off until
+        nothing more can be; whatever is left is caught in one.
+        """
+        records = self.records
+        dependents = {path: [] for path in records}
+        waiting = {}
+        for path, record in records.items():
+            dependencies = {dependency for dependency in record['imports'].values() if dependency in records}
+            waiting[path] = len(dependencies)
+            for dependency in dependencies:
+                dependents[dependency].append(path)
+        ready = [path for path, count in waiting.items() if count == 0]
+        while ready:
+            for dependent in dependents[ready.pop()]:
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    ready.append(dependent)
+        return {path for path, count in waiting.items() if count > 0}
+
+    def check(self, path):
+        """Check one module if it is new or an import's interface changed; return whether it was checked."""
+        record = self.records[path]
+        cyclic = record['cyclic']
+        if record['interface'] is None:
+            return False  # It did not parse
+        imports = record['imports']
+        module = self.modules.get(path)
+        if module is None and not cyclic and None not in imports.values() \
+                and record['checked'] == {name: self.digest(dependency) for name, dependency in imports.items()}:
+            return False
+        start = time.perf_counter()
+        if module is None:
+            with open(path, encoding="utf-8") as f:
+                module = self.parse(path, f.read(), record)  # A cache hit, and imports are found again
+            if module is None:
+                return True
+        error = None
+        if cyclic:
+            error = f"ImportError: '{module.name}' is part of, or imports, a cycle of imports"
+        else:
+            interfaces = {}
+            for name, dependency in module.imports.items():
+                if dependency is None or dependency not in self.records:
+                    error = f"ImportError: No module named '{name}'"
+                    break
+                if self.digest(dependency) is None:
+                    error = f"ImportError: Module '{name}' failed to parse"
+                    break
+                interfaces[name] = Interface.from_dict(self.records[dependency]['interface'])
+            if error is None:
+                try:
+                    check_module(module, interfaces)
+                except (SyntaxError, NameError, TypeError, ImportError) as e:
+                    error = f"{type(e).__name__}: {e}"
+        record['error'] = error
+        record['checked'] = None if cyclic else {name: self.digest(dependency)
+                                                 for name, dependency in module.imports.items()}
+        self.changed = True
+        self.results.append(FileResult(path, error=error, elapsed=time.perf_counter() - start))
+        return True
+
+    def load_manifest(self):
+        from main import VERSION
+
+        if self.manifest is None:
+            return {}
+        try:
+            with open(self.manifest, "rb") as f:
+                version, records = marshal.loads(f.read())
+        except (OSError, ValueError, EOFError, TypeError):
+            return {}
+        if version != (MANIFEST_VERSION, VERSION, FORMAT_VERSION):
+            return {}
+        return records
+
+    def save_manifest(self):
+        """Atomically replace the manifest, like CompilationCache.write does its entries."""
+        from main import VERSION
+
+        directory = os.path.dirname(self.manifest)
+        os.makedirs(directory, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(marshal.dumps(((MANIFEST_VERSION, VERSION, FORMAT_VERSION), self.records)))
+            os.replace(temporary, self.manifest)
+        except BaseException:
+            self.cache.remove(temporary)
+            raise
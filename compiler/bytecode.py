@@ -0,0 +1,487 @@
+from array import array
+from bisect import bisect_right
+from enum import IntEnum, auto
+from functools import partial
+from ast_nodes import ASTNodeType, is_name, literal_value
+from resolver import Resolver, GLOBAL_DEPTH
+from memoize import PurityAnalysis
+from typecheck import TypeInference, STR_FORMATTED_TYPES, EXACT_TYPES, infer_types
+
+class Opcode(IntEnum):
+    LOAD_CONST = auto()
+    LOAD_LOCAL = auto()
+    STORE_LOCAL = auto()
+    LOAD_GLOBAL = auto()
+    STORE_GLOBAL = auto()
+    ADD = auto()
+    SUB = auto()
+    MUL = auto()
+    DIV = auto()
+    LT = auto()
+    GT = auto()
+    LE = auto()
+    GE = auto()
+    EQ = auto()
+    NE = auto()
+    NEG = auto()
+    NOT = auto()
+    JUMP = auto()
+    JUMP_IF_FALSE = auto()
+    JUMP_IF_FALSE_OR_POP = auto()
+    JUMP_IF_TRUE_OR_POP = auto()
+    GET_ITER = auto()
+    FOR_ITER = auto()
+    VECTOR_LOOP = auto()
+    CALL = auto()
+    COMPILE_FUNCTION = auto()
+    CALL_BUILTIN = auto()
+    RETURN = auto()
+    PRINT = auto()
+    PRINT_STR = auto()
+    POP = auto()
+    DUP = auto()
+    BUILD_ARRAY = auto()
+    BUILD_STRING = auto()
+    HALT = auto()
+    # Only in programs compiled for a RuntimeProfile
+    LINE = auto()
+    ENTER = auto()
+    LEAVE = auto()
+
+BINARY_OPCODES = {
+    '+': Opcode.ADD,
+    '-': Opcode.SUB,
+    '*': Opcode.MUL,
+    '/': Opcode.DIV,
+    '<': Opcode.LT,
+    '>': Opcode.GT,
+    '<=': Opcode.LE,
+    '>=': Opcode.GE,
+    '==': Opcode.EQ,
+    '!=': Opcode.NE,
+}
+
+UNARY_OPCODES = {
+    '-': Opcode.NEG,
+    '!': Opcode.NOT,
+}
+
+# Logical operators skip their right operand when the left one decides the
+# result, which is then left on the stack as the value of the expression
+SHORT_CIRCUIT_OPCODES = {
+    '&&': Opcode.JUMP_IF_FALSE_OR_POP,
+    '||': Opcode.JUMP_IF_TRUE_OR_POP,
+}
+
+# Functions callable from KrakenScript without an @ink declaration. The index
+# in this list is the CALL_BUILTIN operand.
+BUILTINS = [
+    ('len', len),
+    ('range', lambda *args: list(range(*args))),
+]
+BUILTIN_SLOTS = {name: index for index, (name, function) in enumerate(BUILTINS)}
+
+# CALL_BUILTIN packs the builtin index and the argument count into one operand
+BUILTIN_ARGC_BITS = 8
+
+class CodeObject:
+    """Bytecode for one @ink function (or the top-level program).
+
+    Instructions are fixed width: every opcode is followed by one integer
+    operand (0 when unused), so code[pc] is always an opcode.
+    """
+    def __init__(self, name, param_names=()):
+        self.name = name
+        self.code = array('l')
+        self.param_count = len(param_names)
+        self.local_names = list(param_names)
+        self.local_slots = {param: slot for slot, param in enumerate(param_names)}
+        self.defaults = []  # Default EXPRESSION nodes for trailing parameters
+        self.memoize = False
+        self.memo_exclusion = None  # Why the function's results are not memoized
+        self.compile_body = None  # Set while a lazily compiled body waits for its first call
+        self.param_types = None  # Inferred types of the arguments every call passes, if known
+        self.return_type = None
+        self.line_offsets = []  # Where each statement's code starts, when compiled for a RuntimeProfile
+        self.line_numbers = []
+
+    def line_at(self, offset):
+        """Source line of the statement whose code holds offset, if lines were recorded."""
+        index = bisect_right(self.line_offsets, offset) - 1
+        return self.line_numbers[index] if index >= 0 else None
+
+    @property
+    def exact_args(self):
+        """Whether each argument always has the same class, so memo keys need not record classes."""
+        return self.param_types is not None and all(type_ in EXACT_TYPES for type_ in self.param_types)
+
+    @property
+    def local_count(self):
+        return len(self.local_names)
+
+    def emit(self, opcode, arg=0):
+        offset = len(self.code)
+        self.code.append(opcode)
+        self.code.append(arg)
+        return offset
+
+    def patch(self, offset, target):
+        self.code[offset + 1] = target
+
+class Program:
+    """Everything the VM needs: the constant pool, globals and code objects."""
+    def __init__(self):
+        self.constants = []
+        self.constant_slots = {}
+        self.global_names = []
+        self.global_slots = {}
+        self.functions = []
+        self.function_slots = {}
+        self.kernels = []  # LoopKernels, indexed by the VECTOR_LOOP operand
+        self.main = CodeObject("<program>")
+        self.lines = []  # (function name, line) pairs, indexed by the LINE operand
+        self.line_slots = {}
+
+    def line(self, name, line):
+        key = (name, line)
+        slot = self.line_slots.get(key)
+        if slot is None:
+            slot = self.line_slots[key] = len(self.lines)
+            self.lines.append(key)
+        return slot
+
+    def constant(self, value):
+        key = (value.__class__, value)
+        slot = self.constant_slots.get(key)
+        if slot is None:
+            slot = self.constant_slots[key] = len(self.constants)
+            self.constants.append(value)
+        return slot
+
+class BytecodeCompiler:
+    """Lowers a PROGRAM AST into a Program of integer-opcode CodeObjects.
+
+    Top-level variables become globals; parameters and variables declared
+    inside an @ink body become local slots of that function's frame. Slots
+    are the addresses the Resolver assigned.
+
+    With vectorize=True, for loops the LoopVectorizer accepts are preceded
+    by a VECTOR_LOOP that runs them on NumPy arrays and jumps past them, or
+    falls through to the scalar loops when their values do not allow it.
+
+    Type errors (see TypeInference) are raised before anything is
+    compiled. Types inferred from the whole program then pick specialized
+    instructions: printing a number or a string skips format_value, and
+    functions whose arguments always have the same classes get memo keys
+    without the classes in them.
+
+    With lazy=True, every @ink body is left unresolved and uncompiled: its
+    code is a single COMPILE_FUNCTION, which compiles the body (parsing it
+    too, if it is a LazyBlock) on the first call. Errors in a body then
+    surface at that call instead of before the program starts, and nothing
+    is specialized, since types cannot be proven without every body.
+
+    Given a RuntimeProfile, the compiler records where each statement's code
+    starts (the AST must carry positions) and, unless the profile samples,
+    emits a LINE before every statement and brackets every body with ENTER
+    and LEAVE so the VM can count and time them.
+    """
+    def __init__(self, vectorize=False, lazy=False, profile=None):
+        self.program = Program()
+        self.vectorize = vectorize
+        self.vectorizer = None
+        self.lazy = lazy
+        self.record_lines = profile is not None
+        self.instrument = profile is not None and not profile.sample_interval
+
+    def compile(self, program_node):
+        program = self.program
+        self.resolver = Resolver(BUILTIN_SLOTS)
+        self.resolution = self.resolver.resolve(program_node, self.lazy)
+        self.resolution.check()
+        self.addresses = self.resolution.addresses
+        self.typing = TypeInference(program_node, self.addresses, lazy=self.lazy).run()
+        self.typing.check()
+        self.proven = None if self.lazy else infer_types(program_node, self.addresses)
+        self.types = {} if self.proven is None else self.proven.types
+        for slot, name in enumerate(self.resolution.frames[program_node].slot_names):
+            program.global_slots[name] = slot
+            program.global_names.append(name)
+        functions = []
+        # Declare every function first so calls may precede declarations
+        for child in program_node.children:
+            if child.type == ASTNodeType.FUNCTION_DECLARATION:
+                functions.append((child, self.declare_function(child)))
+        self.purity = PurityAnalysis(program_node, self.addresses, self.resolve_function if self.lazy else None)
+        if self.vectorize:
+            from vectorize import LoopVectorizer
+            self.vectorizer = LoopVectorizer(self.addresses, program.function_slots)
+
+        main = program.main
+        if self.instrument:
+            main.emit(Opcode.ENTER, -1)
+        self.compile_block([child for child in program_node.children
+                            if child.type != ASTNodeType.FUNCTION_DECLARATION], main)
+        if self.instrument:
+            main.emit(Opcode.LEAVE)
+        main.emit(Opcode.HALT)
+
+        for node, code in functions:
+            if self.lazy:
+                code.code = array('l', [Opcode.COMPILE_FUNCTION, program.function_slots[node.value]])
+                code.compile_body = partial(self.compile_function, node, code)
+            else:
+                self.compile_function(node, code)
+        return program
+
+    def resolve_function(self, node):
+        """Resolve a lazily compiled body, once, raising its first resolution error."""
+        frames = self.resolution.frames
+        if node in frames:
+            return
+        errors = self.resolution.errors
+        count = len(errors)
+        self.resolver.resolve_function(node)
+        if len(errors) > count:
+            del frames[node]  # Raise again if anything asks for this body later
+            raise errors[count]
+
+    def compile_function(self, node, code):
+        self.resolve_function(node)
+        if self.lazy:
+            self.typing.check_function(node)
+        else:
+            code.param_types = self.proven.params[node.value]
+            code.return_type = self.proven.returns[node.value]
+        for name in self.resolution.frames[node].slot_names[code.param_count:]:
+            code.local_slots[name] = len(code.local_names)
+            code.local_names.append(name)
+        code.memo_exclusion = self.purity.exclusion(node.value)
+        code.memoize = code.memo_exclusion is None
+        code.code = array('l')
+        if self.instrument:
+            code.emit(Opcode.ENTER, self.program.function_slots[node.value])
+        self.compile_statement(node.children[2], code)
+        code.emit(Opcode.LOAD_CONST, self.program.constant(None))
+        if self.instrument:
+            code.emit(Opcode.LEAVE)
+        code.emit(Opcode.RETURN)
+        code.compile_body = None
+
+    def declare_function(self, node):
+        if node.value in self.program.function_slots:
+            raise SyntaxError(f"Function '{node.value}' is declared more than once")
+        params = node.children[0].children
+        code = CodeObject(node.value, [param.value for param in params])
+        code.defaults = [param.children[1] for param in params if len(param.children) > 1]
+        self.program.function_slots[node.value] = len(self.program.functions)
+        self.program.functions.append(code)
+        return code
+
+    def compile_block(self, statements, code):
+        if self.vectorizer is None:
+            for statement in statements:
+                self.compile_statement(statement, code)
+            return
+        index = 0
+        while index < len(statements):
+            kernel = None
+            if statements[index].type == ASTNodeType.FOR_LOOP:
+                kernel = self.vectorizer.plan(statements, index)
+            if kernel is None:
+                self.compile_statement(statements[index], code)
+                index += 1
+                continue
+            code.emit(Opcode.VECTOR_LOOP, len(self.program.kernels))
+            self.program.kernels.append(kernel)
+            for loop in statements[index:index + len(kernel.loops)]:
+                self.compile_statement(loop, code)
+            kernel.end = len(code.code)
+            index += len(kernel.loops)
+
+    def compile_statement(self, node, code):
+        node_type = node.type
+        if self.record_lines and node_type != ASTNodeType.BLOCK:
+            self.mark_line(node, code)
+        if node_type == ASTNodeType.BLOCK:
+            self.compile_block(node.children, code)
+        elif node_type in (ASTNodeType.VARIABLE_DECLARATION, ASTNodeType.CONSTANT_DECLARATION):
+            self.compile_expression(node.children[0], code)
+            self.compile_store(node, code)
+        elif node_type == ASTNodeType.ASSIGNMENT:
+            target, value = node.children
+            self.compile_expression(value, code)
+            self.compile_store(target, code)
+        elif node_type == ASTNodeType.PRINT_STATEMENT:
+            value = node.children[0]
+            self.compile_expression(value, code)
+            code.emit(Opcode.PRINT_STR if self.types.get(value) in STR_FORMATTED_TYPES else Opcode.PRINT)
+        elif node_type == ASTNodeType.RETURN_STATEMENT:
+            self.compile_expression(node.children[0], code)
+            if self.instrument:
+                code.emit(Opcode.LEAVE)
+            code.emit(Opcode.RETURN)
+        elif node_type == ASTNodeType.IF_STATEMENT:
+            children = node.children
+            self.compile_expression(children[0], code)
+            jump_to_else = code.emit(Opcode.JUMP_IF_FALSE)
+            self.compile_statement(children[1], code)
+            if len(children) > 2:
+                jump_to_end = code.emit(Opcode.JUMP)
+                code.patch(jump_to_else, len(code.code))
+                self.compile_statement(children[2], code)
+                code.patch(jump_to_end, len(code.code))
+            else:
+                code.patch(jump_to_else, len(code.code))
+        elif node_type == ASTNodeType.FOR_LOOP:
+            variable, collection, body = node.children
+            self.compile_expression(collection, code)
+            code.emit(Opcode.GET_ITER)
+            loop_start = code.emit(Opcode.FOR_ITER)
+            self.compile_store(variable, code)
+            self.compile_statement(body, code)
+            code.emit(Opcode.JUMP, loop_start)
+            code.patch(loop_start, len(code.code))
+        elif node_type == ASTNodeType.FUNCTION_DECLARATION:
+            raise SyntaxError(f"Function '{node.value}' must be declared at the top level")
+        else:
+            # Expression statement; its value is discarded
+            self.compile_expression(node, code)
+            code.emit(Opcode.POP)
+
+    def compile_expression(self, node, code):
+        node_type = node.type
+        if node_type == ASTNodeType.EXPRESSION:
+            if is_name(node.value):
+                self.compile_load(node, code)
+            else:
+                code.emit(Opcode.LOAD_CONST, self.program.constant(literal_value(node.value)))
+        elif node_type == ASTNodeType.BINARY_OPERATION:
+            left, right = node.children
+            if node.value in SHORT_CIRCUIT_OPCODES:
+                self.compile_expression(left, code)
+                jump_to_end = code.emit(SHORT_CIRCUIT_OPCODES[node.value])
+                self.compile_expression(right, code)
+                code.patch(jump_to_end, len(code.code))
+                return
+            opcode = BINARY_OPCODES.get(node.value)
+            if opcode is None:
+                raise SyntaxError(f"Unsupported operator '{node.value}'")
+            self.compile_expression(left, code)
+            self.compile_expression(right, code)
+            code.emit(opcode)
+        elif node_type == ASTNodeType.UNARY_OPERATION:
+            opcode = UNARY_OPCODES.get(node.value)
+            if opcode is None:
+                raise SyntaxError(f"Unsupported operator '{node.value}'")
+            self.compile_expression(node.children[0], code)
+            code.emit(opcode)
+        elif node_type == ASTNodeType.ASSIGNMENT:
+            # An assignment's value is the value assigned
+            target, value = node.children
+            self.compile_expression(value, code)
+            code.emit(Opcode.DUP)
+            self.compile_store(target, code)
+        elif node_type == ASTNodeType.FUNCTION_CALL:
+            self.compile_call(node, code)
+        elif node_type == ASTNodeType.ARRAY_LITERAL:
+            for element in node.children:
+                self.compile_expression(element, code)
+            code.emit(Opcode.BUILD_ARRAY, len(node.children))
+        elif node_type == ASTNodeType.TEMPLATE_STRING:
+            for segment in node.children:
+                self.compile_expression(segment, code)
+            code.emit(Opcode.BUILD_STRING, len(node.children))
+        else:
+            raise SyntaxError(f"Cannot compile {node.type} as an expression")
+
+    def compile_call(self, node, code):
+        name = node.value
+        args = node.children
+        function_slot = self.program.function_slots.get(name)
+        if function_slot is None:
+            builtin_slot = BUILTIN_SLOTS.get(name)
+            if builtin_slot is None:
+                raise NameError(f"Call to undefined function '{name}'")
+            for arg in args:
+                self.compile_expression(arg, code)
+            code.emit(Opcode.CALL_BUILTIN, (builtin_slot << BUILTIN_ARGC_BITS) | len(args))
+            return
+
+        function = self.program.functions[function_slot]
+        required = function.param_count - len(function.defaults)
+        if not required <= len(args) <= function.param_count:
+            raise TypeError(f"{name}() takes {function.param_count} arguments ({required} required), got {len(args)}")
+        for arg in args:
+            self.compile_expression(arg, code)
+        # Missing trailing arguments are filled in from the declared defaults
+        for default in function.defaults[len(args) - required:]:
+            self.compile_expression(default, code)
+        code.emit(Opcode.CALL, function_slot)
+
+    def compile_load(self, node, code):
+        depth, slot = self.addresses[node]
+        code.emit(Opcode.LOAD_GLOBAL if depth == GLOBAL_DEPTH else Opcode.LOAD_LOCAL, slot)
+
+    def compile_store(self, node, code):
+        depth, slot = self.addresses[node]
+        code.emit(Opcode.STORE_GLOBAL if depth == GLOBAL_DEPTH else Opcode.STORE_LOCAL, slot)
+
+    def mark_line(self, node, code):
+        line = getattr(node, 'line', None)  # Trees without positions (cached, compact) have no lines
+        if line is None:
+            return
+        if not code.line_offsets or code.line_offsets[-1] != len(code.code):
+            code.line_offsets.append(len(code.code))
+            code.line_numbers.append(line)
+        else:
+            code.line_numbers[-1] = line  # An empty statement before this one left no code
+        if self.instrument:
+            code.emit(Opcode.LINE, self.program.line(code.name, line))
+
+def compile_program(program_node, vectorize=False, lazy=False, profile=None):
+    return BytecodeCompiler(vectorize, lazy, profile).compile(program_node)
+
+def disassemble_code(program, code):
+    lines = []
+    params = code.local_names[:code.param_count]
+    returns = ""
+    if code.param_types is not None:
+        params = [f"{name}: {type_ or 'Any'}" for name, type_ in zip(params, code.param_types)]
+        returns = f" -> {code.return_type or 'Any'}"
+    lines.append(f"== {code.name}({', '.join(params)}){returns} locals={code.local_count} ==")
+    instructions = code.code
+    for offset in range(0, len(instructions), 2):
+        opcode = Opcode(instructions[offset])
+        arg = instructions[offset + 1]
+        detail = ""
+        if opcode == Opcode.LOAD_CONST:
+            detail = repr(program.constants[arg])
+        elif opcode in (Opcode.LOAD_LOCAL, Opcode.STORE_LOCAL):
+            detail = code.local_names[arg]
+        elif opcode in (Opcode.LOAD_GLOBAL, Opcode.STORE_GLOBAL):
+            detail = program.global_names[arg]
+        elif opcode == Opcode.CALL:
+            detail = program.functions[arg].name
+        elif opcode == Opcode.CALL_BUILTIN:
+            detail = f"{BUILTINS[arg >> BUILTIN_ARGC_BITS][0]}, argc={arg & ((1 << BUILTIN_ARGC_BITS) - 1)}"
+        elif opcode in (Opcode.JUMP, Opcode.JUMP_IF_FALSE, Opcode.JUMP_IF_FALSE_OR_POP,
+                        Opcode.JUMP_IF_TRUE_OR_POP, Opcode.FOR_ITER):
+            detail = f"to {arg}"
+        elif opcode == Opcode.VECTOR_LOOP:
+            kernel = program.kernels[arg]
+            detail = f"{len(kernel.loops)} loop{'s' if len(kernel.loops) > 1 else ''}, to {kernel.end}"
+        elif opcode == Opcode.LINE:
+            detail = f"line {program.lines[arg][1]}"
+        elif opcode == Opcode.ENTER:
+            detail = program.functions[arg].name if arg >= 0 else program.main.name
+        lines.append(f"{offset:6} {opcode.name:<14} {arg:<6} {f'({detail})' if detail else ''}".rstrip())
+    return lines
+
+def disassemble(program):
+    """Human-readable listing of every code object in a Program."""
+    lines = disassemble_code(program, program.main)
+    for code in program.functions:
+        lines.append("")
+        lines.extend(disassemble_code(program, code))
+    return "\n".join(lines)
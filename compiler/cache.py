@@ -0,0 +1,195 @@
+import hashlib
+import importlib.util
+import marshal
+import mmap
+import os
+import struct
+import tempfile
+from serialize import dump_binary, load_binary
+
+# Bump whenever the .ksc layout or the shape of the AST changes
+FORMAT_VERSION = 8
+MAGIC = b"KSC\0"
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+
+# magic, format version, key digest
+HEADER = struct.Struct("=4sH2x32s")
+
+# Transpiled CPython code objects share the directory under keys of their own
+CODE_MAGIC = b"KSP\0"
+
+def default_cache_directory():
+    return os.environ.get("KRAKENSCRIPT_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "krakenscript")
+
+def cache_key(source):
+    """Content address of a source file: its hash plus everything that shapes the cached AST."""
+    from main import VERSION
+    digest = hashlib.sha256(f"{VERSION}\0{FORMAT_VERSION}\0".encode())
+    digest.update(source.encode("utf-8"))
+    return digest.digest()
+
+def code_cache_key(source, filename, options=""):
+    """Like cache_key, plus what a marshalled code object depends on: the
+    Python bytecode version, the file name tracebacks show and the options
+    (such as optimization passes) it was transpiled with."""
+    from main import VERSION
+    digest = hashlib.sha256(f"{VERSION}\0{FORMAT_VERSION}\0{importlib.util.MAGIC_NUMBER.hex()}\0"
+                            f"{filename}\0{options}\0".encode())
+    digest.update(source.encode("utf-8"))
+    return digest.digest()
+
+def dump_ast(root, key):
+    """The .ksc layout: a header carrying the cache key, then the binary AST."""
+    return HEADER.pack(MAGIC, FORMAT_VERSION, key) + dump_binary(root)
+
+def load_ast(buffer, key):
+    """Rebuild an AST from a .ksc buffer, or raise ValueError if it is stale or damaged."""
+    try:
+        magic, version, stored_key = HEADER.unpack_from(buffer)
+    except struct.error:
+        raise ValueError("Truncated cache entry") from None
+    if magic != MAGIC or version != FORMAT_VERSION or stored_key != key:
+        raise ValueError("Stale or foreign cache entry")
+    return load_binary(buffer, HEADER.size)
+
+class CompilationCache:
+    """Content-addressed on-disk cache of parsed programs (.ksc files).
+
+    Entries are named after cache_key(source), written atomically so that
+    concurrent compilers never see a partial file, and evicted least recently
+    used first once the directory grows past max_bytes.
+    """
+    def __init__(self, directory=None, max_bytes=DEFAULT_CACHE_SIZE):
+        self.directory = directory or default_cache_directory()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key.hex() + ".ksc")
+
+    def load(self, source):
+        """Return the cached AST for source, or None on a miss."""
+        key = cache_key(source)
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                ast = load_ast(mapped, key)
+        except (OSError, ValueError) as e:
+            if isinstance(e, ValueError):
+                self.remove(path)
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)  # Mark as recently used for eviction
+        except OSError:
+            pass
+        self.hits += 1
+        return ast
+
+    def contains(self, key):
+        """Cheap check for an entry with a valid header, without loading it."""
+        try:
+            with open(self.path(key), "rb") as f:
+                header = f.read(HEADER.size)
+        except OSError:
+            return False
+        return len(header) == HEADER.size and HEADER.unpack(header) == (MAGIC, FORMAT_VERSION, key)
+
+    def load_code(self, key):
+        """Return the cached code object for a code_cache_key, or None on a miss."""
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            if data[:HEADER.size] != HEADER.pack(CODE_MAGIC, FORMAT_VERSION, key):
+                raise ValueError("Stale or foreign cache entry")
+            code = marshal.loads(memoryview(data)[HEADER.size:])
+        except (OSError, ValueError, EOFError, TypeError) as e:
+            if not isinstance(e, OSError):
+                self.remove(path)
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return code
+
+    def store_code(self, key, code):
+        self.write(key, HEADER.pack(CODE_MAGIC, FORMAT_VERSION, key) + marshal.dumps(code))
+
+    def store(self, source, ast):
+        key = cache_key(source)
+        self.write(key, dump_ast(ast, key))
+
+    def write(self, key, data, evict=True):
+        """Atomically install an already serialized entry."""
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temporary, self.path(key))
+        except BaseException:
+            self.remove(temporary)
+            raise
+        self.stores += 1
+        if evict:
+            self.evict()
+
+    def parse(self, source):
+        """Parse source, skipping the lexer and parser entirely on a cache hit."""
+        ast = self.load(source)
+        if ast is None:
+            from parser import parse
+            ast = parse(source)
+            self.store(source, ast)
+        return ast
+
+    def entries(self):
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith(".ksc"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue  # Evicted by another process meanwhile
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes."""
+        entries = self.entries()
+        total = sum(size for mtime, size, path in entries)
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if self.remove(path):
+                self.evictions += 1
+            total -= size
+
+    def clear(self):
+        if os.path.isdir(self.directory):
+            for mtime, size, path in self.entries():
+                self.remove(path)
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def report(self):
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups * 100 if lookups else 0.0
+        return (f"cache {self.directory}: {self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate), "
+                f"{self.stores} stores, {self.evictions} evictions")
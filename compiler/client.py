@@ -0,0 +1,174 @@
+"""Thin command line client for the compile server started by main.py serve.
+
+It imports nothing from the compiler (not even argparse), so a request
+costs little more than Python's own startup and one socket round trip:
+
+    python compiler/client.py parse examples/vm/functions.ks
+    python compiler/client.py --start build --incremental src/
+"""
+import json
+import os
+import socket
+import sys
+import time
+
+USAGE = """usage: client.py [--socket PATH] [--start] [--time] COMMAND [ARGS]
+
+commands:
+  lex FILE...                      token count of each file
+  parse [--format F] FILE...       parse each file; F is summary (default), text or jsonl
+  build [--incremental] PATH...    like main.py build, run by the server
+  ping                             show the server's state
+  stop                             shut the server down
+
+--start launches a server when none is listening; --time reports the round trip."""
+
+# Seconds --start waits for a freshly launched server to listen
+START_TIMEOUT = 10.0
+
+def default_socket_path():
+    """$KRAKENSCRIPT_SOCKET, else server.sock in the cache directory (see cache.default_cache_directory)."""
+    directory = os.environ.get("KRAKENSCRIPT_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "krakenscript")
+    return os.environ.get("KRAKENSCRIPT_SOCKET") or os.path.join(directory, "server.sock")
+
+class CompileClient:
+    """One connection to the compile server, which answers JSON-lines requests in any order.
+
+    Every request is a JSON object with an op; the response carries the
+    request's id, ok, and either result or error.
+    """
+    def __init__(self, path=None):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(path or default_socket_path())
+        self.stream = self.socket.makefile("rwb")
+        self.next_id = 0
+
+    def close(self):
+        self.stream.close()
+        self.socket.close()
+
+    def batch(self, requests):
+        """Send every request at once, then return their responses in request order."""
+        ids = []
+        for request in requests:
+            self.next_id += 1
+            ids.append(self.next_id)
+            self.stream.write(json.dumps({**request, 'id': self.next_id}).encode() + b"\n")
+        self.stream.flush()
+        responses = {}
+        while len(responses) < len(ids):
+            line = self.stream.readline()
+            if not line:
+                raise ConnectionError("The compile server closed the connection")
+            response = json.loads(line)
+            responses[response['id']] = response
+        return [responses[request_id] for request_id in ids]
+
+    def request(self, op, **params):
+        return self.batch([{'op': op, **params}])[0]
+
+def connect(path, start):
+    try:
+        return CompileClient(path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        if not start:
+            raise
+    import subprocess
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"), "serve"]
+    if path:
+        command += ["--socket", path]
+    subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+    deadline = time.monotonic() + START_TIMEOUT
+    while True:
+        try:
+            return CompileClient(path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.02)
+
+def requests_for(command, args):
+    """Turn a command line into server requests. Paths are made absolute, since the server has its own cwd."""
+    if command in ("lex", "parse"):
+        options = {}
+        if command == "parse" and args[:1] == ["--format"]:
+            options['format'] = args[1]
+            args = args[2:]
+        return [{'op': command, 'path': os.path.abspath(path), **options} for path in args]
+    if command == "build":
+        incremental = "--incremental" in args
+        paths = [os.path.abspath(path) for path in args if path != "--incremental"]
+        return [{'op': 'build', 'paths': paths, 'incremental': incremental}]
+    if command == "ping":
+        return [{'op': 'ping'}]
+    if command == "stop":
+        return [{'op': 'shutdown'}]
+    raise ValueError(f"Unknown command: {command}")
+
+def show(command, request, response):
+    """Print one response; return whether it reported a failure."""
+    if not response['ok']:
+        print(f"error: {request.get('path', command)}: {response['error']}", file=sys.stderr)
+        return True
+    result = response['result']
+    if command == "lex":
+        print(f"{request['path']}: {len(result['tokens'])} tokens")
+    elif command == "parse":
+        if 'ast' in result:
+            sys.stdout.write(result['ast'])
+        else:
+            print(f"{request['path']}: {result['nodes']} nodes")
+    elif command == "build":
+        for path, error in result['errors']:
+            print(f"error: {path}: {error}", file=sys.stderr)
+        print(result['summary'])
+        return bool(result['errors'])
+    else:
+        for key, value in result.items():
+            print(f"{key}: {value}")
+    return False
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    path = None
+    start = timed = False
+    while argv and argv[0].startswith("--"):
+        option = argv.pop(0)
+        if option == "--socket" and argv:
+            path = argv.pop(0)
+        elif option == "--start":
+            start = True
+        elif option == "--time":
+            timed = True
+        else:
+            print(USAGE, file=sys.stderr)
+            return 2
+    if not argv:
+        print(USAGE, file=sys.stderr)
+        return 2
+    command = argv.pop(0)
+    try:
+        requests = requests_for(command, argv)
+    except (ValueError, IndexError):
+        print(USAGE, file=sys.stderr)
+        return 2
+    try:
+        client = connect(path, start)
+    except OSError as e:
+        print(f"No compile server at {path or default_socket_path()} ({e}); start one with main.py serve "
+              f"or pass --start", file=sys.stderr)
+        return 1
+    started = time.perf_counter()
+    responses = client.batch(requests)
+    elapsed = time.perf_counter() - started
+    client.close()
+    failed = False
+    for request, response in zip(requests, responses):
+        failed = show(command, request, response) or failed
+    if timed:
+        print(f"{len(requests)} requests in {elapsed * 1000:.2f} ms", file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+from bisect import bisect_left, bisect_right
+from ast_nodes import ASTNode, ASTNodeType
+from lexer import Lexer, Token, STREAM_LOOKAHEAD
+from parser import Parser
+
+class TopLevelItem:
+    """One top-level statement (or skipped token) and the tokens it was parsed from.
+
+    Token offsets are stored relative to the item's first token, so an edit
+    earlier in the document only moves the item, never its tokens.
+    """
+    __slots__ = ('start', 'line', 'column', 'node', 'spans')
+
+    def __init__(self, start, line, column, node, spans):
+        self.start = start
+        self.line = line
+        self.column = column
+        self.node = node
+        self.spans = spans  # [(token_type, value, relative_start, relative_end)]
+
+class EditStats:
+    def __init__(self):
+        self.relexed_tokens = 0
+        self.reparsed_items = 0
+        self.reused_items = 0
+        self.full_reparse = False
+
+    def __repr__(self):
+        return (f"EditStats(relexed_tokens={self.relexed_tokens}, reparsed_items={self.reparsed_items}, "
+                f"reused_items={self.reused_items}, full_reparse={self.full_reparse})")
+
+class IncrementalDocument:
+    """Source text kept in sync with its tokens and AST across small edits.
+
+    An edit re-lexes from the first token it can affect until the new token
+    stream lines up with an old item boundary again, then re-parses only the
+    top-level items in between. Everything after that point (tokens and AST
+    subtrees) is reused. The resulting tokens and AST equal a full reparse.
+    """
+    def __init__(self, source):
+        self.source = source
+        self.items = []
+        self.starts = []  # First-token offset of every item, for bisection
+        self.ast = None
+        self.error = None
+        self.last_edit = EditStats()
+        self.full_parse()
+
+    def full_parse(self):
+        self.last_edit.full_reparse = True
+        try:
+            items, _ = self.parse_items(Lexer(self.source).iter_spans(), {})
+        except Exception as e:  # The parser does not recover from every malformed input yet
+            self.set_error(e)
+            return
+        self.set_items(items)
+        self.last_edit.reparsed_items = len(items)
+
+    def set_error(self, error):
+        self.items = []
+        self.starts = []
+        self.ast = None
+        self.error = error
+
+    def set_items(self, items):
+        self.items = items
+        self.starts = [item.start for item in items]
+        self.error = None
+        program = ASTNode(ASTNodeType.PROGRAM)
+        program.children = [item.node for item in items if item.node is not None]
+        self.ast = program
+
+    @property
+    def tokens(self):
+        tokens = []
+        for item in self.items:
+            tokens.extend(token for token, start, end in self.materialize(item))
+        return tokens
+
+    def materialize(self, item):
+        """Rebuild an item's tokens with absolute offsets, lines and columns."""
+        source = self.source
+        spans = []
+        line = item.line
+        line_start = item.start - item.column + 1
+        previous = item.start
+        for token_type, value, relative_start, relative_end in item.spans:
+            start = item.start + relative_start
+            newlines = source.count('\n', previous, start)
+            if newlines:
+                line += newlines
+                line_start = source.rfind('\n', previous, start) + 1
+            spans.append((Token(token_type, value, line, start - line_start + 1), start, item.start + relative_end))
+            previous = start
+        return spans
+
+    def parse_items(self, spans, boundaries):
+        """Parse top-level items from an iterator of (token, start, end).
+
+        boundaries maps a token count to the index of an old item starting
+        there; parsing stops as soon as an item ends exactly on one of them.
+        Returns the new items and the index of the first old item to reuse.
+        """
+        recorded = []
+
+        def tokens():
+            for span in spans:
+                recorded.append(span)
+                yield span[0]
+
+        parser = Parser(tokens())
+        items = []
+        while parser.current_token() is not None:
+            first = parser.position
+            node = parser.parse_top_level_statement()
+            parser.current_token()  # Make sure the next boundary, if any, has been reached
+            consumed = recorded[first:parser.position]
+            start = consumed[0][1]
+            first_token = consumed[0][0]
+            items.append(TopLevelItem(start, first_token.line, first_token.column, node,
+                                      [(token.type, token.value, token_start - start, token_end - start)
+                                       for token, token_start, token_end in consumed]))
+            if parser.position in boundaries:
+                return items, boundaries[parser.position]
+        return items, None
+
+    def edit(self, offset, deleted_length, inserted_text):
+        """Replace deleted_length characters at offset with inserted_text and update tokens and AST."""
+        old_source = self.source
+        if offset < 0 or deleted_length < 0 or offset + deleted_length > len(old_source):
+            raise ValueError(f"Edit ({offset}, {deleted_length}) is outside the document")
+        new_source = old_source[:offset] + inserted_text + old_source[offset + deleted_length:]
+        self.source = new_source
+        stats = self.last_edit = EditStats()
+        if self.error is not None:
+            self.full_parse()
+            return stats
+
+        try:
+            self.apply_edit(offset, deleted_length, len(inserted_text), stats)
+        except Exception as e:
+            self.set_error(e)
+        return stats
+
+    def apply_edit(self, offset, deleted_length, inserted_length, stats):
+        items = self.items
+        starts = self.starts
+        delta = inserted_length - deleted_length
+        old_edit_end = offset + deleted_length
+        new_edit_end = offset + inserted_length
+
+        # A token's match depends on at most STREAM_LOOKAHEAD characters past
+        # its end, so the first token that can change is the first one ending
+        # within that distance of the edit.
+        containing = bisect_right(starts, offset) - 1
+        restart_item = restart_token = None
+        for item_index in range(max(containing - STREAM_LOOKAHEAD - 1, 0), len(items)):
+            item = items[item_index]
+            for token_index, (_, _, relative_start, relative_end) in enumerate(item.spans):
+                if item.start + relative_end + STREAM_LOOKAHEAD >= offset:
+                    restart_item, restart_token = item_index, token_index
+                    break
+            if restart_item is not None:
+                break
+
+        # The previous item is re-parsed too: where it ended depended on the
+        # token that followed it
+        parse_start = max(restart_item - 1, 0)
+        prefix = []
+        for item_index in range(parse_start, restart_item + 1):
+            spans = self.materialize(items[item_index])
+            prefix.extend(spans[:restart_token] if item_index == restart_item else spans)
+
+        # The restart token itself may have started inside the edit, in which
+        # case lexing resumes at the edit instead
+        source = self.source
+        lex_start = min(items[restart_item].start + items[restart_item].spans[restart_token][2], offset)
+        anchor_token, anchor = (prefix[-1][0], prefix[-1][1]) if prefix else (Token(None, None, 1, 1), 0)
+        newlines = source.count('\n', anchor, lex_start)
+        lexer = Lexer(source)
+        lexer.position = lex_start
+        lexer.line = anchor_token.line + newlines
+        if newlines:
+            lexer.column = lex_start - source.rfind('\n', anchor, lex_start)
+        else:
+            lexer.column = anchor_token.column + lex_start - anchor
+        relexed = []
+        # Without a resync point (e.g. the old EOF was swallowed by an
+        # unfinished statement) everything up to the end is re-lexed
+        resync_item, resync_token = len(items), None
+        for token, start, end in lexer.iter_spans():
+            if start >= new_edit_end:
+                # Once a token starts where an old item started (after the edit),
+                # the rest of the old stream is valid again, merely shifted
+                old_start = start - delta
+                candidate = bisect_left(starts, old_start)
+                if candidate < len(starts) and starts[candidate] == old_start and old_start >= old_edit_end:
+                    resync_item, resync_token = candidate, token
+                    break
+            relexed.append((token, start, end))
+        stats.relexed_tokens = len(relexed)
+
+        if resync_token is not None:
+            line_delta = resync_token.line - items[resync_item].line
+            for item_index in range(resync_item, len(items)):
+                item = items[item_index]
+                item.start += delta
+                item.line += line_delta
+                starts[item_index] = item.start
+            for item_index in range(resync_item, len(items)):
+                item = items[item_index]
+                if item.line != resync_token.line:
+                    break
+                item.column = item.start - source.rfind('\n', 0, item.start)
+
+        boundaries = {}
+
+        def region_spans():
+            count = 0
+            for span in prefix:
+                count += 1
+                yield span
+            for span in relexed:
+                count += 1
+                yield span
+            for item_index in range(resync_item, len(items)):
+                boundaries[count] = item_index
+                for span in self.materialize(items[item_index]):
+                    count += 1
+                    yield span
+
+        new_items, resume = self.parse_items(region_spans(), boundaries)
+        reused = items[resume:] if resume is not None else []
+        stats.reparsed_items = len(new_items)
+        stats.reused_items = parse_start + len(reused)
+        self.set_items(items[:parse_start] + new_items + reused)
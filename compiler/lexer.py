@@ -1,6 +1,10 @@
 import re
+import codecs
+from array import array
+from bisect import bisect_left
+from collections import deque
 from enum import Enum, auto
-import colorama
+from tracing import Tracer, ignore, resolve_sinks
 
 class TokenType(Enum):
     KEYWORD = auto()
@@ -25,32 +29,244 @@ class Token:
     def __repr__(self):
         return f"Token({self.type}, '{self.value}', line={self.line}, col={self.column})"
 
+class TokenStream:
+    """Small lookahead window over a token iterator.
+
+    Tokens are pulled from the iterator only when the parser asks for them and
+    are released once the parser has moved past them, so memory stays bounded
+    by the lookahead rather than by the size of the source.
+    """
+    def __init__(self, tokens):
+        self.tokens = iter(tokens)
+        self.buffer = deque()
+        self.offset = 0  # Absolute index of buffer[0]
+        self.exhausted = False
+
+    def get(self, index):
+        if index < self.offset:
+            raise IndexError(f"Token {index} has already been released from the stream")
+        buffer = self.buffer
+        while self.offset < index:
+            if buffer:
+                buffer.popleft()
+            elif not self.exhausted and next(self.tokens, None) is None:
+                self.exhausted = True
+            self.offset += 1
+        while len(buffer) <= index - self.offset:
+            if self.exhausted:
+                return None
+            token = next(self.tokens, None)
+            if token is None:
+                self.exhausted = True
+                return None
+            buffer.append(token)
+        return buffer[index - self.offset]
+
+# Default number of characters (or bytes) read per chunk when streaming
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Characters that must follow a match before it can be trusted mid-stream;
+# "1." only becomes a FLOAT once the digit after the dot has been read.
+STREAM_LOOKAHEAD = 2
+
+def read_chunks(source, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield decoded text chunks from a string, a file object or an mmap."""
+    if isinstance(source, str):
+        if source:
+            yield source
+        return
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        if isinstance(chunk, (bytes, bytearray)):
+            chunk = decoder.decode(chunk)
+        if chunk:
+            yield chunk
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+# Token classes in the same priority order as the legacy cascade in
+# Lexer.tokenize_legacy. Python's alternation takes the first branch that
+# matches, so one combined pattern yields exactly the same tokens.
+TOKEN_SPEC = [
+    ('WHITESPACE', r'\s+'),
+    ('COMMENT', r'\(\*[\s\S]*?\*\)'),
+    ('UNCLOSED_COMMENT', r'\(\*'),
+    ('INK', r'@ink'),
+    ('KEYWORD', r'let|const|if|else|for|return|print|import(?!\w)'),
+    ('BOOLEAN', r'true|false'),
+    ('STRING', r'"[^"]*"'),
+    ('UNTERMINATED_STRING', r'"'),
+    ('FLOAT', r'\d+\.\d+'),
+    ('INTEGER', r'\d+'),
+    ('IDENTIFIER', r'[a-zA-Z_]\w*'),
+    ('OPERATOR', r'&&|\|\||[+\-*/=<>!]=?'),
+    ('BLOCK_DELIMITER', r'~'),
+    ('DELIMITER', r'[(),.:;{}\[\]]'),
+]
+
+TOKEN_REGEX = re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern in TOKEN_SPEC))
+
+GROUP_TOKEN_TYPES = {
+    'COMMENT': TokenType.COMMENT,
+    'INK': TokenType.KEYWORD,
+    'KEYWORD': TokenType.KEYWORD,
+    'BOOLEAN': TokenType.BOOLEAN,
+    'STRING': TokenType.STRING,
+    'FLOAT': TokenType.FLOAT,
+    'INTEGER': TokenType.INTEGER,
+    'IDENTIFIER': TokenType.IDENTIFIER,
+    'OPERATOR': TokenType.OPERATOR,
+    'BLOCK_DELIMITER': TokenType.BLOCK_DELIMITER,
+    'DELIMITER': TokenType.DELIMITER,
+}
+
+# Debug messages matching the ones logged by the legacy cascade
+GROUP_DEBUG_MESSAGES = {
+    'COMMENT': "Found multi-line comment: {}",
+    'INK': "Found @ink keyword",
+    'KEYWORD': "Found keyword '{}'",
+    'BOOLEAN': "Found boolean '{}'",
+    'STRING': "Found string",
+    'FLOAT': "Found float '{}'",
+    'INTEGER': "Found integer '{}'",
+    'IDENTIFIER': "Found identifier '{}'",
+    'OPERATOR': "Found operator '{}'",
+    'BLOCK_DELIMITER': "Found block delimiter '{}'",
+    'DELIMITER': "Found delimiter '{}'",
+}
+
+# Bytes flavour of TOKEN_REGEX for TokenBuffer over bytes/mmap input. Character
+# classes such as \w and \d are ASCII-only here.
+TOKEN_REGEX_BYTES = re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern in TOKEN_SPEC).encode())
+
+# Compact integer codes for TokenBuffer; a code indexes into TOKEN_TYPES_BY_CODE
+TOKEN_TYPES_BY_CODE = tuple(TokenType)
+TOKEN_TYPE_CODES = {token_type: code for code, token_type in enumerate(TOKEN_TYPES_BY_CODE)}
+
 class Lexer:
-    def __init__(self, source_code, debug=False):
+    def __init__(self, source_code, debug=False, legacy=False, sinks=None):
         self.source_code = source_code
         self.position = 0
         self.line = 1
         self.column = 1
-        self.debug = debug
-
-    def debug_log(self, message, color=colorama.Fore.CYAN, token_type=None):
-        if self.debug:
-            token_color = colorama.Fore.WHITE
-            if token_type:
-                if token_type in [TokenType.KEYWORD, TokenType.BOOLEAN]:
-                    token_color = colorama.Fore.GREEN
-                elif token_type in [TokenType.STRING, TokenType.INTEGER, TokenType.FLOAT]:
-                    token_color = colorama.Fore.YELLOW
-                elif token_type in [TokenType.IDENTIFIER, TokenType.BLOCK_DELIMITER]:
-                    token_color = colorama.Fore.MAGENTA
-                elif token_type in [TokenType.OPERATOR, TokenType.DELIMITER]:
-                    token_color = colorama.Fore.BLUE
-                elif token_type == TokenType.COMMENT:
-                    token_color = colorama.Fore.CYAN
-
-            print(f"{color}Lexer - DEBUG: [{self.line}:{self.column}] {token_color}{message}{colorama.Fore.RESET}")
-              
+        self.legacy = legacy
+        self.tracer = Tracer("Lexer", resolve_sinks(debug, sinks))
+        self.debug = self.tracer.enabled
+        if not self.debug:
+            self.debug_log = ignore
+
+    def debug_log(self, message, *args, level='debug', token_type=None):
+        self.tracer.log(message, args, level, 0, self.line, self.column, token_type)
+
     def tokenize(self):
+        if self.legacy:
+            return self.tokenize_legacy()
+
+        return list(self.iter_tokens())
+
+    def iter_tokens(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Yield tokens one at a time, reading the source in chunks.
+
+        source_code may be a string, a text or binary file object, or an mmap.
+        A match that runs into the end of the buffer is retried after the next
+        chunk is appended, so tokens straddling chunk boundaries (long strings,
+        (* *) comments, identifiers split mid-word) come out whole.
+        """
+        for token, start, end in self.iter_spans(chunk_size):
+            yield token
+
+    def iter_spans(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Like iter_tokens, but yield (token, start, end) with absolute source offsets.
+
+        A string source is scanned in place starting from self.position (and
+        self.line/self.column), which lets callers re-lex from the middle of a
+        document.
+        """
+        match = TOKEN_REGEX.match
+        token_types = GROUP_TOKEN_TYPES
+        debug = self.debug
+        if isinstance(self.source_code, str):
+            chunks = iter(())
+            buffer = self.source_code
+            at_eof = True
+            position = self.position
+        else:
+            chunks = read_chunks(self.source_code, chunk_size)
+            buffer = ''
+            at_eof = False
+            position = 0
+        discarded = 0  # Characters dropped from the front of the buffer so far
+        line = self.line
+        line_start = position - self.column + 1
+
+        while True:
+            length = len(buffer)
+            m = match(buffer, position) if position < length else None
+            if not at_eof and (m is None or m.end() > length - STREAM_LOOKAHEAD
+                               or m.lastgroup == 'UNCLOSED_COMMENT' or m.lastgroup == 'UNTERMINATED_STRING'):
+                chunk = next(chunks, None)
+                if chunk is None:
+                    at_eof = True
+                else:
+                    # Drop the consumed prefix so the buffer only holds the unscanned tail
+                    buffer = buffer[position:] + chunk
+                    line_start -= position
+                    discarded += position
+                    position = 0
+                continue
+            if position >= length:
+                break
+            if m is None:
+                self.line, self.column = line, position - line_start + 1
+                self.debug_log("Unexpected character: {}", buffer[position], level='error')
+                raise SyntaxError(f"Unexpected character: {buffer[position]} at line {self.line}, column {self.column}")
+
+            kind = m.lastgroup
+            end = m.end()
+            if kind == 'WHITESPACE':
+                newlines = buffer.count('\n', position, end)
+                if newlines:
+                    line += newlines
+                    line_start = buffer.rfind('\n', position, end) + 1
+                position = end
+                continue
+
+            if kind == 'UNCLOSED_COMMENT':
+                raise SyntaxError("Unclosed multi-line comment")
+            if kind == 'UNTERMINATED_STRING':
+                raise SyntaxError(f"Unterminated string starting at line {line}, column {position - line_start + 1}")
+
+            text = m.group()
+            if debug:
+                self.line, self.column = line, position - line_start + 1
+                self.debug_log(GROUP_DEBUG_MESSAGES[kind], text, token_type=token_types[kind])
+
+            if kind == 'FLOAT':
+                value = float(text)
+            elif kind == 'INTEGER':
+                value = int(text)
+            else:
+                value = text
+            yield Token(token_types[kind], value, line, position - line_start + 1), discarded + position, discarded + end
+
+            if kind == 'STRING' or kind == 'COMMENT':
+                newlines = text.count('\n')
+                if newlines:
+                    line += newlines
+                    line_start = buffer.rfind('\n', position, end) + 1
+            position = end
+
+        self.position = discarded + position
+        self.line = line
+        self.column = position - line_start + 1
+        self.debug_log("Tokenization complete", level='success')
+        yield Token(TokenType.EOF, '', self.line, self.column), self.position, self.position
+
+    def tokenize_legacy(self):
         tokens = []
         while self.position < len(self.source_code):
             if self.match(r'\s+'):
@@ -58,40 +274,40 @@ class Lexer:
             elif self.source_code[self.position:self.position+2] == '(*':
                 self.tokenize_multi_line_comment(tokens)
             elif self.match(r'@ink'):
-                self.debug_log(f"Found @ink keyword", token_type=TokenType.KEYWORD)
+                self.debug_log("Found @ink keyword", token_type=TokenType.KEYWORD)
                 tokens.append(self.create_token(TokenType.KEYWORD, self.current_match))
-            elif self.match(r'let|const|if|else|for|return|print'):
-                self.debug_log(f"Found keyword '{self.current_match}'", token_type=TokenType.KEYWORD)
+            elif self.match(r'let|const|if|else|for|return|print|import(?!\w)'):
+                self.debug_log("Found keyword '{}'", self.current_match, token_type=TokenType.KEYWORD)
                 tokens.append(self.create_token(TokenType.KEYWORD, self.current_match))
             elif self.match(r'true|false'):
-                self.debug_log(f"Found boolean '{self.current_match}'", token_type=TokenType.BOOLEAN)
+                self.debug_log("Found boolean '{}'", self.current_match, token_type=TokenType.BOOLEAN)
                 tokens.append(self.create_token(TokenType.BOOLEAN, self.current_match))
             elif self.match(r'"'):
                 self.debug_log("Found string", token_type=TokenType.STRING)
                 self.tokenize_string(tokens)
             elif self.match(r'\d+\.\d+'):
-                self.debug_log(f"Found float '{self.current_match}'", token_type=TokenType.FLOAT)
-                tokens.append(self.create_token(TokenType.FLOAT, float(self.current_match)))
+                self.debug_log("Found float '{}'", self.current_match, token_type=TokenType.FLOAT)
+                tokens.append(self.create_token(TokenType.FLOAT, float(self.current_match), self.current_match))
             elif self.match(r'\d+'):
-                self.debug_log(f"Found integer '{self.current_match}'", token_type=TokenType.INTEGER)
-                tokens.append(self.create_token(TokenType.INTEGER, int(self.current_match)))
+                self.debug_log("Found integer '{}'", self.current_match, token_type=TokenType.INTEGER)
+                tokens.append(self.create_token(TokenType.INTEGER, int(self.current_match), self.current_match))
             elif self.match(r'[a-zA-Z_]\w*'):
-                self.debug_log(f"Found identifier '{self.current_match}'", token_type=TokenType.IDENTIFIER)
+                self.debug_log("Found identifier '{}'", self.current_match, token_type=TokenType.IDENTIFIER)
                 tokens.append(self.create_token(TokenType.IDENTIFIER, self.current_match))
-            elif self.match(r'[+\-*/=<>!]=?'):
-                self.debug_log(f"Found operator '{self.current_match}'", token_type=TokenType.OPERATOR)
+            elif self.match(r'&&|\|\||[+\-*/=<>!]=?'):
+                self.debug_log("Found operator '{}'", self.current_match, token_type=TokenType.OPERATOR)
                 tokens.append(self.create_token(TokenType.OPERATOR, self.current_match))
             elif self.match(r'~'):
-                self.debug_log(f"Found block delimiter '{self.current_match}'", token_type=TokenType.BLOCK_DELIMITER)
+                self.debug_log("Found block delimiter '{}'", self.current_match, token_type=TokenType.BLOCK_DELIMITER)
                 tokens.append(self.create_token(TokenType.BLOCK_DELIMITER, self.current_match))
-            elif self.match(r'[(),.:;{}]'):
-                self.debug_log(f"Found delimiter '{self.current_match}'", token_type=TokenType.DELIMITER)
+            elif self.match(r'[(),.:;{}\[\]]'):
+                self.debug_log("Found delimiter '{}'", self.current_match, token_type=TokenType.DELIMITER)
                 tokens.append(self.create_token(TokenType.DELIMITER, self.current_match))
             else:
-                self.debug_log(f"Unexpected character: {self.source_code[self.position]}", color=colorama.Fore.RED)
+                self.debug_log("Unexpected character: {}", self.source_code[self.position], level='error')
                 raise SyntaxError(f"Unexpected character: {self.source_code[self.position]} at line {self.line}, column {self.column}")
 
-        self.debug_log("Tokenization complete", color=colorama.Fore.GREEN)
+        self.debug_log("Tokenization complete", level='success')
         tokens.append(self.create_token(TokenType.EOF, ''))
         return tokens
 
@@ -132,55 +348,193 @@ class Lexer:
         raise SyntaxError(f"Unterminated comment starting at line {self.line}, column {self.column}")
 
     def tokenize_string(self, tokens):
-        start = self.position
-        self.position += 1  # Skip opening quote
-        self.column += 1
-        while self.position < len(self.source_code):
-            if self.source_code[self.position] == '"':
-                self.position += 1
-                self.column += 1
-                # Include the quotes in the token value
-                tokens.append(self.create_token(TokenType.STRING, self.source_code[start:self.position]))
+        end = self.position + 1  # Skip opening quote
+        while end < len(self.source_code):
+            if self.source_code[end] == '"':
+                # Include the quotes in the token value; create_token advances past them
+                tokens.append(self.create_token(TokenType.STRING, self.source_code[self.position:end + 1]))
                 return
-            elif self.source_code[self.position] == '\n':
-                self.line += 1
-                self.column = 1
-            else:
-                self.column += 1
-            self.position += 1
-        
+            end += 1
+
         raise SyntaxError(f"Unterminated string starting at line {self.line}, column {self.column}")
 
     def tokenize_multi_line_comment(self, tokens):
-        start = self.position
-        self.position += 2  # Skip (*
-        while self.position < len(self.source_code) - 1 and self.source_code[self.position:self.position+2] != '*)':
-            self.position += 1
-        if self.position >= len(self.source_code) - 1:
+        end = self.position + 2  # Skip (*
+        while end < len(self.source_code) - 1 and self.source_code[end:end+2] != '*)':
+            end += 1
+        if end >= len(self.source_code) - 1:
             raise SyntaxError("Unclosed multi-line comment")
-        self.position += 2  # Skip *)
-        comment = self.source_code[start:self.position]
-        self.debug_log(f"Found multi-line comment: {comment}", token_type=TokenType.COMMENT)
+        end += 2  # Skip *); create_token advances past the comment
+        comment = self.source_code[self.position:end]
+        self.debug_log("Found multi-line comment: {}", comment, token_type=TokenType.COMMENT)
         tokens.append(self.create_token(TokenType.COMMENT, comment))
 
-    def create_token(self, token_type, value):
+    def create_token(self, token_type, value, text=None):
+        # text is the source lexeme when it differs from str(value), e.g. "1.50"
+        if text is None:
+            text = str(value)
         token = Token(token_type, value, self.line, self.column)
-        if isinstance(value, str):
-            lines = value.split('\n')
-            if len(lines) > 1:
-                self.line += len(lines) - 1
-                self.column = len(lines[-1]) + 1
-            else:
-                self.column += len(value)
+        lines = text.split('\n')
+        if len(lines) > 1:
+            self.line += len(lines) - 1
+            self.column = len(lines[-1]) + 1
         else:
-            self.column += len(str(value))
-        self.position += len(str(value))
+            self.column += len(text)
+        self.position += len(text)
         return token
 
-def lex(source_code, debug=False):
-    lexer = Lexer(source_code, debug)
+class TokenView:
+    """Token-compatible view of one entry in a TokenBuffer.
+
+    Exposes the same type/value/line/column attributes as Token, but the value
+    is sliced from the source and the position resolved only when accessed.
+    """
+    __slots__ = ('buffer', 'index')
+
+    def __init__(self, buffer, index):
+        self.buffer = buffer
+        self.index = index
+
+    @property
+    def type(self):
+        return TOKEN_TYPES_BY_CODE[self.buffer.types[self.index]]
+
+    @property
+    def value(self):
+        return self.buffer.value(self.index)
+
+    @property
+    def line(self):
+        return self.buffer.position(self.index)[0]
+
+    @property
+    def column(self):
+        return self.buffer.position(self.index)[1]
+
+    def __repr__(self):
+        return f"Token({self.type}, '{self.value}', line={self.line}, col={self.column})"
+
+class TokenBuffer:
+    """Struct-of-arrays token storage: one type code and a start/end offset per token.
+
+    Nothing but integers is stored per token. Values are sliced out of the
+    source on access, and line/column are found by binary search over a
+    newline-offset index built the first time a position is asked for. Bytes
+    input (including mmap) is scanned through a memoryview without copying;
+    offsets and columns are then counted in bytes.
+    """
+    def __init__(self, source):
+        if isinstance(source, str):
+            self.source = source
+            self.newline = '\n'
+            regex = TOKEN_REGEX
+        else:
+            self.source = memoryview(source).cast('B')
+            self.newline = b'\n'
+            regex = TOKEN_REGEX_BYTES
+        self.types = array('B')
+        self.starts = array('q')
+        self.ends = array('q')
+        self.newlines = None
+        self.scan(regex)
+
+    def scan(self, regex):
+        source = self.source
+        length = len(source)
+        match = regex.match
+        codes = {group: TOKEN_TYPE_CODES[token_type] for group, token_type in GROUP_TOKEN_TYPES.items()}
+        add_type = self.types.append
+        add_start = self.starts.append
+        add_end = self.ends.append
+        position = 0
+        while position < length:
+            m = match(source, position)
+            if m is None:
+                line, column = self.resolve(position)
+                char = chr(source[position]) if isinstance(source, memoryview) else source[position]
+                raise SyntaxError(f"Unexpected character: {char} at line {line}, column {column}")
+            kind = m.lastgroup
+            if kind == 'UNCLOSED_COMMENT':
+                raise SyntaxError("Unclosed multi-line comment")
+            if kind == 'UNTERMINATED_STRING':
+                line, column = self.resolve(position)
+                raise SyntaxError(f"Unterminated string starting at line {line}, column {column}")
+            end = m.end()
+            if kind != 'WHITESPACE':
+                add_type(codes[kind])
+                add_start(position)
+                add_end(end)
+            position = end
+        add_type(TOKEN_TYPE_CODES[TokenType.EOF])
+        add_start(length)
+        add_end(length)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.types)
+        if not 0 <= index < len(self.types):
+            raise IndexError("token index out of range")
+        return TokenView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self.types)):
+            yield TokenView(self, index)
+
+    def text(self, index):
+        text = self.source[self.starts[index]:self.ends[index]]
+        if isinstance(text, memoryview):
+            return str(text, 'utf-8')
+        return text
+
+    def value(self, index):
+        token_type = TOKEN_TYPES_BY_CODE[self.types[index]]
+        if token_type == TokenType.FLOAT:
+            return float(self.text(index))
+        if token_type == TokenType.INTEGER:
+            return int(self.text(index))
+        return self.text(index)
+
+    def build_newline_index(self):
+        source = self.source
+        if isinstance(source, memoryview):
+            # Search the underlying bytes/mmap directly when the view covers all of it
+            obj = source.obj
+            source = obj if hasattr(obj, 'find') and len(obj) == source.nbytes else bytes(source)
+        newlines = array('q')
+        find = source.find
+        offset = find(self.newline)
+        while offset != -1:
+            newlines.append(offset)
+            offset = find(self.newline, offset + 1)
+        self.newlines = newlines
+
+    def resolve(self, offset):
+        """Return the 1-based (line, column) of a source offset."""
+        if self.newlines is None:
+            self.build_newline_index()
+        line_index = bisect_left(self.newlines, offset)  # Newlines before offset
+        line_start = self.newlines[line_index - 1] + 1 if line_index else 0
+        return line_index + 1, offset - line_start + 1
+
+    def position(self, index):
+        return self.resolve(self.starts[index])
+
+def lex(source_code, debug=False, legacy=False, sinks=None):
+    lexer = Lexer(source_code, debug, legacy, sinks)
     return lexer.tokenize()
 
+def lex_buffer(source):
+    """Tokenize a str, bytes or mmap into a compact TokenBuffer."""
+    return TokenBuffer(source)
+
+def stream_lex(source, debug=False, chunk_size=DEFAULT_CHUNK_SIZE, sinks=None):
+    """Lazily tokenize a string, file object or mmap without building a token list."""
+    lexer = Lexer(source, debug, sinks=sinks)
+    return lexer.iter_tokens(chunk_size)
+
 # Example usage
 if __name__ == "__main__":
     sample_code = """
@@ -1,5 +1,337 @@
-def main():
-    print("KrakenScript compiler v0.1.0")
+import argparse
+import sys
+import time
+from contextlib import nullcontext
+from functools import partial
+
+VERSION = "0.1.0"
+
+# What the lexer, parser, resolver, type checker and module loader raise for mistakes in a program
+COMPILE_ERRORS = (SyntaxError, NameError, TypeError, ImportError)
+
+def is_compile_error(error):
+    """Whether error reports a mistake in the program rather than a failure of the running program.
+
+    Lazily compiled bodies are compiled while the program runs, so whatever
+    BytecodeCompiler.compile_function raises counts, wherever it surfaces.
+    """
+    import traceback
+    from bytecode import BytecodeCompiler
+    from transpiler import execute
+    from vm import VM
+
+    if not isinstance(error, COMPILE_ERRORS) or isinstance(error, ModuleNotFoundError):
+        return False
+    running = False
+    for frame, line in traceback.walk_tb(error.__traceback__):
+        if frame.f_code is BytecodeCompiler.compile_function.__code__:
+            return True
+        if frame.f_code in (VM.execute.__code__, execute.__code__):
+            running = True
+    return not running
+
+def report_error(path, error):
+    print(f"error: {path}: {type(error).__name__}: {error}", file=sys.stderr)
+    for note in getattr(error, '__notes__', ()):
+        print(f"  {note}", file=sys.stderr)
+    return 1
+
+def run_command(args):
+    try:
+        return run_program(args)
+    except COMPILE_ERRORS as e:
+        if not is_compile_error(e):
+            raise
+        return report_error(args.file, e)
+
+def run_program(args):
+    from parser import parse
+    from bytecode import compile_program, disassemble
+    from modules import load_program
+    from vm import VM
+
+    profile = runtime_profile = None
+    timed = lambda name: nullcontext()
+    if args.profile:
+        from profiling import Profile
+        profile = Profile()
+        timed = profile.phase
+    runtime_format = args.profile_runtime or ("text" if args.profile_sample else None)
+    if runtime_format is not None:
+        from profiling import RuntimeProfile
+        interval = args.profile_sample / 1000 if args.profile_sample else None
+        runtime_profile = RuntimeProfile(interval, args.profile_sort)
+
+    with open(args.file) as f:
+        source = f.read()
+    if args.backend == "python":
+        return run_transpiled(args, source, profile, timed)
+    lazy = args.lazy and not args.disassemble
+    if lazy and args.optimize:
+        print("warning: --lazy is ignored with -O, whose passes read every function body", file=sys.stderr)
+        lazy = False
+    positions = runtime_profile is not None  # Lines come from the parser; cached trees have none
+    cache = None
+    if profile is not None or positions:
+        ast = parse(source, profile=profile, lazy=lazy, positions=positions)  # A cache hit would hide the front end
+    elif args.no_cache or lazy:
+        ast = parse(source, lazy=lazy)  # The cache holds fully parsed trees
+    else:
+        from cache import CompilationCache
+        cache = CompilationCache(args.cache_dir)
+        ast = cache.parse(source)
+    with timed("link"):
+        ast = load_program(args.file, ast,
+                           cache.parse if cache is not None else partial(parse, lazy=lazy, positions=positions), lazy)
+    if cache is not None and args.cache_stats:
+        print(cache.report(), file=sys.stderr)
+    if args.optimize:
+        from optimizer import PassManager
+        pass_manager = PassManager(disabled=args.disable_pass)
+        with timed("optimize"):
+            ast = pass_manager.run(ast)
+        if args.pass_stats:
+            print(pass_manager.report(), file=sys.stderr)
+    with timed("compile"):
+        program = compile_program(ast, vectorize=args.vectorize, lazy=lazy, profile=runtime_profile)
+    if args.disassemble:
+        print(disassemble(program))
+    else:
+        vm = VM(program, memo_size=args.memo_size, profile=runtime_profile)
+        with timed("execute"):
+            vm.run()
+        if args.memo_stats:
+            for function, memo in zip(program.functions, vm.memos):
+                if memo is not None:
+                    print(memo.report(), file=sys.stderr)
+                elif function.compile_body is not None:
+                    print(f"{function.name}: never called", file=sys.stderr)
+                else:
+                    print(f"{function.name}: not memoized ({function.memo_exclusion or 'memoization is off'})",
+                          file=sys.stderr)
+        if args.stats:
+            print(f"{vm.instructions} instructions in {vm.elapsed:.4f}s "
+                  f"({vm.instructions_per_second:,.0f} instructions/s)", file=sys.stderr)
+            if program.kernels:
+                runs = sum(kernel.runs for kernel in program.kernels)
+                fallbacks = sum(kernel.fallbacks for kernel in program.kernels)
+                print(f"{len(program.kernels)} vectorized loop kernels: {runs} runs, "
+                      f"{fallbacks} fell back to scalar loops", file=sys.stderr)
+        if runtime_profile is not None:
+            write_profile(runtime_profile, runtime_format, args.profile_runtime_output)
+    if profile is not None:
+        write_profile(profile, args.profile, args.profile_output)
+    return 0
+
+def run_transpiled(args, source, profile, timed):
+    """run --backend python: execute the program as a CPython code object, cached by source hash."""
+    from transpiler import execute
+    from modules import might_import
+
+    if args.vectorize:
+        raise SystemExit("--vectorize only applies to the vm backend")
+    if args.lazy:
+        raise SystemExit("--lazy only applies to the vm backend")
+    if args.profile_runtime or args.profile_sample:
+        raise SystemExit("--profile-runtime only applies to the vm backend")
+    cache = code = ast = None
+    options = "O:" + ",".join(sorted(args.disable_pass)) if args.optimize else ""
+    if might_import(source):
+        # The code object depends on every imported module too, so they are loaded before looking it up
+        from parser import parse
+        from modules import load_modules, link
+        modules = load_modules(args.file, parse(source, profile=profile, positions=True), partial(parse, positions=True))
+        for module in modules[:-1]:
+            with open(module.path, encoding="utf-8") as f:
+                options += f"\0{module.path}\0{f.read()}"
+        ast = link(modules)
+    if profile is None and not args.no_cache and not args.disassemble:
+        from cache import CompilationCache, code_cache_key
+        cache = CompilationCache(args.cache_dir)
+        key = code_cache_key(source, args.file, options)
+        code = cache.load_code(key)
+    if code is None:
+        from parser import parse
+        from transpiler import transpile
+        if ast is None:
+            ast = parse(source, profile=profile, positions=True)
+        if args.optimize:
+            from optimizer import PassManager
+            pass_manager = PassManager(disabled=args.disable_pass)
+            with timed("optimize"):
+                ast = pass_manager.run(ast)
+            if args.pass_stats:
+                print(pass_manager.report(), file=sys.stderr)
+        with timed("transpile"):
+            module = transpile(ast)
+        if args.disassemble:
+            import ast as python_ast
+            print(python_ast.unparse(module))
+            return 0
+        with timed("compile"):
+            code = compile(module, args.file, "exec")
+        if cache is not None:
+            cache.store_code(key, code)
+    if cache is not None and args.cache_stats:
+        print(cache.report(), file=sys.stderr)
+    memos = []
+    with timed("execute"):
+        start = time.perf_counter()
+        execute(code, memo_size=args.memo_size, memos=memos)
+        elapsed = time.perf_counter() - start
+    if args.memo_stats:
+        for memo in memos:
+            print(memo.report(), file=sys.stderr)
+    if args.stats:
+        print(f"executed in {elapsed:.4f}s", file=sys.stderr)
+    if profile is not None:
+        write_profile(profile, args.profile, args.profile_output)
+    return 0
+
+def write_profile(profile, output_format, path):
+    if output_format == "json":
+        text = profile.to_json()
+    elif output_format == "folded":
+        text = profile.folded()
+    else:
+        text = profile.report()
+    if path:
+        with open(path, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text, file=sys.stderr)
+
+def ast_command(args):
+    from parser import parse
+
+    with open(args.file) as f:
+        source = f.read()
+    try:
+        ast = parse(source)
+    except SyntaxError as e:
+        return report_error(args.file, e)
+    if args.format == "binary":
+        from serialize import dump_binary
+        data = dump_binary(ast)
+        if args.output:
+            with open(args.output, "wb") as f:
+                f.write(data)
+        else:
+            sys.stdout.buffer.write(data)
+        return 0
+    with open(args.output, "w") if args.output else nullcontext(sys.stdout) as stream:
+        if args.format == "jsonl":
+            from serialize import write_jsonl
+            write_jsonl(ast, stream)
+        else:
+            from ast_nodes import pretty_print_ast
+            pretty_print_ast(ast, stream=stream)
+    return 0
+
+def build_command(args):
+    from build import build, ModuleBuild
+
+    cache = None
+    if not args.no_cache:
+        from cache import CompilationCache
+        cache = CompilationCache(args.cache_dir)
+    if args.incremental:
+        report = ModuleBuild(args.paths, cache).run()
+    else:
+        report = build(args.paths, jobs=args.jobs, chunk_size=args.chunk_size, cache=cache)
+    if args.timings:
+        for result in report.results:
+            status = "cached" if result.cached else "error" if result.error else "ok"
+            print(f"{result.elapsed * 1000:9.2f} ms  {status:<6} {result.path}")
+    for result in report.errors:
+        print(f"error: {result.path}: {result.error}", file=sys.stderr)
+    print(report.summary())
+    if cache is not None and args.cache_stats:
+        print(cache.report(), file=sys.stderr)
+    return 1 if report.errors else 0
+
+def serve_command(args):
+    from server import serve
+
+    cache = None
+    if not args.no_cache:
+        from cache import CompilationCache
+        cache = CompilationCache(args.cache_dir)
+    return serve(args.socket, cache, args.workers)
+
+def main(argv=None):
+    from memoize import DEFAULT_MEMO_SIZE
+
+    arg_parser = argparse.ArgumentParser(prog="krakenscript", description=f"KrakenScript compiler v{VERSION}")
+    commands = arg_parser.add_subparsers(dest="command")
+
+    run_parser = commands.add_parser("run", help="compile a .ks file to bytecode and execute it")
+    run_parser.add_argument("file")
+    run_parser.add_argument("--backend", choices=["vm", "python"], default="vm",
+                            help="execute on the bytecode VM (default) or as transpiled CPython code")
+    run_parser.add_argument("--disassemble", action="store_true",
+                            help="print the bytecode (or the transpiled Python) instead of running it")
+    run_parser.add_argument("--memo-size", type=int, default=DEFAULT_MEMO_SIZE, metavar="N",
+                            help=f"results cached per pure @ink function (default {DEFAULT_MEMO_SIZE}, 0 disables)")
+    run_parser.add_argument("--memo-stats", action="store_true", help="report memoization hits and misses per function")
+    run_parser.add_argument("--vectorize", action="store_true",
+                            help="run numeric for loops as NumPy array operations (requires numpy)")
+    run_parser.add_argument("--lazy", action="store_true",
+                            help="parse and compile each @ink body on its first call (vm backend)")
+    run_parser.add_argument("--stats", action="store_true", help="report instructions executed per second")
+    run_parser.add_argument("-O", "--optimize", action="store_true", help="run the AST optimization passes before compiling")
+    run_parser.add_argument("--disable-pass", action="append", default=[], metavar="NAME",
+                            help="skip one optimization pass (repeatable), e.g. common-subexpression-elimination")
+    run_parser.add_argument("--pass-stats", action="store_true", help="report what each optimization pass changed")
+    run_parser.add_argument("--profile", choices=["text", "json", "folded"],
+                            help="time each phase and grammar rule; 'folded' is flamegraph.pl/speedscope input")
+    run_parser.add_argument("--profile-output", metavar="FILE", help="write the profile here instead of stderr")
+    run_parser.add_argument("--profile-runtime", choices=["text", "json", "folded"],
+                            help="count calls and time per @ink function and executions per source line")
+    run_parser.add_argument("--profile-sample", type=float, metavar="MS",
+                            help="sample the running program every MS milliseconds instead of counting everything")
+    run_parser.add_argument("--profile-sort", choices=["self", "total", "calls", "name"], default="self",
+                            help="order of the functions in the runtime profile (default: self time)")
+    run_parser.add_argument("--profile-runtime-output", metavar="FILE",
+                            help="write the runtime profile here instead of stderr")
+    run_parser.add_argument("--no-cache", action="store_true", help="always lex and parse instead of using the .ksc cache")
+    run_parser.add_argument("--cache-dir", metavar="DIR",
+                            help="where .ksc files are kept (default: $KRAKENSCRIPT_CACHE_DIR or ~/.cache/krakenscript)")
+    run_parser.add_argument("--cache-stats", action="store_true", help="report cache hits and misses")
+    run_parser.set_defaults(handler=run_command)
+
+    ast_parser = commands.add_parser("ast", help="parse a .ks file and print or export its AST")
+    ast_parser.add_argument("file")
+    ast_parser.add_argument("--format", choices=["text", "jsonl", "binary"], default="text",
+                            help="outline (default), one JSON object per node, or the compact binary layout")
+    ast_parser.add_argument("-o", "--output", metavar="FILE", help="write here instead of stdout")
+    ast_parser.set_defaults(handler=ast_command)
+
+    build_parser = commands.add_parser("build", help="lex and parse many .ks files in parallel into the .ksc cache")
+    build_parser.add_argument("paths", nargs="+", help="files, directories or glob patterns")
+    build_parser.add_argument("-j", "--jobs", type=int, help="worker processes (default: one per CPU)")
+    build_parser.add_argument("--chunk-size", type=int, help="files per work unit sent to a worker")
+    build_parser.add_argument("--incremental", action="store_true",
+                              help="also check imports, redoing only the modules that changed and their dependents")
+    build_parser.add_argument("--timings", action="store_true", help="print how long each file took")
+    build_parser.add_argument("--no-cache", action="store_true", help="parse every file and keep nothing")
+    build_parser.add_argument("--cache-dir", metavar="DIR", help="where .ksc files are kept")
+    build_parser.add_argument("--cache-stats", action="store_true", help="report cache hits and misses")
+    build_parser.set_defaults(handler=build_command)
+
+    serve_parser = commands.add_parser("serve", help="keep the compiler warm behind a Unix socket for client.py")
+    serve_parser.add_argument("--socket", metavar="PATH",
+                              help="where to listen (default: $KRAKENSCRIPT_SOCKET or server.sock in the cache directory)")
+    serve_parser.add_argument("--workers", type=int, help="threads running requests at once")
+    serve_parser.add_argument("--no-cache", action="store_true", help="parse every request and keep nothing on disk")
+    serve_parser.add_argument("--cache-dir", metavar="DIR", help="where .ksc files are kept")
+    serve_parser.set_defaults(handler=serve_command)
+
+    args = arg_parser.parse_args(argv)
+    if args.command is None:
+        print(f"KrakenScript compiler v{VERSION}")
+        return 0
+    return args.handler(args)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,183 @@
+from collections import OrderedDict
+from ast_nodes import ASTNodeType, is_name
+from resolver import GLOBAL_DEPTH
+
+# Entries kept per memoized function unless run --memo-size says otherwise
+DEFAULT_MEMO_SIZE = 128
+
+class MemoCache:
+    """Bounded LRU cache of one function's results, keyed by its arguments.
+
+    Keys pair every argument with its class, so f(1), f(1.0) and f(true)
+    stay apart even though they compare equal. Calls with unhashable
+    arguments (lists) are not cached. When type inference proved that
+    every argument always has the same class (exact=True), the arguments
+    alone are the key.
+    """
+    def __init__(self, name, size=DEFAULT_MEMO_SIZE, exact=False):
+        self.name = name
+        self.size = size
+        self.exact = exact
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, args):
+        """Cache key for an argument list, or None if it cannot be hashed."""
+        if self.exact:
+            return tuple(args)
+        key = (*args, *map(type, args))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def lookup(self, key, default=None):
+        entries = self.entries
+        if key in entries:
+            entries.move_to_end(key)
+            self.hits += 1
+            return entries[key]
+        self.misses += 1
+        return default
+
+    def store(self, key, value):
+        entries = self.entries
+        entries[key] = value
+        if len(entries) > self.size:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+    def report(self):
+        calls = self.hits + self.misses
+        rate = self.hits / calls * 100 if calls else 0.0
+        return (f"{self.name}: {self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate), "
+                f"{self.evictions} evictions, {len(self.entries)}/{self.size} entries")
+
+class PurityAnalysis:
+    """Decides which @ink functions are pure enough to memoize.
+
+    A function is pure when it does not print, does not assign globals,
+    only calls builtins and other pure functions, and only reads globals
+    that are constants declared before the program first calls a
+    function, so no call can see them change or uninitialized. Recursive
+    functions are pure unless something else makes them impure. Functions
+    annotated @ink memo are taken to be pure on their author's word, unless
+    trust_annotations is False.
+
+    Functions are inspected on demand: reason() looks only at the function
+    asked about and those it can reach, calling prepare (if given) with
+    each FUNCTION_DECLARATION before reading its body, so that a lazy
+    compiler can resolve the body first.
+    """
+    def __init__(self, program_node, addresses, prepare=None, trust_annotations=True):
+        self.addresses = addresses
+        self.prepare = prepare
+        self.trust_annotations = trust_annotations
+        self.functions = {child.value: child for child in program_node.children
+                          if child.type == ASTNodeType.FUNCTION_DECLARATION}
+        self.stable_globals = self.initialized_constants(program_node, self.functions)
+        self.reasons = {}
+
+    def analyze(self):
+        """Return {function name: reason it is impure, or None if it is pure}."""
+        return {name: self.reason(name) for name in self.functions}
+
+    def reason(self, name):
+        """Why the function called name is impure, or None if it is pure."""
+        known = self.reasons
+        if name in known:
+            return known[name]
+        reasons = {}
+        callees = {}
+        pending = [name]
+        while pending:
+            current = pending.pop()
+            if current in reasons or current in known or current not in self.functions:
+                continue  # Builtins are pure
+            function = self.functions[current]
+            if annotation(function) == 'memo' and self.trust_annotations:
+                reasons[current], callees[current] = None, set()
+                continue
+            if self.prepare is not None:
+                self.prepare(function)
+            reasons[current], callees[current] = self.inspect(function)
+            pending.extend(callees[current])
+        # Impurity spreads to callers until nothing changes
+        changed = True
+        while changed:
+            changed = False
+            for current, called in callees.items():
+                if reasons[current] is not None:
+                    continue
+                for callee in called:
+                    if reasons.get(callee, known.get(callee)) is not None:
+                        reasons[current] = f"calls impure function '{callee}'"
+                        changed = True
+                        break
+        known.update(reasons)
+        return known[name]
+
+    def exclusion(self, name):
+        """Why the function called name is not memoized, or None if it is."""
+        if annotation(self.functions[name]) == 'nomemo':
+            return "annotated nomemo"
+        return self.reason(name)
+
+    def initialized_constants(self, program_node, function_names):
+        """Addresses of the constants declared at the top level before any function can run."""
+        constants = set()
+        for child in program_node.children:
+            if child.type == ASTNodeType.FUNCTION_DECLARATION:
+                continue
+            if child.type == ASTNodeType.CONSTANT_DECLARATION and not self.calls(child.children[0], function_names):
+                constants.add(self.addresses[child])
+            elif self.calls(child, function_names):
+                break
+        return constants
+
+    def calls(self, node, function_names):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.type == ASTNodeType.FUNCTION_CALL and node.value in function_names:
+                return True
+            stack.extend(node.children)
+        return False
+
+    def inspect(self, function):
+        """Return a reason found in the body itself why the function is impure (or None), and the functions it calls."""
+        reason = None
+        called = set()
+        stack = [function.children[2]]
+        while stack:
+            node = stack.pop()
+            node_type = node.type
+            if node_type == ASTNodeType.PRINT_STATEMENT:
+                reason = reason or "prints"
+            elif node_type == ASTNodeType.ASSIGNMENT:
+                target = node.children[0]
+                if self.addresses[target][0] == GLOBAL_DEPTH:
+                    reason = reason or f"assigns global '{target.value}'"
+            elif node_type == ASTNodeType.EXPRESSION and is_name(node.value):
+                address = self.addresses[node]
+                if address[0] == GLOBAL_DEPTH and address not in self.stable_globals:
+                    reason = reason or f"reads global '{node.value}'"
+            elif node_type == ASTNodeType.FUNCTION_CALL:
+                called.add(node.value)
+            stack.extend(node.children)
+        return reason, called
+
+def annotation(function):
+    """The word between @ink and a FUNCTION_DECLARATION's name, if any."""
+    return function.children[3].value if len(function.children) > 3 else None
+
+def analyze_purity(program_node, addresses):
+    return PurityAnalysis(program_node, addresses).analyze()
+
+def memoization_exclusions(program_node, addresses):
+    """{function name: why its results are not memoized, or None if they are}."""
+    analysis = PurityAnalysis(program_node, addresses)
+    return {name: analysis.exclusion(name) for name in analysis.functions}
@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+import re
+from ast_nodes import ASTNode, ASTNodeType
+
+MODULE_EXTENSION = ".ks"
+
+# Textual test for sources that may import modules. Comments and strings can
+# fool it into a false positive, but it never misses an import statement.
+IMPORT_KEYWORD = re.compile(r'import(?!\w)')
+
+def might_import(source):
+    return IMPORT_KEYWORD.search(source) is not None
+
+def imported_names(program_node):
+    """Names of the modules a parsed module imports, in source order."""
+    return [child.value for child in program_node.children if child.type == ASTNodeType.IMPORT]
+
+def module_name(path, roots=()):
+    """Dotted name of the module in path: reef/tides.ks under a root is reef.tides."""
+    for root in roots:
+        relative = os.path.relpath(path, root)
+        if not relative.startswith(os.pardir):
+            return os.path.splitext(relative)[0].replace(os.sep, '.')
+    return os.path.splitext(os.path.basename(path))[0]
+
+def find_module(name, roots):
+    """Path of the file import name loads, from the first root that has it."""
+    relative = os.path.join(*name.split('.')) + MODULE_EXTENSION
+    for root in roots:
+        path = os.path.join(root, relative)
+        if os.path.isfile(path):
+            return os.path.normpath(path)
+    raise ImportError(f"No module named '{name}'")
+
+def expression_key(node):
+    """Nested lists that compare equal exactly when two expression trees do."""
+    return [node.type.name, node.value, *map(expression_key, node.children)]
+
+class Interface:
+    """What a module exports to its importers: its top-level functions and globals.
+
+    functions maps each @ink name to its signature: parameter names, types
+    and default values (callers evaluate defaults, so they are part of it),
+    the return type and the annotation. globals maps each top-level let or
+    const name to whether it is constant. digest hashes both, so importers
+    only need checking again when it changes, not when a body does.
+    """
+    def __init__(self, functions, globals_):
+        self.functions = functions
+        self.globals = globals_
+        text = json.dumps([functions, globals_], sort_keys=True)
+        self.digest = hashlib.sha256(text.encode()).hexdigest()
+
+    @classmethod
+    def of(cls, program_node):
+        functions = {}
+        globals_ = {}
+        for child in program_node.children:
+            if child.type == ASTNodeType.FUNCTION_DECLARATION:
+                params, return_type = child.children[:2]
+                functions[child.value] = {
+                    'params': [[param.value, param.children[0].value,
+                                expression_key(param.children[1]) if len(param.children) > 1 else None]
+                               for param in params.children],
+                    'returns': return_type.value,
+                    'annotation': child.children[3].value if len(child.children) > 3 else None,
+                }
+            elif child.type in (ASTNodeType.VARIABLE_DECLARATION, ASTNodeType.CONSTANT_DECLARATION):
+                constant = child.type == ASTNodeType.CONSTANT_DECLARATION
+                globals_[child.value] = globals_.get(child.value, False) or constant
+        return cls(functions, globals_)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['functions'], data['globals'])
+
+    def to_dict(self):
+        return {'functions': self.functions, 'globals': self.globals}
+
+    def names(self):
+        return [*self.functions, *self.globals]
+
+class Module:
+    """A parsed source file. imports maps each module name it imports to that module's path."""
+    __slots__ = ('name', 'path', 'ast', 'imports', 'interface')
+
+    def __init__(self, name, path, ast, imports, interface):
+        self.name = name
+        self.path = path
+        self.ast = ast
+        self.imports = imports
+        self.interface = interface
+
+def resolve_imports(program_node, roots, path):
+    imports = {}
+    for name in imported_names(program_node):
+        try:
+            imports[name] = find_module(name, roots)
+        except ImportError:
+            raise ImportError(f"No module named '{name}' (imported by {path})") from None
+    return imports
+
+def check_module(module, interfaces, lazy=False):
+    """Resolve a module against {imported module name: Interface}, raising the first error.
+
+    A module only sees what it declares and what the modules it imports
+    declare themselves, and may not declare a name it also imports. Calls
+    to imported functions are type checked against their signatures.
+    """
+    from bytecode import BUILTIN_SLOTS
+    from resolver import Resolver
+    from typecheck import Signature, check_types
+
+    owners = dict.fromkeys(module.interface.names(), module.name)
+    for imported, interface in interfaces.items():
+        for name in interface.names():
+            owner = owners.setdefault(name, imported)
+            if owner == module.name:
+                raise SyntaxError(f"'{name}' is declared in module '{module.name}' and imported from '{imported}'")
+            if owner != imported:
+                raise SyntaxError(f"'{name}' is imported from both '{owner}' and '{imported}'")
+    resolution = Resolver(BUILTIN_SLOTS).resolve(module.ast, lazy, list(interfaces.values()))
+    resolution.check()
+    imports = [Signature.from_interface(name, entry)
+               for interface in interfaces.values() for name, entry in interface.functions.items()]
+    check_types(module.ast, resolution.addresses, imports, lazy).check()
+
+class ModuleLoader:
+    """Loads a program and every module it imports, directly or not.
+
+    import reef.tides loads reef/tides.ks from the first of roots that has
+    it, and parse(source) turns each file into its AST. Every module is
+    loaded once, however many modules import it.
+    """
+    def __init__(self, roots, parse):
+        self.roots = roots
+        self.parse = parse
+        self.modules = {}  # Path -> Module
+
+    def module(self, path, ast=None):
+        module = self.modules.get(path)
+        if module is None:
+            try:
+                if ast is None:
+                    with open(path, encoding="utf-8") as f:
+                        ast = self.parse(f.read())
+                imports = resolve_imports(ast, self.roots, path)
+            except Exception as e:  # Whatever the parser raises, say which file it was reading
+                e.add_note(f"in module {path}")
+                raise
+            module = Module(module_name(path, self.roots), path, ast, imports, Interface.of(ast))
+            self.modules[path] = module
+        return module
+
+    def load(self, path, ast=None):
+        """Load the module in path (already parsed, if ast is given) and all it imports, dependencies first."""
+        order = []
+        done = set()
+        root = self.module(path, ast)
+        stack = [(root, iter(root.imports.values()))]  # Depth first, without recursing per import level
+        active = {root.path}
+        while stack:
+            module, pending = stack[-1]
+            dependency = next(pending, None)
+            if dependency is None:
+                stack.pop()
+                active.discard(module.path)
+                done.add(module.path)
+                order.append(module)
+            elif dependency in active:
+                cycle = [entry[0].name for entry in stack]
+                cycle = cycle[[entry[0].path for entry in stack].index(dependency):]
+                raise ImportError(f"Circular import: {' -> '.join(cycle + [cycle[0]])}")
+            elif dependency not in done:
+                module = self.module(dependency)
+                stack.append((module, iter(module.imports.values())))
+                active.add(dependency)
+        return order
+
+def link(modules):
+    """Join modules, dependencies first, into a single PROGRAM without import statements.
+
+    Every module's top-level statements run once, after those of the
+    modules it imports. Two modules may not declare the same name.
+    """
+    owners = {}
+    program_node = ASTNode(ASTNodeType.PROGRAM)
+    for module in modules:
+        for name in module.interface.names():
+            owner = owners.setdefault(name, module.name)
+            if owner != module.name:
+                raise SyntaxError(f"'{name}' is declared in both module '{owner}' and module '{module.name}'")
+        program_node.children.extend(child for child in module.ast.children if child.type != ASTNodeType.IMPORT)
+    return program_node
+
+def load_modules(path, program_node, parse, lazy=False):
+    """Load and check the program parsed from path and the modules it imports, dependencies first.
+
+    Imports are found relative to the program's directory. Each module is
+    checked against the interfaces of its own imports (with lazy=True, only
+    its top level is).
+    """
+    loader = ModuleLoader([os.path.dirname(path) or os.curdir], parse)
+    modules = loader.load(os.path.normpath(path), program_node)
+    for module in modules:
+        interfaces = {name: loader.modules[dependency].interface for name, dependency in module.imports.items()}
+        try:
+            check_module(module, interfaces, lazy)
+        except (SyntaxError, NameError, TypeError, ImportError) as e:
+            e.add_note(f"in module {module.path}")
+            raise
+    return modules
+
+def load_program(path, program_node, parse, lazy=False):
+    """The program parsed from path linked with the modules it imports, or as is if it imports none."""
+    if not imported_names(program_node):
+        return program_node
+    return link(load_modules(path, program_node, parse, lazy))
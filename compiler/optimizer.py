@@ -0,0 +1,455 @@
+import operator
+import time
+from ast_nodes import ASTNode, ASTNodeType, ArenaNode, is_name, literal_value
+from vm import format_value
+
+# Operators that can be evaluated at compile time. Semantics match the VM,
+# which applies the same Python operators at run time.
+FOLDABLE_OPERATORS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '<': operator.lt,
+    '>': operator.gt,
+    '<=': operator.le,
+    '>=': operator.ge,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+UNARY_FOLDABLE_OPERATORS = {
+    '-': operator.neg,
+    '!': operator.not_,
+}
+
+# Operators whose operands are always both evaluated and that have no side
+# effects, so identical subtrees built from them can safely be shared
+PURE_OPERATORS = frozenset(FOLDABLE_OPERATORS)
+
+# Operators whose right operand only runs depending on the left one
+SHORT_CIRCUIT_OPERATORS = frozenset(['&&', '||'])
+
+# Prefix for temporaries introduced by common-subexpression elimination
+TEMPORARY_PREFIX = "__ks_cse"
+
+def is_literal(node):
+    return node.type == ASTNodeType.EXPRESSION and not is_name(node.value)
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def to_literal(value):
+    """Turn a runtime value back into the token value an EXPRESSION node holds."""
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if isinstance(value, str):
+        return f'"{value}"'
+    return value
+
+def count_nodes(node):
+    count = 0
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node.children)
+    return count
+
+def declared_names(node):
+    """Count how often each name is declared (parameter, let, const, for) or assigned under node."""
+    counts = {}
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.type in (ASTNodeType.VARIABLE_DECLARATION, ASTNodeType.CONSTANT_DECLARATION, ASTNodeType.PARAMETER):
+            counts[node.value] = counts.get(node.value, 0) + 1
+        elif node.type in (ASTNodeType.FOR_LOOP, ASTNodeType.ASSIGNMENT):
+            name = node.children[0].value
+            counts[name] = counts.get(name, 0) + 1
+        stack.extend(node.children)
+    return counts
+
+def statement_expressions(node):
+    """Indices of the expression children a statement evaluates itself (not via nested blocks)."""
+    node_type = node.type
+    if node_type in (ASTNodeType.VARIABLE_DECLARATION, ASTNodeType.CONSTANT_DECLARATION,
+                     ASTNodeType.RETURN_STATEMENT, ASTNodeType.PRINT_STATEMENT, ASTNodeType.IF_STATEMENT):
+        return [0]
+    if node_type in (ASTNodeType.FOR_LOOP, ASTNodeType.ASSIGNMENT):
+        return [1]
+    return []
+
+def contains_assignment(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.type == ASTNodeType.ASSIGNMENT:
+            return True
+        stack.extend(node.children)
+    return False
+
+def calls_any(node, function_names):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.type == ASTNodeType.FUNCTION_CALL and node.value in function_names:
+            return True
+        stack.extend(node.children)
+    return False
+
+def is_statement_container(node):
+    return node.type in (ASTNodeType.PROGRAM, ASTNodeType.BLOCK)
+
+EXPRESSION_TYPES = (ASTNodeType.EXPRESSION, ASTNodeType.BINARY_OPERATION, ASTNodeType.UNARY_OPERATION,
+                    ASTNodeType.FUNCTION_CALL, ASTNodeType.ARRAY_LITERAL, ASTNodeType.TEMPLATE_STRING)
+
+class PassStats:
+    def __init__(self, name):
+        self.name = name
+        self.counters = {}
+        self.nodes_before = 0
+        self.nodes_after = 0
+        self.elapsed = 0.0
+
+    def count(self, counter, amount=1):
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def __repr__(self):
+        return f"PassStats({self.name}, {self.counters}, nodes {self.nodes_before}->{self.nodes_after})"
+
+class OptimizationPass:
+    """Base class for AST passes. run() may rewrite the tree in place and returns the new root."""
+    name = None
+
+    def run(self, program_node, stats):
+        raise NotImplementedError
+
+class ConstantFolding(OptimizationPass):
+    """Evaluates operations on literal operands and inlines literal const values."""
+    name = "constant-folding"
+
+    def run(self, program_node, stats):
+        self.stats = stats
+        top_level_declarations = {}
+        for child in program_node.children:
+            if child.type != ASTNodeType.FUNCTION_DECLARATION:
+                for name, count in declared_names(child).items():
+                    top_level_declarations[name] = top_level_declarations.get(name, 0) + count
+
+        env = {}
+        self.fold_statements(program_node, env, top_level_declarations)
+        # A function can run before later constants are declared, so it only sees the earlier ones
+        initialized = self.initialized_constants(program_node)
+        function_env = {name: value for name, value in env.items() if name in initialized}
+
+        for child in program_node.children:
+            if child.type == ASTNodeType.FUNCTION_DECLARATION:
+                params, return_type, body = child.children[:3]
+                for param in params.children:
+                    if len(param.children) > 1:
+                        param.children[1] = self.fold_expression(param.children[1], function_env)
+                local_declarations = declared_names(child)
+                # Locals and parameters shadow top-level constants
+                local_env = {name: value for name, value in function_env.items() if name not in local_declarations}
+                self.fold_statements(body, local_env, local_declarations)
+        return program_node
+
+    def initialized_constants(self, program_node):
+        """Names of the top-level constants declared before any function can run (see PurityAnalysis)."""
+        functions = {child.value for child in program_node.children
+                     if child.type == ASTNodeType.FUNCTION_DECLARATION}
+        constants = set()
+        for child in program_node.children:
+            if child.type == ASTNodeType.FUNCTION_DECLARATION:
+                continue
+            if calls_any(child, functions):
+                break
+            if child.type == ASTNodeType.CONSTANT_DECLARATION:
+                constants.add(child.value)
+        return constants
+
+    def fold_statements(self, container, env, declarations):
+        statements = container.children
+        for index, node in enumerate(statements):
+            if node.type == ASTNodeType.FUNCTION_DECLARATION:
+                continue
+            if node.type in EXPRESSION_TYPES:
+                statements[index] = self.fold_expression(node, env)
+                continue
+            for child_index in statement_expressions(node):
+                node.children[child_index] = self.fold_expression(node.children[child_index], env)
+            # Only constants declared exactly once in scope are safe to inline
+            if node.type == ASTNodeType.CONSTANT_DECLARATION and is_literal(node.children[0]) \
+                    and declarations.get(node.value) == 1:
+                env[node.value] = node.children[0].value
+            for child in node.children:
+                if child.type == ASTNodeType.BLOCK:
+                    # Constants declared in the block go out of scope with it
+                    self.fold_statements(child, dict(env), declarations)
+
+    def fold_expression(self, node, env):
+        if node.type == ASTNodeType.EXPRESSION:
+            if is_name(node.value) and node.value in env:
+                self.stats.count("constants_propagated")
+                return ASTNode(ASTNodeType.EXPRESSION, env[node.value])
+            return node
+        children = node.children
+        if node.type == ASTNodeType.ASSIGNMENT:
+            # The target is a name being written, not a use of its value
+            children[1] = self.fold_expression(children[1], env)
+            return node
+        for index, child in enumerate(children):
+            children[index] = self.fold_expression(child, env)
+        if node.type == ASTNodeType.TEMPLATE_STRING:
+            if all(is_literal(child) for child in children):
+                self.stats.count("templates_folded")
+                text = "".join(format_value(literal_value(child.value)) for child in children)
+                return ASTNode(ASTNodeType.EXPRESSION, to_literal(text))
+            return node
+        if node.type == ASTNodeType.UNARY_OPERATION and node.value in UNARY_FOLDABLE_OPERATORS:
+            operand = children[0]
+            if is_literal(operand):
+                value = literal_value(operand.value)
+                if node.value == '!' or is_number(value):
+                    self.stats.count("operations_folded")
+                    return ASTNode(ASTNodeType.EXPRESSION, to_literal(UNARY_FOLDABLE_OPERATORS[node.value](value)))
+            return node
+        if node.type == ASTNodeType.BINARY_OPERATION and node.value in FOLDABLE_OPERATORS:
+            left, right = children
+            if is_literal(left) and is_literal(right):
+                left_value, right_value = literal_value(left.value), literal_value(right.value)
+                if is_number(left_value) and is_number(right_value):
+                    try:
+                        result = FOLDABLE_OPERATORS[node.value](left_value, right_value)
+                    except ZeroDivisionError:
+                        return node  # Leave the error for run time
+                    self.stats.count("operations_folded")
+                    return ASTNode(ASTNodeType.EXPRESSION, to_literal(result))
+        return node
+
+class DeadBranchElimination(OptimizationPass):
+    """Removes if-branches with literal conditions, empty literal loops and code after return."""
+    name = "dead-branch-elimination"
+
+    def run(self, program_node, stats):
+        self.stats = stats
+        self.prune(program_node)
+        return program_node
+
+    def prune(self, container):
+        statements = []
+        for index, node in enumerate(container.children):
+            node = self.simplify(node)
+            if node is None:
+                continue
+            statements.append(node)
+            if node.type == ASTNodeType.RETURN_STATEMENT and container.type == ASTNodeType.BLOCK:
+                removed = len(container.children) - index - 1
+                if removed:
+                    self.stats.count("unreachable_statements_removed", removed)
+                break
+        container.children[:] = statements
+
+    def simplify(self, node):
+        node_type = node.type
+        if node_type == ASTNodeType.IF_STATEMENT:
+            condition = node.children[0]
+            if is_literal(condition):
+                self.stats.count("branches_removed")
+                if literal_value(condition.value):
+                    node = node.children[1]
+                elif len(node.children) > 2:
+                    node = node.children[2]
+                else:
+                    return None
+                return self.simplify(node)
+        elif node_type == ASTNodeType.FOR_LOOP:
+            collection = node.children[1]
+            if collection.type == ASTNodeType.ARRAY_LITERAL and not collection.children:
+                self.stats.count("loops_removed")
+                return None
+        for child in node.children:
+            if is_statement_container(child):
+                self.simplify(child)
+        if is_statement_container(node):
+            self.prune(node)
+        return node
+
+class CommonSubexpressionElimination(OptimizationPass):
+    """Computes repeated pure subexpressions of a statement once, in a temporary.
+
+    Only subtrees made of literals, names and PURE_OPERATORS are shared, and
+    only when evaluating them again costs more than storing and reloading
+    the temporary. Statements that assign, or that call an @ink function
+    PurityAnalysis cannot prove pure, are left alone: the call could change
+    a global between two occurrences, or print before a hoisted division
+    raises.
+    """
+    name = "common-subexpression-elimination"
+
+    def run(self, program_node, stats):
+        self.stats = stats
+        self.temporaries = 0
+        self.impure_functions = self.find_impure_functions(program_node)
+        self.visit_container(program_node)
+        return program_node
+
+    def find_impure_functions(self, program_node):
+        from bytecode import BUILTIN_SLOTS
+        from memoize import PurityAnalysis
+        from resolver import Resolver
+
+        resolution = Resolver(BUILTIN_SLOTS).resolve(program_node)
+        functions = {child.value for child in program_node.children
+                     if child.type == ASTNodeType.FUNCTION_DECLARATION}
+        if resolution.errors:
+            return functions  # The compiler reports the error; until then no call is known to be pure
+        # An @ink memo annotation promises memoizing is fine, not that the body has no effects
+        analysis = PurityAnalysis(program_node, resolution.addresses, trust_annotations=False)
+        return {name for name, reason in analysis.analyze().items() if reason is not None}
+
+    def visit_container(self, container):
+        statements = []
+        for node in container.children:
+            if node.type in EXPRESSION_TYPES:
+                holder = ASTNode(ASTNodeType.BLOCK)
+                holder.children = [node]
+                statements.extend(self.eliminate(holder, [0]))
+                statements.append(holder.children[0])
+                continue
+            statements.extend(self.eliminate(node, statement_expressions(node)))
+            statements.append(node)
+            for child in node.children:
+                if is_statement_container(child):
+                    self.visit_container(child)
+        container.children[:] = statements
+
+    def eliminate(self, node, indices):
+        """Rewrite the statement's expressions; return the temporaries to declare before it."""
+        declarations = []
+        # An assignment or impure call inside the statement could change a name between two occurrences
+        if any(contains_assignment(node.children[index]) or calls_any(node.children[index], self.impure_functions)
+               for index in indices):
+            return declarations
+        while True:
+            occurrences = {}
+            for index in indices:
+                self.collect(node.children[index], occurrences)
+            best = None
+            for key, (size, nodes) in occurrences.items():
+                count = len(nodes)
+                # Recomputing costs size nodes per extra use; sharing costs a store and a load per use
+                if count > 1 and size * (count - 1) > count + 1 and (best is None or size > best[0]):
+                    best = (size, key)
+            if best is None:
+                return declarations
+            name = f"{TEMPORARY_PREFIX}{self.temporaries}"
+            self.temporaries += 1
+            key = best[1]
+            expression = None
+            for index in indices:
+                node.children[index], expression = self.replace(node.children[index], key, name, expression)
+            declaration = ASTNode(ASTNodeType.VARIABLE_DECLARATION, name)
+            declaration.add_child(expression)
+            declarations.append(declaration)
+            self.stats.count("temporaries")
+            self.stats.count("subexpressions_reused", len(occurrences[key][1]) - 1)
+
+    def collect(self, node, occurrences):
+        """Return (key, size) for pure subtrees, recording BINARY_OPERATION occurrences."""
+        if node.type == ASTNodeType.EXPRESSION:
+            return (node.value.__class__, node.value), 1
+        pure = node.type == ASTNodeType.BINARY_OPERATION and node.value in PURE_OPERATORS
+        children = node.children
+        if node.type == ASTNodeType.BINARY_OPERATION and node.value in SHORT_CIRCUIT_OPERATORS:
+            # The right operand may never run, so nothing in it can be computed ahead of the statement
+            children = children[:1]
+        keys = []
+        size = 1
+        for child in children:
+            key, child_size = self.collect(child, occurrences)
+            keys.append(key)
+            if key is None:
+                pure = False
+            size += child_size
+        if not pure:
+            return None, size
+        key = (node.value, tuple(keys))
+        entry = occurrences.setdefault(key, (size, []))
+        entry[1].append(node)
+        return key, size
+
+    def key(self, node):
+        if node.type == ASTNodeType.EXPRESSION:
+            return (node.value.__class__, node.value)
+        if node.type != ASTNodeType.BINARY_OPERATION or node.value not in PURE_OPERATORS:
+            return None
+        keys = tuple(self.key(child) for child in node.children)
+        if None in keys:
+            return None
+        return (node.value, keys)
+
+    def replace(self, node, key, name, expression):
+        if node.type == ASTNodeType.BINARY_OPERATION and self.key(node) == key:
+            return ASTNode(ASTNodeType.EXPRESSION, name), expression or node
+        children = node.children
+        for index, child in enumerate(children):
+            children[index], expression = self.replace(child, key, name, expression)
+        return node, expression
+
+DEFAULT_PASSES = (ConstantFolding, DeadBranchElimination, CommonSubexpressionElimination)
+
+class PassManager:
+    """Runs a configurable sequence of optimization passes over a PROGRAM AST.
+
+    Passes can be switched off by name; per-pass counters, node counts and
+    timings are collected in self.stats after run().
+    """
+    def __init__(self, passes=DEFAULT_PASSES, disabled=()):
+        self.passes = [optimization_pass() for optimization_pass in passes]
+        self.disabled = set(disabled)
+        unknown = self.disabled - {optimization_pass.name for optimization_pass in self.passes}
+        if unknown:
+            raise ValueError(f"Unknown optimization passes: {', '.join(sorted(unknown))}")
+        self.stats = []
+
+    def enable(self, name):
+        self.disabled.discard(name)
+
+    def disable(self, name):
+        self.disabled.add(name)
+
+    def run(self, program_node):
+        if isinstance(program_node, ArenaNode):
+            raise TypeError("Optimization passes rewrite the tree and need ASTNode trees, not a compact ASTArena")
+        from parser import LazyBlock
+        if any(isinstance(child.children[2], LazyBlock) and not child.children[2].parsed
+               for child in program_node.children if child.type == ASTNodeType.FUNCTION_DECLARATION):
+            # Every pass reads every body, which would parse them all and defeat lazy parsing
+            raise TypeError("Optimization passes need every function body parsed; parse without lazy=True")
+        self.stats = []
+        for optimization_pass in self.passes:
+            if optimization_pass.name in self.disabled:
+                continue
+            stats = PassStats(optimization_pass.name)
+            stats.nodes_before = count_nodes(program_node)
+            start = time.perf_counter()
+            program_node = optimization_pass.run(program_node, stats)
+            stats.elapsed = time.perf_counter() - start
+            stats.nodes_after = count_nodes(program_node)
+            self.stats.append(stats)
+        return program_node
+
+    def report(self):
+        lines = []
+        for stats in self.stats:
+            counters = ", ".join(f"{name}={value}" for name, value in sorted(stats.counters.items())) or "no changes"
+            lines.append(f"{stats.name}: {counters}; nodes {stats.nodes_before} -> {stats.nodes_after} "
+                         f"in {stats.elapsed * 1000:.2f}ms")
+        return "\n".join(lines)
+
+def optimize(program_node, disabled=()):
+    return PassManager(disabled=disabled).run(program_node)
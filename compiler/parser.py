@@ -1,24 +1,239 @@
 import re
 from enum import Enum, auto
-from lexer import TokenType, Token, lex
-import colorama
-from ast_nodes import ASTNode, ASTNodeType, pretty_print_ast
+from lexer import TokenType, Token, TokenStream, lex, stream_lex, DEFAULT_CHUNK_SIZE
+from ast_nodes import ASTNode, ASTNodeType, ASTArena, is_name, pretty_print_ast
+from tracing import Tracer, ignore, resolve_sinks
+
+# Entry message for each traced grammar rule, and whether the rule's own
+# messages are indented one level deeper. Rules are only wrapped with this
+# bookkeeping when tracing is enabled.
+RULE_TRACE_MESSAGES = {
+    'parse_program': ("Parsing program", True),
+    'parse_function_declaration': ("Parsing function declaration", True),
+    'parse_parameters': ("Parsing parameters", True),
+    'parse_block': ("Parsing block", True),
+    'parse_variable_declaration': ("Parsing variable declaration", True),
+    'parse_return_statement': ("Parsing return statement", True),
+    'parse_if_statement': ("Parsing if statement", True),
+    'parse_for_loop': ("Parsing for loop", True),
+    'parse_print_statement': ("Parsing print statement", True),
+    'parse_import_statement': ("Parsing import statement", True),
+    'parse_function_call': ("Parsing function call to {}", True),
+    'parse_expression': ("Parsing expression", False),
+}
+
+# Grammar rules timed and counted when a Profile is attached
+PROFILED_RULES = list(RULE_TRACE_MESSAGES) + ['parse_top_level_statement', 'parse_expression_statement',
+                                              'parse_primary', 'parse_array_literal', 'parse_template']
+
+# Statement rules keyed by the (type, value) of their first token; a None
+# value stands for any token of that type. A token without a rule cannot
+# start a statement, which is a syntax error.
+BLOCK_STATEMENT_RULES = {
+    (TokenType.KEYWORD, 'let'): 'parse_variable_declaration',
+    (TokenType.KEYWORD, 'const'): 'parse_variable_declaration',
+    (TokenType.KEYWORD, 'return'): 'parse_return_statement',
+    (TokenType.KEYWORD, 'if'): 'parse_if_statement',
+    (TokenType.KEYWORD, 'for'): 'parse_for_loop',
+    (TokenType.KEYWORD, 'print'): 'parse_print_statement',
+    (TokenType.KEYWORD, 'import'): 'parse_import_statement',
+    (TokenType.IDENTIFIER, None): 'parse_expression_statement',
+    (TokenType.INTEGER, None): 'parse_expression_statement',
+    (TokenType.FLOAT, None): 'parse_expression_statement',
+    (TokenType.STRING, None): 'parse_expression_statement',
+    (TokenType.BOOLEAN, None): 'parse_expression_statement',
+    (TokenType.DELIMITER, '('): 'parse_expression_statement',
+    (TokenType.DELIMITER, '['): 'parse_expression_statement',
+    **{(TokenType.OPERATOR, operator): 'parse_expression_statement' for operator in ('-', '!')},
+    (TokenType.COMMENT, None): 'skip_token',
+    (TokenType.EOF, None): 'skip_token',
+}
+
+# Functions can only be declared at the top level
+TOP_LEVEL_STATEMENT_RULES = {
+    (TokenType.KEYWORD, '@ink'): 'parse_function_declaration',
+    **BLOCK_STATEMENT_RULES,
+}
+
+# Words allowed between @ink and the function name. They become an
+# ANNOTATION node, the optional fourth child of FUNCTION_DECLARATION.
+FUNCTION_ANNOTATIONS = frozenset(['memo', 'nomemo'])
+
+# Keywords whose header ends in a '~' that opens a block rather than closing one
+BLOCK_HEADER_KEYWORDS = frozenset(['if', 'else', 'for'])
+
+# Binary operators: symbol -> (binding power, right associative, node type).
+# Higher powers bind tighter. A new operator needs an entry here and code
+# generation for its node.
+BINARY_OPERATORS = {
+    '=': (1, True, ASTNodeType.ASSIGNMENT),
+    '||': (2, False, ASTNodeType.BINARY_OPERATION),
+    '&&': (3, False, ASTNodeType.BINARY_OPERATION),
+    '==': (4, False, ASTNodeType.BINARY_OPERATION),
+    '!=': (4, False, ASTNodeType.BINARY_OPERATION),
+    '<': (5, False, ASTNodeType.BINARY_OPERATION),
+    '>': (5, False, ASTNodeType.BINARY_OPERATION),
+    '<=': (5, False, ASTNodeType.BINARY_OPERATION),
+    '>=': (5, False, ASTNodeType.BINARY_OPERATION),
+    '+': (6, False, ASTNodeType.BINARY_OPERATION),
+    '-': (6, False, ASTNodeType.BINARY_OPERATION),
+    '*': (7, False, ASTNodeType.BINARY_OPERATION),
+    '/': (7, False, ASTNodeType.BINARY_OPERATION),
+}
+
+# Prefix operators bind tighter than every binary operator
+PREFIX_OPERATORS = frozenset(['-', '!'])
+
+TEMPLATE_OPEN = "{{"
+TEMPLATE_CLOSE = "}}"
+
+def split_template(text):
+    """Split a quoted string token into literal text and the tokens of each {{expression}}.
+
+    Returns a tuple of plain strings and (offset, tokens) pairs in source
+    order, where offset is the index in text at which the expression
+    starts; empty literal pieces are left out. Token positions count from
+    the start of the expression (see place_tokens).
+    """
+    body = text[1:-1]
+    segments = []
+    position = 0
+    while True:
+        start = body.find(TEMPLATE_OPEN, position)
+        if start < 0:
+            break
+        end = body.find(TEMPLATE_CLOSE, start + len(TEMPLATE_OPEN))
+        if end < 0:
+            raise SyntaxError(f"Unclosed '{TEMPLATE_OPEN}' in string {text}")
+        if start > position:
+            segments.append(body[position:start])
+        offset = start + len(TEMPLATE_OPEN)
+        segments.append((offset + 1, lex(body[offset:end])))  # + 1 for the opening quote
+        position = end + len(TEMPLATE_CLOSE)
+    if position < len(body):
+        segments.append(body[position:])
+    return tuple(segments)
+
+def place_tokens(tokens, text, offset, line, column):
+    """Copies of an embedded expression's tokens, positioned in the source the string token text came from."""
+    prefix = text[:offset]
+    newline = prefix.rfind("\n")
+    if newline < 0:
+        start_line, start_column = line, column + offset
+    else:
+        start_line, start_column = line + prefix.count("\n"), offset - newline
+    return [Token(token.type, token.value, start_line + token.line - 1,
+                  start_column + token.column - 1 if token.line == 1 else token.column)
+            for token in tokens]
+
+class LazyBlock(ASTNode):
+    """The BLOCK of an @ink body, parsed from its token range on first access to children.
+
+    A parse error in the body is raised by that first access, and again by
+    every later one. The parser, and with it the token list, stays alive
+    until every lazy body it produced has been parsed.
+    """
+    def __init__(self, parser, name, start, end):
+        self.type = ASTNodeType.BLOCK
+        self.value = None
+        self.parser = parser
+        self.name = name
+        self.start = start
+        self.end = end
+        self.parsed_children = None
+
+    @property
+    def parsed(self):
+        return self.parsed_children is not None
+
+    @property
+    def children(self):
+        if self.parsed_children is None:
+            self.parsed_children = self.parser.parse_lazy_block(self).children
+            self.parser = None
+        return self.parsed_children
+
+    @children.setter
+    def children(self, children):
+        self.parsed_children = children
+        self.parser = None
 
 class Parser:
-    def __init__(self, tokens, debug=False):
+    def __init__(self, tokens, debug=False, compact=False, sinks=None, profile=None, positions=False, lazy=False):
+        # Anything that can't be indexed (e.g. the generator from stream_lex)
+        # is consumed through a lookahead window instead of a full list
+        if not hasattr(tokens, '__getitem__'):
+            tokens = TokenStream(tokens)
+        if isinstance(tokens, TokenStream):
+            self.current_token = self.stream_current_token
         self.tokens = tokens
+        # Skipping a body needs random access to its tokens and a node that can parse itself
+        self.lazy = lazy and not compact and not isinstance(tokens, TokenStream)
+        # Compact mode builds the tree in an ASTArena instead of ASTNode objects
+        self.arena = ASTArena() if compact else None
+        self.new_node = self.arena.new_node if compact else ASTNode
         self.position = 0
-        self.debug = debug
         self.indent_level = 0
-
-    def debug_log(self, message, color=colorama.Fore.CYAN):
+        # Interned template splits: string token value -> split_template result
+        self.templates = {}
+        self.tracer = Tracer("Parser", resolve_sinks(debug, sinks))
+        self.debug = self.tracer.enabled
         if self.debug:
-            indent = "  " * self.indent_level
-            print(f"{color}Parser - DEBUG: {indent}{message}{colorama.Fore.RESET}")
+            for name, (message, indented) in RULE_TRACE_MESSAGES.items():
+                setattr(self, name, self.traced_rule(getattr(self, name), message, indented))
+        else:
+            self.debug_log = ignore
+        self.profile = profile
+        self.positions = positions and not compact
+        if profile is not None:
+            for name in PROFILED_RULES:
+                setattr(self, name, profile.wrap_rule(name, getattr(self, name), self))
+            self.match = profile.wrap_match(self.match)
+            # AST construction shows up as its own entry next to the rules
+            self.new_node = profile.wrap_rule('new_node', self.new_node, self)
+        # Source positions are stamped on ASTNode trees only; ArenaNode rows have no room for them
+        if positions and not compact:
+            for name in {*TOP_LEVEL_STATEMENT_RULES.values(), 'parse_expression', 'parse_primary'}:
+                setattr(self, name, self.positioned_rule(getattr(self, name)))
+        # Bound after wrapping so dispatched rules are traced and profiled too
+        self.top_level_rules = self.bind_rules(TOP_LEVEL_STATEMENT_RULES)
+        self.block_rules = self.bind_rules(BLOCK_STATEMENT_RULES)
+
+    def bind_rules(self, rules):
+        return {key: getattr(self, name) for key, name in rules.items()}
+
+    def debug_log(self, message, *args, level='debug'):
+        self.tracer.log(message, args, level, self.indent_level)
+
+    def traced_rule(self, rule, message, indented):
+        def traced(*args):
+            self.debug_log(message, *args)
+            if not indented:
+                return rule(*args)
+            self.indent_level += 1
+            try:
+                return rule(*args)
+            finally:
+                self.indent_level -= 1
+        return traced
+
+    def positioned_rule(self, rule):
+        """Wrap rule to give the node it returns the line and column of its first token."""
+        def positioned(*args):
+            token = self.current_token()
+            node = rule(*args)
+            if node is not None and node.line is None:
+                node.line = token.line
+                node.column = token.column
+            return node
+        return positioned
 
     def current_token(self):
         return self.tokens[self.position] if self.position < len(self.tokens) else None
 
+    def stream_current_token(self):
+        return self.tokens.get(self.position)
+
     def next_token(self):
         self.position += 1
         return self.current_token()
@@ -27,9 +242,9 @@ class Parser:
         if self.current_token() and self.current_token().type == token_type and (value is None or self.current_token().value == value):
             token = self.current_token()
             self.next_token()
-            self.debug_log(f"Matched {token_type}: '{token.value}'")
+            self.debug_log("Matched {}: '{}'", token_type, token.value)
             return token
-        self.debug_log(f"Failed to match {token_type}")
+        self.debug_log("Failed to match {}", token_type)
         return None
 
     def parse(self):
@@ -41,37 +256,44 @@ class Parser:
         return result
 
     def parse_program(self):
-        self.debug_log("Parsing program")
-        self.indent_level += 1
-        program_node = ASTNode(ASTNodeType.PROGRAM)
+        program_node = self.new_node(ASTNodeType.PROGRAM)
         while self.current_token():
-            if self.current_token().type == TokenType.COMMENT:
-                self.next_token()  # Skip comments
-            elif self.current_token().type == TokenType.KEYWORD:
-                if self.current_token().value == "@ink":
-                    program_node.add_child(self.parse_function_declaration())
-                elif self.current_token().value in ["let", "const"]:
-                    program_node.add_child(self.parse_variable_declaration())
-                elif self.current_token().value == "return":
-                    program_node.add_child(self.parse_return_statement())
-                elif self.current_token().value == "if":
-                    program_node.add_child(self.parse_if_statement())
-                elif self.current_token().value == "for":
-                    program_node.add_child(self.parse_for_loop())
-                elif self.current_token().value == "print":
-                    program_node.add_child(self.parse_print_statement())
-            else:
-                self.next_token()
-        self.indent_level -= 1
+            statement = self.parse_top_level_statement()
+            if statement is not None:
+                program_node.add_child(statement)
         return program_node
 
+    def parse_top_level_statement(self):
+        """Parse one program-level statement, or skip a comment or the end of input and return None."""
+        return self.parse_statement(self.top_level_rules)
+
+    def parse_statement(self, rules):
+        token = self.current_token()
+        rule = rules.get((token.type, token.value)) or rules.get((token.type, None))
+        if rule is not None:
+            return rule()
+        raise SyntaxError(f"Unexpected token at the start of a statement: {token}")
+
+    def skip_token(self):
+        self.next_token()
+        return None
+
+    def parse_expression_statement(self):
+        expression = self.parse_expression()
+        if self.current_token() and self.current_token().type == TokenType.DELIMITER and self.current_token().value == ";":
+            self.next_token()  # Skip semicolon
+        return expression
+
     def parse_function_declaration(self):
-        self.debug_log("Parsing function declaration")
-        self.indent_level += 1
         self.match(TokenType.KEYWORD)  # @ink
         name = self.match(TokenType.IDENTIFIER)
         if not name:
             raise SyntaxError("Expected function name after @ink")
+        annotation = None
+        if name.value in FUNCTION_ANNOTATIONS and self.current_token() \
+                and self.current_token().type == TokenType.IDENTIFIER:
+            annotation = name.value
+            name = self.match(TokenType.IDENTIFIER)
         name = name.value
         self.match(TokenType.DELIMITER)  # (
         params = self.parse_parameters()
@@ -87,22 +309,28 @@ class Parser:
             return_type = return_type.value
 
         self.match(TokenType.BLOCK_DELIMITER)  # ~
-        body = self.parse_block()
+        if self.lazy:
+            start = self.position
+            self.position = self.skip_block()
+            body = LazyBlock(self, name, start, self.position)
+        else:
+            body = self.parse_block()
+        self.match(TokenType.BLOCK_DELIMITER)  # ~
         
-        node = ASTNode(ASTNodeType.FUNCTION_DECLARATION, name)
+        node = self.new_node(ASTNodeType.FUNCTION_DECLARATION, name)
         node.add_child(params)
-        node.add_child(ASTNode(ASTNodeType.RETURN_TYPE, return_type or "None"))
+        node.add_child(self.new_node(ASTNodeType.RETURN_TYPE, return_type or "None"))
         node.add_child(body)
+        if annotation is not None:
+            node.add_child(self.new_node(ASTNodeType.ANNOTATION, annotation))
 
-        param_str = ", ".join([f"{p.value}: {p.children[0].value}{' = ' + str(p.children[1].value) if len(p.children) > 1 else ''}" for p in params.children])
-        self.debug_log(f"Parsed function: {name}({param_str}) -> {return_type or 'None'}")
-        self.indent_level -= 1
+        if self.debug:
+            param_str = ", ".join([f"{p.value}: {p.children[0].value}{' = ' + str(p.children[1].value) if len(p.children) > 1 else ''}" for p in params.children])
+            self.debug_log("Parsed function: {}({}) -> {}", name, param_str, return_type or 'None')
         return node
 
     def parse_parameters(self):
-        self.debug_log("Parsing parameters")
-        self.indent_level += 1
-        params = ASTNode(ASTNodeType.PARAMETERS)
+        params = self.new_node(ASTNodeType.PARAMETERS)
         while self.current_token() and (self.current_token().type != TokenType.DELIMITER or self.current_token().value != ")"):
             param_name = self.match(TokenType.IDENTIFIER)
             if not param_name:
@@ -111,198 +339,303 @@ class Parser:
             param_type = self.match(TokenType.IDENTIFIER)
             if not param_type:
                 raise SyntaxError(f"Expected type for parameter {param_name.value}")
-            param_node = ASTNode(ASTNodeType.PARAMETER, param_name.value)
-            param_node.add_child(ASTNode(ASTNodeType.TYPE, param_type.value))
+            param_node = self.new_node(ASTNodeType.PARAMETER, param_name.value)
+            param_node.add_child(self.new_node(ASTNodeType.TYPE, param_type.value))
+            default_value = None
             if self.current_token() and self.current_token().type == TokenType.OPERATOR and self.current_token().value == "=":
                 self.match(TokenType.OPERATOR)  # =
                 default_value = self.parse_expression()
                 param_node.add_child(default_value)
             params.add_child(param_node)
-            self.debug_log(f"Parsed parameter: {param_name.value}: {param_type.value}{' = ' + str(default_value.value) if 'default_value' in locals() else ''}")
+            self.debug_log("Parsed parameter: {}: {}{}", param_name.value, param_type.value, '' if default_value is None else f" = {default_value.value}")
             if self.current_token() and self.current_token().type == TokenType.DELIMITER and self.current_token().value == ",":
                 self.match(TokenType.DELIMITER)  # ,
-        self.indent_level -= 1
         return params
 
+    def skip_block(self):
+        """Position of the '~' that closes the block just opened, found without parsing it.
+
+        A '~' after an if, else or for header opens a nested block; any other
+        '~' closes the innermost one. Without a closing '~' the block runs to
+        the end of the tokens, as it does for parse_block.
+        """
+        BLOCK_DELIMITER = TokenType.BLOCK_DELIMITER
+        KEYWORD = TokenType.KEYWORD
+        tokens = self.tokens
+        depth = 1
+        header = False
+        for position in range(self.position, len(tokens)):
+            token = tokens[position]
+            if token.type is BLOCK_DELIMITER:
+                if header:
+                    depth += 1
+                    header = False
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        return position
+            elif token.type is KEYWORD and token.value in BLOCK_HEADER_KEYWORDS:
+                header = True
+        return len(tokens)
+
+    def parse_lazy_block(self, block):
+        saved = self.position
+        self.position = block.start
+        try:
+            body = self.parse_block()
+            # Only token sequences no eager parse accepts either can end elsewhere
+            if self.position != block.end:
+                raise SyntaxError(f"Cannot parse the body of '{block.name}': its '~' delimiters do not match up")
+        finally:
+            self.position = saved
+        return body
+
     def parse_block(self):
-        self.debug_log("Parsing block")
-        self.indent_level += 1
-        block_node = ASTNode(ASTNodeType.BLOCK)
+        block_node = self.new_node(ASTNodeType.BLOCK)
+        rules = self.block_rules
         while self.current_token() and self.current_token().type != TokenType.BLOCK_DELIMITER:
-            if self.current_token().type == TokenType.KEYWORD:
-                if self.current_token().value == "return":
-                    block_node.add_child(self.parse_return_statement())
-                elif self.current_token().value == "if":
-                    block_node.add_child(self.parse_if_statement())
-                elif self.current_token().value == "for":
-                    block_node.add_child(self.parse_for_loop())
-                elif self.current_token().value == "print":
-                    block_node.add_child(self.parse_print_statement())
-                elif self.current_token().value in ["let", "const"]:
-                    block_node.add_child(self.parse_variable_declaration())
-                else:
-                    self.debug_log(f"Skipping unknown keyword: {self.current_token().value}")
-                    self.next_token()  # Skip unknown keywords
-            elif self.current_token().type == TokenType.IDENTIFIER:
-                expression = self.parse_expression()
-                block_node.add_child(expression)
-                if self.current_token() and self.current_token().type == TokenType.DELIMITER and self.current_token().value == ";":
-                    self.next_token()  # Skip semicolon
-            else:
-                self.debug_log(f"Skipping unknown token: {self.current_token().value}")
-                self.next_token()  # Skip unknown tokens
-        self.indent_level -= 1
+            statement = self.parse_statement(rules)
+            if statement is not None:
+                block_node.add_child(statement)
         return block_node
 
     def parse_variable_declaration(self):
-        self.debug_log("Parsing variable declaration")
-        self.indent_level += 1
         keyword = self.match(TokenType.KEYWORD).value
         name = self.match(TokenType.IDENTIFIER).value
         self.match(TokenType.OPERATOR)  # =
         value = self.parse_expression()
+        self.match(TokenType.DELIMITER, ";")
         node_type = ASTNodeType.VARIABLE_DECLARATION if keyword == "let" else ASTNodeType.CONSTANT_DECLARATION
-        node = ASTNode(node_type, name)
+        node = self.new_node(node_type, name)
         node.add_child(value)
-        self.debug_log(f"Parsed variable declaration: {name} = {value.value}")
-        self.indent_level -= 1
+        self.debug_log("Parsed variable declaration: {} = {}", name, value.value)
         return node
 
     def parse_return_statement(self):
-        self.debug_log("Parsing return statement")
-        self.indent_level += 1
         self.match(TokenType.KEYWORD)  # return
         value = self.parse_expression()
         self.match(TokenType.DELIMITER)  # ;
-        self.debug_log(f"Parsed return statement: return {value.value}")
-        self.indent_level -= 1
-        return_node = ASTNode(ASTNodeType.RETURN_STATEMENT)
+        self.debug_log("Parsed return statement: return {}", value.value)
+        return_node = self.new_node(ASTNodeType.RETURN_STATEMENT)
         return_node.add_child(value)
         return return_node
 
     def parse_if_statement(self):
-        self.debug_log("Parsing if statement")
-        self.indent_level += 1
         self.match(TokenType.KEYWORD)  # if
         condition = self.parse_expression()
         self.match(TokenType.BLOCK_DELIMITER)  # ~
         body = self.parse_block()
         self.match(TokenType.BLOCK_DELIMITER)  # ~
-        self.debug_log(f"Parsed if statement: if {condition.value} {{ ... }}")
-        self.indent_level -= 1
-        node = ASTNode(ASTNodeType.IF_STATEMENT)
+        self.debug_log("Parsed if statement: if {} {{ ... }}", condition.value)
+        node = self.new_node(ASTNodeType.IF_STATEMENT)
         node.add_child(condition)
         node.add_child(body)
+        token = self.current_token()
+        if token is not None and token.type == TokenType.KEYWORD and token.value == "else":
+            self.next_token()
+            token = self.current_token()
+            if token is not None and token.type == TokenType.KEYWORD and token.value == "if":
+                # else if: the alternative is a block holding the nested if
+                alternative = self.new_node(ASTNodeType.BLOCK)
+                alternative.add_child(self.parse_if_statement())
+            else:
+                self.match(TokenType.BLOCK_DELIMITER)  # ~
+                alternative = self.parse_block()
+                self.match(TokenType.BLOCK_DELIMITER)  # ~
+            node.add_child(alternative)
         return node
 
     def parse_for_loop(self):
-        self.debug_log("Parsing for loop")
-        self.indent_level += 1
         self.match(TokenType.KEYWORD)  # for
         variable = self.match(TokenType.IDENTIFIER).value
-        self.match(TokenType.KEYWORD)  # in
+        self.match(TokenType.IDENTIFIER, "in")  # 'in' is lexed as an identifier
         collection = self.parse_expression()
         self.match(TokenType.BLOCK_DELIMITER)  # ~
         body = self.parse_block()
         self.match(TokenType.BLOCK_DELIMITER)  # ~
-        self.debug_log(f"Parsed for loop: for {variable} in {collection.value} {{ ... }}")
-        self.indent_level -= 1
-        node = ASTNode(ASTNodeType.FOR_LOOP)
-        node.add_child(variable)
+        self.debug_log("Parsed for loop: for {} in {} {{ ... }}", variable, collection.value)
+        node = self.new_node(ASTNodeType.FOR_LOOP)
+        node.add_child(self.new_node(ASTNodeType.EXPRESSION, variable))
         node.add_child(collection)
         node.add_child(body)
         return node
 
     def parse_print_statement(self):
-        self.debug_log("Parsing print statement")
-        self.indent_level += 1
         self.match(TokenType.KEYWORD, "print")
         self.match(TokenType.DELIMITER, "(")
         value = self.parse_expression()
         self.match(TokenType.DELIMITER, ")")
         self.match(TokenType.DELIMITER, ";")
-        self.debug_log(f"Parsed print statement: print({value.value})")
-        self.indent_level -= 1
-        node = ASTNode(ASTNodeType.PRINT_STATEMENT)
+        self.debug_log("Parsed print statement: print({})", value.value)
+        node = self.new_node(ASTNodeType.PRINT_STATEMENT)
         node.add_child(value)
         return node
 
+    def parse_import_statement(self):
+        self.match(TokenType.KEYWORD, "import")
+        name = self.match(TokenType.IDENTIFIER)
+        if not name:
+            raise SyntaxError("Expected a module name after import")
+        parts = [name.value]
+        while self.match(TokenType.DELIMITER, "."):
+            name = self.match(TokenType.IDENTIFIER)
+            if not name:
+                raise SyntaxError(f"Expected a module name after 'import {'.'.join(parts)}.'")
+            parts.append(name.value)
+        self.match(TokenType.DELIMITER, ";")
+        self.debug_log("Parsed import statement: import {}", '.'.join(parts))
+        return self.new_node(ASTNodeType.IMPORT, '.'.join(parts))
+
     def parse_expression(self):
-        self.debug_log("Parsing expression")
-        token = self.current_token()
-        if token.type == TokenType.STRING:
-            self.next_token()
-            return ASTNode(ASTNodeType.EXPRESSION, token.value)
-        return self.parse_additive()
-
-    def parse_additive(self):
-        self.debug_log("Parsing additive expression")
-        left = self.parse_multiplicative()
-        while self.current_token() and self.current_token().type == TokenType.OPERATOR and self.current_token().value in ['+', '-']:
-            op = self.current_token().value
-            self.debug_log(f"Found additive operator: {op}")
-            self.next_token()
-            right = self.parse_multiplicative()
-            new_node = ASTNode(ASTNodeType.BINARY_OPERATION, op)
-            new_node.add_child(left)
-            new_node.add_child(right)
-            left = new_node
-        return left
-
-    def parse_multiplicative(self):
-        self.debug_log("Parsing multiplicative expression")
-        left = self.parse_primary()
-        while self.current_token() and self.current_token().type == TokenType.OPERATOR and self.current_token().value in ['*', '/']:
-            op = self.current_token().value
-            self.debug_log(f"Found multiplicative operator: {op}")
+        """Precedence climbing over BINARY_OPERATORS with an explicit operator stack.
+
+        Every operand costs one parse_primary call and at most one stack push
+        and reduction, however many precedence levels the table defines.
+        """
+        operands = [self.parse_primary()]
+        operators = []  # (binding power, symbol, node type) still waiting for a right operand
+        while True:
+            token = self.current_token()
+            entry = BINARY_OPERATORS.get(token.value) if token is not None and token.type == TokenType.OPERATOR else None
+            if entry is None:
+                break
+            power, right_associative, node_type = entry
+            # Operators that bind tighter (or as tight, left to right) are complete
+            while operators and (operators[-1][0] > power or (operators[-1][0] == power and not right_associative)):
+                self.reduce(operators, operands)
+            self.debug_log("Found binary operator: {}", token.value)
+            operators.append((power, token.value, node_type))
             self.next_token()
-            right = self.parse_primary()
-            new_node = ASTNode(ASTNodeType.BINARY_OPERATION, op)
-            new_node.add_child(left)
-            new_node.add_child(right)
-            left = new_node
-        return left
+            operands.append(self.parse_primary())
+        while operators:
+            self.reduce(operators, operands)
+        return operands[0]
+
+    def reduce(self, operators, operands):
+        """Replace the top two operands with the top operator applied to them."""
+        power, symbol, node_type = operators.pop()
+        right = operands.pop()
+        left = operands[-1]
+        if node_type == ASTNodeType.ASSIGNMENT:
+            if left.type != ASTNodeType.EXPRESSION or not is_name(left.value):
+                raise SyntaxError(f"Cannot assign to {left.type.name.lower()} {left.value}")
+            node = self.new_node(ASTNodeType.ASSIGNMENT)
+        else:
+            node = self.new_node(node_type, symbol)
+        node.add_child(left)
+        node.add_child(right)
+        operands[-1] = node
 
     def parse_primary(self):
         token = self.current_token()
-        self.debug_log(f"Parsing primary expression: {token.value}")
+        self.debug_log("Parsing primary expression: {}", token.value)
         if token.type == TokenType.IDENTIFIER:
             self.next_token()
             if self.current_token() and self.current_token().type == TokenType.DELIMITER and self.current_token().value == "(":
                 return self.parse_function_call(token.value)
-            return ASTNode(ASTNodeType.EXPRESSION, token.value)
+            return self.new_node(ASTNodeType.EXPRESSION, token.value)
         elif token.type in [TokenType.INTEGER, TokenType.FLOAT, TokenType.STRING, TokenType.BOOLEAN]:
             self.next_token()
-            return ASTNode(ASTNodeType.EXPRESSION, token.value)
+            if token.type == TokenType.STRING and TEMPLATE_OPEN in token.value:
+                return self.parse_template(token)
+            return self.new_node(ASTNodeType.EXPRESSION, token.value)
         elif token.type == TokenType.DELIMITER and token.value == "(":
             self.next_token()
             expr = self.parse_expression()
             self.match(TokenType.DELIMITER, ")")
             return expr
+        elif token.type == TokenType.DELIMITER and token.value == "[":
+            return self.parse_array_literal()
+        elif token.type == TokenType.OPERATOR and token.value in PREFIX_OPERATORS:
+            self.next_token()
+            node = self.new_node(ASTNodeType.UNARY_OPERATION, token.value)
+            node.add_child(self.parse_primary())
+            return node
         else:
             raise SyntaxError(f"Unexpected token in expression: {token}")
 
+    def parse_template(self, token):
+        """Build a TEMPLATE_STRING node from literal EXPRESSION strings and embedded expressions."""
+        text = token.value
+        where = f"in string {text} at line {token.line}, column {token.column}"
+        segments = self.templates.get(text)
+        if segments is None:
+            try:
+                segments = self.templates[text] = split_template(text)
+            except SyntaxError as e:
+                raise SyntaxError(f"{e} at line {token.line}, column {token.column}") from None
+        node = self.new_node(ASTNodeType.TEMPLATE_STRING, text)
+        for segment in segments:
+            if isinstance(segment, str):
+                node.add_child(self.new_node(ASTNodeType.EXPRESSION, f'"{segment}"'))
+                continue
+            # A throwaway parser over the embedded tokens that builds into this tree
+            offset, tokens = segment
+            parser = Parser(place_tokens(tokens, text, offset, token.line, token.column), sinks=self.tracer.sinks,
+                            profile=self.profile, positions=self.positions)
+            parser.new_node = self.new_node
+            parser.indent_level = self.indent_level
+            node.add_child(parser.parse_expression())
+            rest = parser.current_token()
+            if rest.type != TokenType.EOF:
+                raise SyntaxError(f"Unexpected {rest.value!r} in interpolation {where}")
+        self.debug_log("Parsed template with {} segments", len(segments))
+        return node
+
+    def parse_array_literal(self):
+        node = self.new_node(ASTNodeType.ARRAY_LITERAL)
+        self.match(TokenType.DELIMITER, "[")
+        while self.current_token() and (self.current_token().type != TokenType.DELIMITER or self.current_token().value != "]"):
+            node.add_child(self.parse_expression())
+            if not self.match(TokenType.DELIMITER, ","):
+                break
+        if not self.match(TokenType.DELIMITER, "]"):
+            raise SyntaxError(f"Expected ']' to close array literal, found {self.current_token()}")
+        self.debug_log("Parsed array literal with {} elements", len(node.children))
+        return node
+
     def parse_function_call(self, function_name):
-        self.debug_log(f"Parsing function call to {function_name}")
-        self.indent_level += 1
-        node = ASTNode(ASTNodeType.FUNCTION_CALL, function_name)
+        node = self.new_node(ASTNodeType.FUNCTION_CALL, function_name)
         self.match(TokenType.DELIMITER)  # (
-        args = []
         while self.current_token() and (self.current_token().type != TokenType.DELIMITER or self.current_token().value != ")"):
             arg = self.parse_expression()
             node.add_child(arg)
-            args.append(str(arg.value))
             if self.current_token() and self.current_token().type == TokenType.DELIMITER and self.current_token().value == ",":
                 self.match(TokenType.DELIMITER)  # ,
         self.match(TokenType.DELIMITER)  # )
-        self.debug_log(f"Parsed function call: {function_name}({', '.join(args)})")
-        self.indent_level -= 1
+        if self.debug:
+            self.debug_log("Parsed function call: {}({})", function_name, ', '.join(str(arg.value) for arg in node.children))
         return node
 
-def parse(source_code, debug=False):
-    tokens = lex(source_code, debug)
-    parser = Parser(tokens, debug)
-    return parser.parse()
+def parse(source_code, debug=False, compact=False, sinks=None, profile=None, positions=False, lazy=False):
+    """Parse source code into a PROGRAM node.
+
+    With lazy=True, @ink bodies are LazyBlocks that are only parsed when
+    something reads their children (ASTNode trees only).
+    """
+    if profile is None:
+        tokens = lex(source_code, debug, sinks=sinks)
+        return Parser(tokens, debug, compact, sinks, positions=positions, lazy=lazy).parse()
+    with profile.phase("lex") as phase:
+        tokens = lex(source_code, debug, sinks=sinks)
+        phase.items += len(tokens)
+    with profile.phase("parse") as phase:
+        created = profile.rule_calls('new_node')
+        ast = Parser(tokens, debug, compact, sinks, profile, positions, lazy).parse()
+        phase.items += profile.rule_calls('new_node') - created
+    return ast
+
+def parse_stream(source, debug=False, chunk_size=DEFAULT_CHUNK_SIZE, compact=False, sinks=None, profile=None):
+    """Parse a file object or mmap while it is being lexed, in bounded memory."""
+    parser = Parser(stream_lex(source, debug, chunk_size, sinks), debug, compact, sinks, profile)
+    if profile is None:
+        return parser.parse()
+    # Lexing happens on demand inside the parser here, so it cannot be timed apart
+    with profile.phase("lex+parse") as phase:
+        created = profile.rule_calls('new_node')
+        ast = parser.parse()
+        phase.items += profile.rule_calls('new_node') - created
+    return ast
 
 # Example usage
 if __name__ == "__main__":
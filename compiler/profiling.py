@@ -0,0 +1,338 @@
+import json
+import time
+
+class PhaseStats:
+    __slots__ = ('name', 'calls', 'seconds', 'items')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.items = 0  # Tokens for lexing, AST nodes for parsing, ...
+
+class RuleStats:
+    __slots__ = ('name', 'calls', 'tokens', 'seconds', 'self_seconds', 'active')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.tokens = 0  # Tokens consumed, counted once across recursive calls
+        self.seconds = 0.0  # Inclusive time, counted once across recursive calls
+        self.self_seconds = 0.0  # Time not spent in nested rules
+        self.active = 0
+
+class Profile:
+    """Wall time and call counts per compiler phase and per grammar rule.
+
+    Nothing is measured unless a Profile is handed to parse() or Parser:
+    rules are only wrapped with the bookkeeping below in that case, the same
+    way tracing is. Nested phases and rules form call stacks whose self time
+    is exported in the folded format flamegraph.pl and speedscope read.
+    """
+    def __init__(self):
+        self.phases = {}
+        self.rules = {}
+        self.failed_matches = 0
+        self.failed_matches_by_type = {}
+        self.stack = []  # [folded path, time spent in nested frames]
+        self.folded_seconds = {}
+
+    def enter(self, name):
+        path = self.stack[-1][0] + ";" + name if self.stack else name
+        frame = [path, 0.0]
+        self.stack.append(frame)
+        return frame
+
+    def leave(self, frame, elapsed):
+        self.stack.pop()
+        self_seconds = elapsed - frame[1]
+        self.folded_seconds[frame[0]] = self.folded_seconds.get(frame[0], 0.0) + self_seconds
+        if self.stack:
+            self.stack[-1][1] += elapsed
+        return self_seconds
+
+    def rule_calls(self, name):
+        rule = self.rules.get(name)
+        return rule.calls if rule is not None else 0
+
+    def phase(self, name):
+        return PhaseTimer(self, name)
+
+    def wrap_rule(self, name, rule, parser):
+        """Return rule instrumented to update the stats for name."""
+        stats = self.rules.get(name)
+        if stats is None:
+            stats = self.rules[name] = RuleStats(name)
+        clock = time.perf_counter
+
+        def profiled(*args, **kwargs):
+            frame = self.enter(name)
+            position = parser.position
+            stats.active += 1
+            start = clock()
+            try:
+                return rule(*args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                stats.active -= 1
+                stats.calls += 1
+                stats.self_seconds += self.leave(frame, elapsed)
+                if not stats.active:
+                    stats.seconds += elapsed
+                    stats.tokens += parser.position - position
+        return profiled
+
+    def wrap_match(self, match):
+        def profiled(token_type, value=None):
+            token = match(token_type, value)
+            if token is None:
+                self.failed_matches += 1
+                self.failed_matches_by_type[token_type.name] = self.failed_matches_by_type.get(token_type.name, 0) + 1
+            return token
+        return profiled
+
+    def to_dict(self):
+        return {
+            'phases': {name: {'calls': phase.calls, 'seconds': phase.seconds, 'items': phase.items}
+                       for name, phase in self.phases.items()},
+            'rules': {name: {'calls': rule.calls, 'tokens': rule.tokens, 'seconds': rule.seconds,
+                             'self_seconds': rule.self_seconds}
+                      for name, rule in self.rules.items()},
+            'failed_matches': self.failed_matches,
+            'failed_matches_by_type': dict(self.failed_matches_by_type),
+        }
+
+    def to_json(self, indent=2):
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def folded(self):
+        """Collapsed stacks ("phase;rule;rule microseconds"), one per line."""
+        return "\n".join(f"{path} {round(seconds * 1e6)}"
+                         for path, seconds in sorted(self.folded_seconds.items())
+                         if round(seconds * 1e6) > 0)
+
+    def report(self):
+        lines = ["phase                          calls    seconds      items"]
+        for phase in self.phases.values():
+            lines.append(f"{phase.name:<28} {phase.calls:>7} {phase.seconds:>10.4f} {phase.items:>10}")
+        if self.rules:
+            lines.append("")
+            lines.append("rule                           calls     tokens    seconds       self")
+            for rule in sorted(self.rules.values(), key=lambda rule: rule.self_seconds, reverse=True):
+                lines.append(f"{rule.name:<28} {rule.calls:>7} {rule.tokens:>10} "
+                             f"{rule.seconds:>10.4f} {rule.self_seconds:>10.4f}")
+            by_type = ", ".join(f"{name} {count}" for name, count in sorted(self.failed_matches_by_type.items()))
+            lines.append("")
+            lines.append(f"failed matches: {self.failed_matches}" + (f" ({by_type})" if by_type else ""))
+        return "\n".join(lines)
+
+class PhaseTimer:
+    """Context manager that charges the time spent inside it to a phase."""
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.stats = profile.phases.get(name)
+        if self.stats is None:
+            self.stats = profile.phases[name] = PhaseStats(name)
+        self.name = name
+
+    def __enter__(self):
+        self.frame = self.profile.enter(self.name)
+        self.start = time.perf_counter()
+        return self.stats
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        self.profile.leave(self.frame, elapsed)
+        self.stats.calls += 1
+        self.stats.seconds += elapsed
+        return False
+
+class FunctionStats:
+    __slots__ = ('name', 'calls', 'memo_hits', 'samples', 'seconds', 'self_seconds', 'active')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0  # Bodies entered; calls answered from the memo cache are memo_hits
+        self.memo_hits = 0
+        self.samples = 0  # Samples that found the function on the stack
+        self.seconds = 0.0  # Inclusive time, counted once across recursive calls
+        self.self_seconds = 0.0  # Time not spent in functions it called
+        self.active = 0
+
+# Keys run --profile-sort accepts, and what each sorts functions by (largest first)
+RUNTIME_SORT_KEYS = {
+    'self': lambda stats: stats.self_seconds,
+    'total': lambda stats: stats.seconds,
+    'calls': lambda stats: stats.calls + stats.memo_hits or stats.samples,
+    'name': None,
+}
+# Hottest lines listed by report(); to_dict() has all of them
+REPORT_LINES = 30
+
+class RuntimeProfile:
+    """Where a running KrakenScript program spends its time, per @ink function and per source line.
+
+    A program compiled for a RuntimeProfile (compile_program's profile
+    argument) starts each statement with a LINE instruction that counts it,
+    and brackets each function body with ENTER and LEAVE, which time it.
+    Programs compiled without one carry none of these, so the VM pays
+    nothing for profiling unless it is asked for. Lines come from the
+    positions the parser stamps on nodes (parse(..., positions=True)).
+
+    With sample_interval (seconds), nothing is counted or timed per
+    statement. Instead a timer signal interrupts the VM that often and
+    charges one interval to the function and line it finds running, and to
+    every caller on its stack, so the cost depends on the interval instead
+    of on how much the program does. Calls are not counted then, and line
+    counts are samples. Sampling uses SIGALRM, so it needs a Unix main thread.
+    """
+    def __init__(self, sample_interval=None, sort='self'):
+        self.sample_interval = sample_interval
+        self.sort = sort  # report()'s default order, one of RUNTIME_SORT_KEYS
+        self.functions = []  # FunctionStats per function slot, then the top level last
+        self.program = None
+        self.line_counts = []  # Indexed like program.lines
+        self.stack = []  # [FunctionStats, folded path, start, time spent in callees]
+        self.folded_seconds = {}
+        self.code_objects = {}  # id(code array) -> CodeObject, for samples
+        self.execute_code = None
+        self.previous_handler = None
+
+    def start(self, vm):
+        program = self.program = vm.program
+        if not self.functions:
+            self.functions = [FunctionStats(code.name) for code in program.functions]
+            self.functions.append(FunctionStats(program.main.name))
+        self.line_counts.extend([0] * (len(program.lines) - len(self.line_counts)))
+        if self.sample_interval:
+            import signal
+            self.execute_code = type(vm).execute.__code__
+            self.previous_handler = signal.signal(signal.SIGALRM, self.take_sample)
+            signal.setitimer(signal.ITIMER_REAL, self.sample_interval, self.sample_interval)
+
+    def stop(self, vm):
+        if self.sample_interval:
+            import signal
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self.previous_handler)
+        for stats, memo in zip(self.functions, vm.memos):
+            if memo is not None:
+                stats.memo_hits = memo.hits
+        self.line_counts.extend([0] * (len(self.program.lines) - len(self.line_counts)))
+
+    def enter(self, slot):
+        """ENTER: a function body (slot -1 is the top level) starts running."""
+        stats = self.functions[slot]
+        stats.calls += 1
+        stats.active += 1
+        path = self.stack[-1][1] + ";" + stats.name if self.stack else stats.name
+        self.stack.append([stats, path, time.perf_counter(), 0.0])
+
+    def leave(self):
+        """LEAVE: the innermost running body returns."""
+        stats, path, start, callee_seconds = self.stack.pop()
+        elapsed = time.perf_counter() - start
+        self_seconds = elapsed - callee_seconds
+        stats.self_seconds += self_seconds
+        stats.active -= 1
+        if not stats.active:
+            stats.seconds += elapsed
+        self.folded_seconds[path] = self.folded_seconds.get(path, 0.0) + self_seconds
+        if self.stack:
+            self.stack[-1][3] += elapsed
+
+    def code_object(self, code):
+        code_object = self.code_objects.get(id(code))
+        if code_object is None or code_object.code is not code:
+            # Lazily compiled bodies replace their code arrays, so look again
+            self.code_objects = {id(candidate.code): candidate
+                                 for candidate in (self.program.main, *self.program.functions)}
+            code_object = self.code_objects.get(id(code))
+        return code_object
+
+    def take_sample(self, signum, frame):
+        while frame is not None and frame.f_code is not self.execute_code:
+            frame = frame.f_back
+        if frame is None:
+            return
+        state = frame.f_locals  # A snapshot of VM.execute's locals
+        if state.get('frames') is None or state.get('code') is None:
+            return
+        interval = self.sample_interval
+        stack = [(entry[0], entry[1]) for entry in state['frames']]
+        stack.append((state['code'], state['pc']))
+        names = []
+        for code, pc in stack:
+            code_object = self.code_object(code)
+            names.append(code_object.name if code_object is not None else "?")
+        for name in set(names):
+            stats = self.stats(name)
+            stats.samples += 1
+            stats.seconds += interval
+        self.stats(names[-1]).self_seconds += interval
+        path = ";".join(names)
+        self.folded_seconds[path] = self.folded_seconds.get(path, 0.0) + interval
+        code_object = self.code_object(stack[-1][0])
+        line = code_object.line_at(stack[-1][1] - 2) if code_object is not None else None
+        if line is not None:
+            slot = self.program.line(code_object.name, line)
+            self.line_counts.extend([0] * (slot + 1 - len(self.line_counts)))
+            self.line_counts[slot] += 1
+
+    def stats(self, name):
+        for stats in self.functions:
+            if stats.name == name:
+                return stats
+        stats = FunctionStats(name)
+        self.functions.append(stats)
+        return stats
+
+    def hot_lines(self):
+        """[(function name, line, count)] for every line that ran, most executed first."""
+        lines = [(name, line, count) for (name, line), count in zip(self.program.lines, self.line_counts) if count]
+        return sorted(lines, key=lambda entry: (-entry[2], entry[1]))
+
+    def sorted_functions(self, sort=None):
+        functions = [stats for stats in self.functions if stats.calls or stats.memo_hits or stats.samples]
+        key = RUNTIME_SORT_KEYS[sort or self.sort]
+        if key is None:
+            return sorted(functions, key=lambda stats: stats.name)
+        return sorted(functions, key=key, reverse=True)
+
+    def to_dict(self):
+        return {
+            'mode': 'sampled' if self.sample_interval else 'instrumented',
+            'sample_interval': self.sample_interval,
+            'functions': {stats.name: {'calls': stats.calls, 'memo_hits': stats.memo_hits, 'samples': stats.samples,
+                                       'seconds': stats.seconds, 'self_seconds': stats.self_seconds}
+                          for stats in self.sorted_functions()},
+            'lines': [{'function': name, 'line': line, 'count': count} for name, line, count in self.hot_lines()],
+        }
+
+    def to_json(self, indent=2):
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def folded(self):
+        """Collapsed stacks ("<program>;caller;callee microseconds"), one per line."""
+        return "\n".join(f"{path} {round(seconds * 1e6)}"
+                         for path, seconds in sorted(self.folded_seconds.items())
+                         if round(seconds * 1e6) > 0)
+
+    def report(self, sort=None):
+        sampled = bool(self.sample_interval)
+        counted = "samples" if sampled else "calls"
+        lines = [f"function                     {counted:>9}  memo hits    seconds       self   per call"]
+        for stats in self.sorted_functions(sort):
+            calls = stats.samples if sampled else stats.calls
+            per_call = f"{stats.seconds / stats.calls * 1e3:>8.3f}ms" if stats.calls and not sampled else ""
+            lines.append(f"{stats.name:<28} {calls:>9} {stats.memo_hits:>10} {stats.seconds:>10.4f} "
+                         f"{stats.self_seconds:>10.4f} {per_call}".rstrip())
+        hot_lines = self.hot_lines()
+        if hot_lines:
+            lines.append("")
+            lines.append(f"line   function                     {'samples' if sampled else 'executions':>10}")
+            for name, line, count in hot_lines[:REPORT_LINES]:
+                lines.append(f"{line:<6} {name:<28} {count:>10}")
+            if len(hot_lines) > REPORT_LINES:
+                lines.append(f"... {len(hot_lines) - REPORT_LINES} more lines")
+        return "\n".join(lines)
@@ -0,0 +1,243 @@
+from ast_nodes import ASTNodeType, is_name
+
+# Address depths: globals live in the program frame, everything else in the
+# frame of the @ink call that declares it. Functions only appear at the top
+# level, so no deeper frames exist.
+GLOBAL_DEPTH = 0
+LOCAL_DEPTH = 1
+
+class SymbolTable:
+    """Interns identifier strings as small integers."""
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+    def intern(self, name):
+        symbol = self.ids.get(name)
+        if symbol is None:
+            symbol = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return symbol
+
+class Binding:
+    __slots__ = ('name', 'depth', 'slot', 'constant')
+
+    def __init__(self, name, depth, slot, constant):
+        self.name = name
+        self.depth = depth
+        self.slot = slot
+        self.constant = constant
+
+class Frame:
+    """Storage for one @ink call, or for the program's globals: a slot per binding."""
+    __slots__ = ('name', 'depth', 'slot_names')
+
+    def __init__(self, name, depth):
+        self.name = name
+        self.depth = depth
+        self.slot_names = []
+
+    @property
+    def size(self):
+        return len(self.slot_names)
+
+class Scope:
+    __slots__ = ('bindings', 'parent', 'frame')
+
+    def __init__(self, frame, parent=None):
+        self.bindings = {}  # Symbol -> Binding
+        self.parent = parent
+        self.frame = frame
+
+class Resolution:
+    """Result of resolving a PROGRAM: symbols, addresses, frames and errors.
+
+    addresses maps every node that names a variable (EXPRESSION references,
+    assignment targets, declarations, parameters and for-loop variables) to
+    its (depth, slot) address. frames maps the PROGRAM node and each
+    FUNCTION_DECLARATION to its Frame.
+    """
+    def __init__(self):
+        self.symbols = SymbolTable()
+        self.addresses = {}
+        self.frames = {}
+        self.errors = []
+
+    def frame_size(self, node):
+        return self.frames[node].size
+
+    def check(self):
+        """Raise the first error found, if any."""
+        if self.errors:
+            raise self.errors[0]
+
+class Resolver:
+    """Builds lexical scopes for a PROGRAM AST and assigns every binding a frame slot.
+
+    Functions, blocks and for loops open scopes. A new name is visible until
+    the end of the scope that declares it; declaring a name again within the
+    same frame (let total = total + n inside a loop) updates the existing
+    binding instead of shadowing it. Function bodies see the globals
+    declared at the top level, wherever they appear, and default parameter
+    values only see globals. Undefined names, calls to undefined functions
+    and writes to constants are collected in Resolution.errors.
+
+    With lazy=True only the top level is resolved; each function body waits
+    for a resolve_function call, which may come any time after resolve().
+
+    A module is resolved on its own by passing the Interfaces of the modules
+    it imports: their functions and globals are declared before anything
+    else, and its import statements are then skipped. Without imports, an
+    import statement is an error, since the program was never linked.
+    """
+    def __init__(self, builtins=()):
+        self.builtins = frozenset(builtins)
+
+    def resolve(self, program_node, lazy=False, imports=None):
+        self.resolution = resolution = Resolution()
+        self.intern = resolution.symbols.intern
+        program_frame = resolution.frames[program_node] = Frame("<program>", GLOBAL_DEPTH)
+        self.globals = self.scope = Scope(program_frame)
+
+        self.functions = set()
+        for interface in imports or ():
+            for name in interface.functions:
+                self.functions.add(self.intern(name))
+            for name, constant in interface.globals.items():
+                self.declare_import(name, constant)
+        functions = []
+        for child in program_node.children:
+            if child.type == ASTNodeType.FUNCTION_DECLARATION:
+                symbol = self.intern(child.value)
+                if symbol in self.functions:
+                    self.error(SyntaxError(f"Function '{child.value}' is declared more than once"))
+                self.functions.add(symbol)
+                functions.append(child)
+
+        for child in program_node.children:
+            if child.type == ASTNodeType.FUNCTION_DECLARATION:
+                # Defaults are evaluated by the caller, so they may only use globals
+                for param in child.children[0].children:
+                    if len(param.children) > 1:
+                        self.resolve_expression(param.children[1])
+            elif child.type == ASTNodeType.IMPORT:
+                if imports is None:
+                    self.error(ImportError(f"Module '{child.value}' was imported but never loaded"))
+            else:
+                self.resolve_statement(child)
+        if not lazy:
+            for function in functions:
+                self.resolve_function(function)
+        return resolution
+
+    def error(self, exception):
+        self.resolution.errors.append(exception)
+
+    def resolve_function(self, node):
+        """Resolve one @ink body against the complete set of globals."""
+        params, return_type, body = node.children[:3]
+        frame = self.resolution.frames[node] = Frame(node.value, LOCAL_DEPTH)
+        self.scope = Scope(frame, self.globals)
+        # Parameters take the first slots, in order, which is where calls put the arguments
+        for param in params.children:
+            self.declare(param, param.value, False)
+        for statement in body.children:
+            self.resolve_statement(statement)
+        self.scope = self.globals
+
+    def resolve_statement(self, node):
+        node_type = node.type
+        if node_type == ASTNodeType.BLOCK:
+            self.scope = Scope(self.scope.frame, self.scope)
+            for child in node.children:
+                self.resolve_statement(child)
+            self.scope = self.scope.parent
+        elif node_type in (ASTNodeType.VARIABLE_DECLARATION, ASTNodeType.CONSTANT_DECLARATION):
+            # The value is resolved first: let total = total + n reads the old total
+            self.resolve_expression(node.children[0])
+            self.declare(node, node.value, node_type == ASTNodeType.CONSTANT_DECLARATION)
+        elif node_type in (ASTNodeType.PRINT_STATEMENT, ASTNodeType.RETURN_STATEMENT):
+            self.resolve_expression(node.children[0])
+        elif node_type == ASTNodeType.IF_STATEMENT:
+            self.resolve_expression(node.children[0])
+            for branch in node.children[1:]:
+                self.resolve_statement(branch)
+        elif node_type == ASTNodeType.FOR_LOOP:
+            variable, collection, body = node.children
+            self.resolve_expression(collection)
+            self.scope = Scope(self.scope.frame, self.scope)
+            self.declare(variable, variable.value, False)
+            self.resolve_statement(body)
+            self.scope = self.scope.parent
+        elif node_type == ASTNodeType.FUNCTION_DECLARATION:
+            self.error(SyntaxError(f"Function '{node.value}' must be declared at the top level"))
+        elif node_type == ASTNodeType.IMPORT:
+            self.error(SyntaxError(f"Module '{node.value}' must be imported at the top level"))
+        else:
+            self.resolve_expression(node)
+
+    def resolve_expression(self, node):
+        EXPRESSION = ASTNodeType.EXPRESSION
+        ASSIGNMENT = ASTNodeType.ASSIGNMENT
+        FUNCTION_CALL = ASTNodeType.FUNCTION_CALL
+        reference = self.reference
+        # Expressions declare nothing; children are pushed reversed only so errors come in source order
+        stack = [node]
+        pop = stack.pop
+        while stack:
+            node = pop()
+            node_type = node.type
+            if node_type is EXPRESSION:
+                if is_name(node.value):
+                    reference(node, node.value, False)
+                continue
+            children = node.children
+            if node_type is ASSIGNMENT:
+                target, value = children
+                reference(target, target.value, True)
+                stack.append(value)
+                continue
+            if node_type is FUNCTION_CALL and node.value not in self.builtins \
+                    and self.intern(node.value) not in self.functions:
+                self.error(NameError(f"Call to undefined function '{node.value}'"))
+            stack.extend(reversed(children))
+
+    def lookup(self, symbol):
+        scope = self.scope
+        while scope is not None:
+            binding = scope.bindings.get(symbol)
+            if binding is not None:
+                return binding
+            scope = scope.parent
+        return None
+
+    def reference(self, node, name, assigning):
+        binding = self.lookup(self.intern(name))
+        if binding is None:
+            self.error(NameError(f"Undefined name '{name}' in {self.scope.frame.name}"))
+            return
+        if assigning and binding.constant:
+            self.error(TypeError(f"Cannot reassign constant '{name}'"))
+        self.resolution.addresses[node] = (binding.depth, binding.slot)
+
+    def declare_import(self, name, constant):
+        frame = self.globals.frame
+        self.globals.bindings[self.intern(name)] = Binding(name, frame.depth, frame.size, constant)
+        frame.slot_names.append(name)
+
+    def declare(self, node, name, constant):
+        symbol = self.intern(name)
+        frame = self.scope.frame
+        binding = self.lookup(symbol)
+        if binding is not None and binding.depth == frame.depth:
+            if binding.constant:
+                self.error(TypeError(f"Cannot reassign constant '{name}'"))
+            binding.constant = binding.constant or constant
+        else:
+            binding = Binding(name, frame.depth, frame.size, constant)
+            frame.slot_names.append(name)
+            self.scope.bindings[symbol] = binding
+        self.resolution.addresses[node] = (binding.depth, binding.slot)
+
+def resolve(program_node, builtins=()):
+    return Resolver(builtins).resolve(program_node)
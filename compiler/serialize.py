@@ -0,0 +1,200 @@
+import gc
+import json
+import struct
+from array import array
+from ast_nodes import ASTNode, ASTNodeType, NODE_TYPES_BY_CODE, NODE_TYPE_CODES
+
+# Compact binary AST: magic, layout version, node count, value count, value bytes
+BINARY_MAGIC = b"KSA\0"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("=4sH2xIII")
+
+# Node values are None or the raw token values the parser stores
+VALUE_NONE, VALUE_STR, VALUE_INT, VALUE_FLOAT = range(4)
+
+def padded(data):
+    return data + b"\0" * (-len(data) % 4)
+
+def dump_binary(root):
+    """Serialize an AST into the compact binary layout.
+
+    Nodes are written in preorder as three columns (type code, value index,
+    child count) followed by the interned value table, so loading is a single
+    pass over flat arrays without any per-node framing.
+    """
+    types = array('B')
+    value_indices = array('I')
+    child_counts = array('I')
+    values = []
+    value_table = {}
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        value_key = (node.value.__class__, node.value)
+        value_index = value_table.get(value_key)
+        if value_index is None:
+            value_index = value_table[value_key] = len(values)
+            values.append(node.value)
+        types.append(NODE_TYPE_CODES[node.type])
+        value_indices.append(value_index)
+        child_counts.append(len(node.children))
+        stack.extend(reversed(node.children))
+
+    tags = array('B')
+    lengths = array('I')
+    data = bytearray()
+    for value in values:
+        if value is None:
+            tags.append(VALUE_NONE)
+            encoded = b""
+        elif isinstance(value, str):
+            tags.append(VALUE_STR)
+            encoded = value.encode("utf-8")
+        elif isinstance(value, int):
+            tags.append(VALUE_INT)
+            encoded = str(value).encode()
+        elif isinstance(value, float):
+            tags.append(VALUE_FLOAT)
+            encoded = repr(value).encode()
+        else:
+            raise TypeError(f"Cannot serialize a node value of type {type(value).__name__}")
+        lengths.append(len(encoded))
+        data += encoded
+
+    return b"".join((
+        BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(types), len(values), len(data)),
+        padded(types.tobytes()),
+        value_indices.tobytes(),
+        child_counts.tobytes(),
+        padded(tags.tobytes()),
+        lengths.tobytes(),
+        bytes(data),
+    ))
+
+def build_tree(types, value_indices, child_counts, values):
+    """Link preorder node columns back into an ASTNode tree."""
+    node_types = NODE_TYPES_BY_CODE
+    root = None
+    parents = []  # Nodes still expecting children, with how many are missing
+    remaining = []
+    for type_code, value_index, child_count in zip(types, value_indices, child_counts):
+        node = ASTNode(node_types[type_code], values[value_index])
+        if parents:
+            parents[-1].children.append(node)
+            remaining[-1] -= 1
+            if not remaining[-1]:
+                parents.pop()
+                remaining.pop()
+        else:
+            root = node
+        if child_count:
+            parents.append(node)
+            remaining.append(child_count)
+    if root is None or parents:
+        raise ValueError("Malformed AST data")
+    return root
+
+def load_binary(buffer, offset=0):
+    """Rebuild an AST from dump_binary output starting at offset in buffer.
+
+    buffer may be bytes or an mmap; raises ValueError if the data is damaged
+    or was written by an incompatible version.
+    """
+    view = memoryview(buffer)
+    sections = []  # Released before returning so an mmap can be closed
+    try:
+        magic, version, node_count, value_count, data_size = BINARY_HEADER.unpack_from(view, offset)
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            raise ValueError("Not KrakenScript AST data or written by another version")
+        offset += BINARY_HEADER.size
+
+        def column(count, itemsize, fmt):
+            nonlocal offset
+            size = count * itemsize
+            section = view[offset:offset + size].cast(fmt)
+            sections.append(section)
+            if len(section) != count:
+                raise ValueError("Truncated AST data")
+            offset += size + (-size % 4)
+            return section
+
+        types = column(node_count, 1, 'B')
+        value_indices = column(node_count, 4, 'I')
+        child_counts = column(node_count, 4, 'I')
+        tags = column(value_count, 1, 'B')
+        lengths = column(value_count, 4, 'I')
+        data = view[offset:offset + data_size]
+        sections.append(data)
+        if len(data) != data_size:
+            raise ValueError("Truncated AST data")
+
+        values = []
+        position = 0
+        for tag, length in zip(tags, lengths):
+            text = str(data[position:position + length], "utf-8")
+            position += length
+            if tag == VALUE_NONE:
+                values.append(None)
+            elif tag == VALUE_STR:
+                values.append(text)
+            elif tag == VALUE_INT:
+                values.append(int(text))
+            else:
+                values.append(float(text))
+
+        # Nothing built here can form a cycle, and the collector would
+        # otherwise rescan the growing tree every few hundred nodes
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            root = build_tree(types.tolist(), value_indices.tolist(), child_counts.tolist(), values)
+        finally:
+            if collecting:
+                gc.enable()
+        return root
+    except (struct.error, IndexError, TypeError, UnicodeDecodeError) as e:
+        raise ValueError(f"Malformed AST data: {e}") from None
+    finally:
+        for section in sections:
+            section.release()
+        view.release()
+
+def write_jsonl(root, stream):
+    """Write the tree as JSON lines, one node per line in preorder.
+
+    Each record holds the node's type name, value and the preorder index of
+    its parent (null for the root), which is all a consumer needs to rebuild
+    the tree or to process nodes as a stream.
+    """
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+    type_names = {node_type: node_type.name for node_type in ASTNodeType}
+    lines = []
+    stack = [(root, None)]
+    index = 0
+    while stack:
+        node, parent = stack.pop()
+        lines.append(dumps({"type": type_names[node.type], "value": node.value, "parent": parent}))
+        for child in reversed(node.children):
+            stack.append((child, index))
+        index += 1
+        if len(lines) >= 4096:
+            stream.write("\n".join(lines) + "\n")
+            lines.clear()
+    if lines:
+        stream.write("\n".join(lines) + "\n")
+
+def read_jsonl(lines):
+    """Rebuild a tree from write_jsonl output (any iterable of lines, e.g. a file)."""
+    nodes = []
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        node = ASTNode(ASTNodeType[record["type"]], record["value"])
+        parent = record["parent"]
+        if parent is not None:
+            nodes[parent].children.append(node)
+        nodes.append(node)
+    if not nodes:
+        raise ValueError("No AST nodes in input")
+    return nodes[0]
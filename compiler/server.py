@@ -0,0 +1,189 @@
+import asyncio
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from client import default_socket_path
+
+# Longest request line accepted, which bounds the inline source a request can carry
+MAX_REQUEST_BYTES = 64 * 1024 * 1024
+
+class CompileServer:
+    """Long-running compiler behind a Unix socket, so repeated calls skip Python startup and imports.
+
+    Clients (see client.py) send JSON lines such as {"id": 1, "op": "parse",
+    "path": "/abs/file.ks"} and get {"id": 1, "ok": true, "result": {...}}
+    back, or ok false and an error. A connection may send many requests
+    without waiting: each runs as its own task on a thread pool, and
+    responses come back as they finish, matched by id. Between requests the
+    compiler modules stay imported, the .ksc cache stays open and every
+    incremental build keeps its manifest in memory.
+
+    Ops: lex and parse (path or source), build (paths, incremental, jobs),
+    ping and shutdown.
+    """
+    def __init__(self, socket_path=None, cache=None, workers=None):
+        self.socket_path = socket_path or default_socket_path()
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.manifests = {}  # Incremental build paths -> their manifest records, kept between builds
+        self.build_locks = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.started = time.time()
+        self.stopping = None
+        self.handlers = {
+            'lex': self.lex,
+            'parse': self.parse,
+            'build': self.build,
+            'ping': self.ping,
+        }
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.stopping = asyncio.Event()
+        directory = os.path.dirname(self.socket_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.remove_stale_socket()
+        server = await asyncio.start_unix_server(self.handle, path=self.socket_path, limit=MAX_REQUEST_BYTES)
+        os.chmod(self.socket_path, 0o600)  # The server reads any file its user can, so only that user may ask
+        try:
+            async with server:
+                await self.stopping.wait()
+        finally:
+            try:
+                os.remove(self.socket_path)
+            except FileNotFoundError:
+                pass
+            self.executor.shutdown(cancel_futures=True)
+
+    def remove_stale_socket(self):
+        """Delete a socket file left by a server that died, but refuse to replace a live one."""
+        import socket
+
+        if not os.path.exists(self.socket_path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.remove(self.socket_path)
+        else:
+            raise RuntimeError(f"A compile server is already listening on {self.socket_path}")
+        finally:
+            probe.close()
+
+    async def handle(self, reader, writer):
+        write_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while line := await reader.readline():
+                task = asyncio.create_task(self.respond(line, writer, write_lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (ConnectionError, ValueError):  # Dropped connection, or a line over MAX_REQUEST_BYTES
+            pass
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        writer.close()
+
+    async def respond(self, line, writer, write_lock):
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+            op = request.get('op')
+            if op == 'shutdown':
+                self.stopping.set()
+                result = {}
+            elif op in self.handlers:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self.executor, self.handlers[op], request)
+            else:
+                raise ValueError(f"Unknown op: {op!r}")
+            response = {'id': request_id, 'ok': True, 'result': result}
+        except Exception as e:  # Reported to the client; one bad request must not stop the server
+            response = {'id': request_id, 'ok': False, 'error': f"{type(e).__name__}: {e}"}
+        with self.lock:
+            self.requests += 1
+        async with write_lock:
+            writer.write(json.dumps(response).encode() + b"\n")
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+
+    def source(self, request):
+        if 'source' in request:
+            return request['source']
+        with open(request['path'], encoding="utf-8") as f:
+            return f.read()
+
+    def lex(self, request):
+        from lexer import lex
+
+        return {'tokens': [[token.type.name, token.value, token.line, token.column]
+                           for token in lex(self.source(request))]}
+
+    def parse(self, request):
+        from parser import parse
+
+        source = self.source(request)
+        ast = self.cache.parse(source) if self.cache is not None else parse(source)
+        output_format = request.get('format', 'summary')
+        if output_format == 'summary':
+            from visitor import walk
+            return {'nodes': sum(1 for node in walk(ast))}
+        stream = io.StringIO()
+        if output_format == 'jsonl':
+            from serialize import write_jsonl
+            write_jsonl(ast, stream)
+        elif output_format == 'text':
+            from ast_nodes import pretty_print_ast
+            pretty_print_ast(ast, stream=stream)
+        else:
+            raise ValueError(f"Unknown format: {output_format!r}")
+        return {'ast': stream.getvalue()}
+
+    def build(self, request):
+        from build import build, ModuleBuild
+
+        paths = request['paths']
+        if request.get('incremental'):
+            key = tuple(paths)
+            with self.lock:
+                lock = self.build_locks.setdefault(key, threading.Lock())
+            with lock:  # Builds of the same tree share their manifest, so they take turns
+                module_build = ModuleBuild(paths, self.cache, self.manifests.get(key))
+                report = module_build.run()
+                self.manifests[key] = module_build.records
+        else:
+            report = build(paths, jobs=request.get('jobs', 1), cache=self.cache)
+        return {'summary': report.summary(), 'errors': [[result.path, result.error] for result in report.errors]}
+
+    def ping(self, request):
+        from main import VERSION
+
+        return {'version': VERSION, 'pid': os.getpid(), 'socket': self.socket_path,
+                'uptime': round(time.time() - self.started, 3), 'requests': self.requests}
+
+def serve(socket_path=None, cache=None, workers=None):
+    """Run a CompileServer until a client asks it to shut down; return the exit status."""
+    server = CompileServer(socket_path, cache, workers)
+    # Everything a request can need is imported up front, so the first one is as fast as the rest
+    import lexer, parser, build, serialize, visitor  # noqa: F401
+    print(f"KrakenScript compile server listening on {server.socket_path}", file=sys.stderr)
+    try:
+        server.run()
+    except RuntimeError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
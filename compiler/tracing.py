@@ -0,0 +1,119 @@
+import json
+import sys
+import time
+
+class TraceEvent:
+    __slots__ = ('component', 'message', 'level', 'depth', 'line', 'column', 'token_type', 'timestamp')
+
+    def __init__(self, component, message, level, depth, line, column, token_type):
+        self.component = component
+        self.message = message
+        self.level = level
+        self.depth = depth
+        self.line = line
+        self.column = column
+        self.token_type = token_type
+        self.timestamp = time.time()
+
+class ConsoleSink:
+    """Colored human-readable trace output, the classic debug=True format."""
+    def __init__(self, stream=None):
+        # colorama is only needed once someone actually asks for colored output
+        import colorama
+        self.stream = stream
+        self.fore = colorama.Fore
+        self.level_colors = {
+            'debug': colorama.Fore.CYAN,
+            'success': colorama.Fore.GREEN,
+            'error': colorama.Fore.RED,
+        }
+        self.token_colors = {
+            'KEYWORD': colorama.Fore.GREEN,
+            'BOOLEAN': colorama.Fore.GREEN,
+            'STRING': colorama.Fore.YELLOW,
+            'INTEGER': colorama.Fore.YELLOW,
+            'FLOAT': colorama.Fore.YELLOW,
+            'IDENTIFIER': colorama.Fore.MAGENTA,
+            'BLOCK_DELIMITER': colorama.Fore.MAGENTA,
+            'OPERATOR': colorama.Fore.BLUE,
+            'DELIMITER': colorama.Fore.BLUE,
+            'COMMENT': colorama.Fore.CYAN,
+        }
+
+    def emit(self, event):
+        color = self.level_colors.get(event.level, self.fore.CYAN)
+        indent = "  " * event.depth
+        if event.line is not None:
+            token_name = event.token_type.name if event.token_type is not None else None
+            token_color = self.token_colors.get(token_name, self.fore.WHITE)
+            text = f"{color}{event.component} - DEBUG: [{event.line}:{event.column}] {token_color}{event.message}{self.fore.RESET}"
+        else:
+            text = f"{color}{event.component} - DEBUG: {indent}{event.message}{self.fore.RESET}"
+        print(text, file=self.stream or sys.stdout)
+
+    def close(self):
+        pass
+
+class JSONTraceSink:
+    """Structured trace output: one JSON object per event (JSON lines)."""
+    def __init__(self, stream):
+        self.stream = stream
+
+    def emit(self, event):
+        record = {
+            'ts': event.timestamp,
+            'component': event.component,
+            'level': event.level,
+            'depth': event.depth,
+            'message': event.message,
+        }
+        if event.line is not None:
+            record['line'] = event.line
+            record['column'] = event.column
+        if event.token_type is not None:
+            record['token_type'] = event.token_type.name
+        self.stream.write(json.dumps(record) + "\n")
+
+    def close(self):
+        self.stream.flush()
+
+class ListSink:
+    """Collects events in memory, mainly for tooling and inspection."""
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event):
+        self.events.append(event)
+
+    def close(self):
+        pass
+
+def ignore(*args, **kwargs):
+    """No-op bound in place of logging methods when tracing is off."""
+
+class Tracer:
+    """Fans trace messages out to sinks, formatting them only when enabled.
+
+    Messages are str.format templates; the arguments are only formatted once
+    a sink is known to want the event, so disabled tracing costs nothing
+    beyond the (no-op) call.
+    """
+    def __init__(self, component, sinks=()):
+        self.component = component
+        self.sinks = list(sinks)
+        self.enabled = bool(self.sinks)
+
+    def log(self, message, args=(), level='debug', depth=0, line=None, column=None, token_type=None):
+        if not self.enabled:
+            return
+        if args:
+            message = message.format(*args)
+        event = TraceEvent(self.component, message, level, depth, line, column, token_type)
+        for sink in self.sinks:
+            sink.emit(event)
+
+def resolve_sinks(debug=False, sinks=None):
+    """Explicit sinks win; otherwise debug=True means the colored console."""
+    if sinks is not None:
+        return list(sinks)
+    return [ConsoleSink()] if debug else []
@@ -0,0 +1,357 @@
+import ast
+import keyword
+import sys
+from ast_nodes import ASTNodeType, is_name, literal_value
+from bytecode import BUILTINS
+from memoize import MemoCache, DEFAULT_MEMO_SIZE, memoization_exclusions
+from resolver import Resolver, GLOBAL_DEPTH
+from typecheck import STR_FORMATTED_TYPES, EXACT_TYPES, check_types, infer_types
+from vm import format_value
+
+# Runtime support is looked up in the module namespace under names no
+# KrakenScript identifier is expected to use
+HELPER_PREFIX = "__ks_"
+
+# Valid KrakenScript identifiers that Python cannot use as names (None, True,
+# False and the other keywords). The generated code reaches builtins only
+# through helpers, so it needs no other names kept free.
+PYTHON_RESERVED = frozenset(keyword.kwlist)
+
+BINARY_OPERATORS = {
+    '+': ast.Add,
+    '-': ast.Sub,
+    '*': ast.Mult,
+    '/': ast.Div,
+}
+
+COMPARISON_OPERATORS = {
+    '<': ast.Lt,
+    '>': ast.Gt,
+    '<=': ast.LtE,
+    '>=': ast.GtE,
+    '==': ast.Eq,
+    '!=': ast.NotEq,
+}
+
+# Like the VM's short-circuit jumps, these yield the operand that decided the result
+BOOLEAN_OPERATORS = {
+    '&&': ast.And,
+    '||': ast.Or,
+}
+
+UNARY_OPERATORS = {
+    '-': ast.USub,
+    '!': ast.Not,
+}
+
+class ProgramReturn(Exception):
+    """Raised by a top-level return, which ends the program like the VM's RETURN does."""
+    def __init__(self, value):
+        super().__init__(value)
+        self.value = value
+
+def is_literal(node):
+    return node.type == ASTNodeType.EXPRESSION and not is_name(node.value)
+
+def function_names(names):
+    """Python identifier for each @ink function name, with an underscore appended to Python keywords."""
+    python_names = {}
+    taken = set(names) | PYTHON_RESERVED
+    for name in names:
+        python_name = name
+        if name in PYTHON_RESERVED:
+            python_name = name + "_"
+            while python_name in taken:
+                python_name += "_"
+            taken.add(python_name)
+        python_names[name] = python_name
+    return python_names
+
+def frame_names(frame, reserved):
+    """Python identifier for each slot of a Frame.
+
+    Names keep their KrakenScript spelling unless a frame reuses them for
+    several slots (block-scoped declarations) or they clash with reserved
+    names, in which case the slot number is appended.
+    """
+    counts = {}
+    for name in frame.slot_names:
+        counts[name] = counts.get(name, 0) + 1
+    names = []
+    taken = set(frame.slot_names) | reserved
+    for slot, name in enumerate(frame.slot_names):
+        if counts[name] > 1 or name in reserved:
+            candidate = f"{name}_{slot}"
+            while candidate in taken:
+                candidate += "_"
+            taken.add(candidate)
+            name = candidate
+        names.append(name)
+    return names
+
+class FunctionInfo:
+    __slots__ = ('node', 'param_count', 'defaults', 'python_defaults')
+
+    def __init__(self, node):
+        params = node.children[0].children
+        self.node = node
+        self.param_count = len(params)
+        self.defaults = [param.children[1] for param in params if len(param.children) > 1]
+        # Literal defaults can live on the def; others are evaluated at each
+        # call, as the VM does, because Python evaluates defaults only once
+        self.python_defaults = all(is_literal(default) for default in self.defaults)
+
+class PythonTranspiler:
+    """Translates a PROGRAM AST into a Python ast.Module with the VM's semantics.
+
+    Variables are named through the Resolver's frame slots: globals become
+    module globals and @ink functions become defs whose locals are plain
+    Python locals. print, builtins, value formatting and memoization of
+    pure functions go through helpers from runtime_namespace(). Statements carry the line and column of the
+    KrakenScript source when the tree was parsed with positions=True.
+    Type errors are raised before anything is transpiled, and inferred
+    types specialize print and memo keys as the bytecode compiler does.
+    """
+    def transpile(self, program_node):
+        resolution = Resolver(name for name, function in BUILTINS).resolve(program_node)
+        resolution.check()
+        self.addresses = resolution.addresses
+        check_types(program_node, self.addresses).check()
+        self.typing = infer_types(program_node, self.addresses)
+        self.memo_exclusions = memoization_exclusions(program_node, self.addresses)
+        self.functions = {}
+        for child in program_node.children:
+            if child.type == ASTNodeType.FUNCTION_DECLARATION:
+                self.functions[child.value] = FunctionInfo(child)
+
+        self.function_names = function_names(self.functions)
+        reserved = set(self.function_names.values()) | PYTHON_RESERVED
+        self.global_names = frame_names(resolution.frames[program_node], reserved)
+        self.local_names = None
+        body = []
+        for info in self.functions.values():
+            frame = resolution.frames[info.node]
+            # Locals are renamed rather than shadowing a global the function also reads
+            self.local_names = frame_names(frame, reserved | set(self.global_names))
+            body.append(self.function(info))
+        self.local_names = None
+        if self.global_names:
+            # VM globals start out as none; a function may read one before the top level assigns it
+            targets = [ast.Name(id=name, ctx=ast.Store()) for name in self.global_names]
+            body.append(ast.Assign(targets=targets, value=ast.Constant(value=None)))
+        for child in program_node.children:
+            if child.type != ASTNodeType.FUNCTION_DECLARATION:
+                body.extend(self.statement(child, top_level=True))
+        module = ast.Module(body=body, type_ignores=[])
+        return ast.fix_missing_locations(module)
+
+    def located(self, python_node, node):
+        line = getattr(node, 'line', None)  # Compact ArenaNode trees carry no positions
+        if line is not None:
+            # Only start positions are known; the one-character span puts the caret there
+            python_node.lineno = python_node.end_lineno = line
+            python_node.col_offset = node.column - 1
+            python_node.end_col_offset = node.column
+        return python_node
+
+    def name(self, node):
+        depth, slot = self.addresses[node]
+        return self.global_names[slot] if depth == GLOBAL_DEPTH else self.local_names[slot]
+
+    def load(self, node):
+        return self.located(ast.Name(id=self.name(node), ctx=ast.Load()), node)
+
+    def store(self, node):
+        return ast.Name(id=self.name(node), ctx=ast.Store())
+
+    def helper(self, name):
+        return ast.Name(id=HELPER_PREFIX + name, ctx=ast.Load())
+
+    def function(self, info):
+        node = info.node
+        params, return_type, body = node.children[:3]
+        args = [ast.arg(arg=self.name(param)) for param in params.children]
+        defaults = [self.expression(default) for default in info.defaults] if info.python_defaults else []
+        statements = []
+        # Assignments to globals need a global declaration; declarations never create one
+        assigned_globals = sorted({self.name(target) for target in self.assignment_targets(body)
+                                   if self.addresses[target][0] == GLOBAL_DEPTH})
+        if assigned_globals:
+            statements.append(ast.Global(names=assigned_globals))
+        for statement in body.children:
+            statements.extend(self.statement(statement, top_level=False))
+        decorators = []
+        if self.memo_exclusions[node.value] is None:
+            exact = all(type_ in EXACT_TYPES for type_ in self.typing.params[node.value])
+            decorators.append(ast.Call(func=self.helper("memoize"), args=[ast.Constant(value=node.value),
+                                                                          ast.Constant(value=exact)], keywords=[]))
+        definition = ast.FunctionDef(
+            name=self.function_names[node.value],
+            args=ast.arguments(posonlyargs=[], args=args, vararg=None, kwonlyargs=[], kw_defaults=[],
+                               kwarg=None, defaults=defaults),
+            body=statements or [ast.Pass()],
+            decorator_list=decorators,
+            returns=None,
+        )
+        return self.located(definition, node)
+
+    def assignment_targets(self, node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.type == ASTNodeType.ASSIGNMENT:
+                yield node.children[0]
+            stack.extend(node.children)
+
+    def block(self, node, top_level):
+        statements = []
+        for child in node.children:
+            statements.extend(self.statement(child, top_level))
+        return statements or [ast.Pass()]
+
+    def statement(self, node, top_level):
+        """Lower one statement to a list of Python statements."""
+        node_type = node.type
+        if node_type == ASTNodeType.BLOCK:
+            return self.block(node, top_level)
+        if node_type in (ASTNodeType.VARIABLE_DECLARATION, ASTNodeType.CONSTANT_DECLARATION):
+            result = ast.Assign(targets=[self.store(node)], value=self.expression(node.children[0]))
+        elif node_type == ASTNodeType.ASSIGNMENT:
+            target, value = node.children
+            result = ast.Assign(targets=[self.store(target)], value=self.expression(value))
+        elif node_type == ASTNodeType.PRINT_STATEMENT:
+            value = node.children[0]
+            helper = "print_str" if self.typing.types.get(value) in STR_FORMATTED_TYPES else "print"
+            result = ast.Expr(ast.Call(func=self.helper(helper), args=[self.expression(value)], keywords=[]))
+        elif node_type == ASTNodeType.RETURN_STATEMENT:
+            value = self.expression(node.children[0])
+            if top_level:
+                result = ast.Raise(exc=ast.Call(func=self.helper("return"), args=[value], keywords=[]), cause=None)
+            else:
+                result = ast.Return(value=value)
+        elif node_type == ASTNodeType.IF_STATEMENT:
+            children = node.children
+            orelse = self.block(children[2], top_level) if len(children) > 2 else []
+            result = ast.If(test=self.expression(children[0]), body=self.block(children[1], top_level), orelse=orelse)
+        elif node_type == ASTNodeType.FOR_LOOP:
+            variable, collection, body = node.children
+            result = ast.For(target=self.store(variable), iter=self.expression(collection),
+                             body=self.block(body, top_level), orelse=[])
+        elif node_type == ASTNodeType.FUNCTION_DECLARATION:
+            raise SyntaxError(f"Function '{node.value}' must be declared at the top level")
+        else:
+            result = ast.Expr(self.expression(node))
+        return [self.located(result, node)]
+
+    def expression(self, node):
+        node_type = node.type
+        if node_type == ASTNodeType.EXPRESSION:
+            if is_name(node.value):
+                return self.load(node)
+            result = ast.Constant(value=literal_value(node.value))
+        elif node_type == ASTNodeType.BINARY_OPERATION:
+            left, right = node.children
+            operator = node.value
+            if operator in BINARY_OPERATORS:
+                result = ast.BinOp(left=self.expression(left), op=BINARY_OPERATORS[operator](),
+                                   right=self.expression(right))
+            elif operator in COMPARISON_OPERATORS:
+                result = ast.Compare(left=self.expression(left), ops=[COMPARISON_OPERATORS[operator]()],
+                                     comparators=[self.expression(right)])
+            elif operator in BOOLEAN_OPERATORS:
+                result = ast.BoolOp(op=BOOLEAN_OPERATORS[operator](),
+                                    values=[self.expression(left), self.expression(right)])
+            else:
+                raise SyntaxError(f"Unsupported operator '{operator}'")
+        elif node_type == ASTNodeType.UNARY_OPERATION:
+            if node.value not in UNARY_OPERATORS:
+                raise SyntaxError(f"Unsupported operator '{node.value}'")
+            result = ast.UnaryOp(op=UNARY_OPERATORS[node.value](), operand=self.expression(node.children[0]))
+        elif node_type == ASTNodeType.ASSIGNMENT:
+            target, value = node.children
+            result = ast.NamedExpr(target=self.store(target), value=self.expression(value))
+        elif node_type == ASTNodeType.FUNCTION_CALL:
+            result = self.call(node)
+        elif node_type == ASTNodeType.ARRAY_LITERAL:
+            result = ast.List(elts=[self.expression(element) for element in node.children], ctx=ast.Load())
+        elif node_type == ASTNodeType.TEMPLATE_STRING:
+            values = []
+            for segment in node.children:
+                if is_literal(segment) and isinstance(literal_value(segment.value), str):
+                    values.append(ast.Constant(value=literal_value(segment.value)))
+                else:
+                    # format_value rather than str(), so true/false/none/lists print as in the VM
+                    formatted = ast.Call(func=self.helper("format"), args=[self.expression(segment)], keywords=[])
+                    values.append(ast.FormattedValue(value=formatted, conversion=-1, format_spec=None))
+            result = ast.JoinedStr(values=values)
+        else:
+            raise SyntaxError(f"Cannot compile {node.type} as an expression")
+        return self.located(result, node)
+
+    def call(self, node):
+        name = node.value
+        args = [self.expression(arg) for arg in node.children]
+        info = self.functions.get(name)
+        if info is None:
+            return ast.Call(func=self.helper(name), args=args, keywords=[])
+        required = info.param_count - len(info.defaults)
+        if not required <= len(args) <= info.param_count:
+            raise TypeError(f"{name}() takes {info.param_count} arguments ({required} required), got {len(args)}")
+        if not info.python_defaults:
+            args.extend(self.expression(default) for default in info.defaults[len(args) - required:])
+        return ast.Call(func=ast.Name(id=self.function_names[name], ctx=ast.Load()), args=args, keywords=[])
+
+def transpile(program_node):
+    return PythonTranspiler().transpile(program_node)
+
+def compile_python(program_node, filename="<krakenscript>"):
+    """Transpile and compile a PROGRAM AST to a code object for exec()."""
+    return compile(transpile(program_node), filename, "exec")
+
+def memoizer(memo_size, memos):
+    """The memoize helper: wraps a function in a MemoCache, appended to memos."""
+    missing = object()
+
+    def memoize(name, exact=False):
+        def decorate(function):
+            if memo_size <= 0:
+                return function
+            memo = MemoCache(name, memo_size, exact)
+            memos.append(memo)
+
+            def memoized(*args):
+                key = memo.key(args)
+                if key is None:
+                    return function(*args)
+                value = memo.lookup(key, missing)
+                if value is missing:
+                    value = function(*args)
+                    memo.store(key, value)
+                return value
+            return memoized
+        return decorate
+    return memoize
+
+def runtime_namespace(write=None, memo_size=DEFAULT_MEMO_SIZE, memos=None):
+    """Globals for executing transpiled code: the helpers it calls, and nothing else."""
+    write = write or sys.stdout.write
+    namespace = {"__name__": "__krakenscript__", "__builtins__": {}}
+    for name, function in BUILTINS:
+        namespace[HELPER_PREFIX + name] = function
+    namespace[HELPER_PREFIX + "format"] = format_value
+    namespace[HELPER_PREFIX + "print"] = lambda value: write(format_value(value) + "\n")
+    namespace[HELPER_PREFIX + "print_str"] = lambda value: write(str(value) + "\n")
+    namespace[HELPER_PREFIX + "return"] = ProgramReturn
+    namespace[HELPER_PREFIX + "memoize"] = memoizer(memo_size, [] if memos is None else memos)
+    return namespace
+
+def execute(code, write=None, memo_size=DEFAULT_MEMO_SIZE, memos=None):
+    """Run a code object from compile_python and return the value of a top-level return, if any.
+
+    The MemoCaches of memoized functions are appended to memos, if given.
+    """
+    try:
+        exec(code, runtime_namespace(write, memo_size, memos))
+    except ProgramReturn as result:
+        return result.value
+    return None
@@ -0,0 +1,444 @@
+from ast_nodes import ASTNodeType, is_name, literal_value
+from resolver import GLOBAL_DEPTH
+
+# Types are strings: the ones a declaration can name, plus the ones only
+# inference produces. Python None stands for "no value seen yet", which
+# joins with any type to give that type.
+INT = 'Int'
+FLOAT = 'Float'
+STRING = 'String'
+BOOL = 'Bool'
+NONE = 'None'  # What an @ink function returns when it ends without a return
+NUMBER = 'Number'  # An Int or a Float; either may turn up
+ANY = 'Any'  # Anything at all, including types declared with a name inference does not know
+ARRAY = 'Array'  # Arrays are Array[element type]
+
+# A declared Array holds elements of any type
+DECLARABLE_TYPES = frozenset([INT, FLOAT, STRING, BOOL, ARRAY])
+NUMERIC_TYPES = frozenset([INT, FLOAT, NUMBER])
+# Values of these types print the way str() formats them, so format_value can be skipped
+STR_FORMATTED_TYPES = frozenset([INT, FLOAT, NUMBER, STRING])
+# Each of these has exactly one runtime class (Bool values are never Int ones here)
+EXACT_TYPES = frozenset([INT, FLOAT, STRING, BOOL])
+
+# Arrays nested deeper than this are Array[Any], so let a = [a] in a loop still settles
+MAX_ARRAY_DEPTH = 4
+
+ARITHMETIC_OPERATORS = frozenset(['+', '-', '*', '/'])
+ORDERING_OPERATORS = frozenset(['<', '>', '<=', '>='])
+EQUALITY_OPERATORS = frozenset(['==', '!='])
+LOGICAL_OPERATORS = frozenset(['&&', '||'])
+
+def array_of(element):
+    if element is not None and element.count('[') >= MAX_ARRAY_DEPTH:
+        element = ANY
+    return f"{ARRAY}[{element or ''}]"
+
+def is_array(type_):
+    return type_ is not None and type_.startswith(ARRAY)
+
+def element_type(array_type):
+    return array_type[len(ARRAY) + 1:-1] or None
+
+def join(first, second):
+    """The narrowest type holding every value of both."""
+    if first is None or first == second:
+        return second
+    if second is None:
+        return first
+    if first in NUMERIC_TYPES and second in NUMERIC_TYPES:
+        return NUMBER
+    if is_array(first) and is_array(second):
+        return array_of(join(element_type(first), element_type(second)))
+    return ANY
+
+def accepts(declared, actual):
+    """Whether a value inferred as actual may be passed where declared is expected.
+
+    Only types with no value in common are refused: an Int fits a Float,
+    and a Number or an Any may turn out to fit anything.
+    """
+    if declared == ANY or actual is None or actual == ANY:
+        return True
+    if declared == FLOAT:
+        return actual in NUMERIC_TYPES
+    if declared == INT:
+        return actual in (INT, NUMBER)
+    if is_array(declared):
+        return is_array(actual)
+    return actual == declared
+
+def literal_type(value):
+    value = literal_value(value)
+    if value is True or value is False:
+        return BOOL
+    if value.__class__ is int:
+        return INT
+    if value.__class__ is float:
+        return FLOAT
+    return STRING
+
+def binary_type(operator, left, right):
+    """Type of left operator right, raising TypeError when no values of those types combine so."""
+    if operator in LOGICAL_OPERATORS:
+        return join(left, right)  # The operand that decided the result
+    if operator in EQUALITY_OPERATORS:
+        return BOOL
+    if left is None or right is None:
+        return BOOL if operator in ORDERING_OPERATORS else None
+    if left in NUMERIC_TYPES and right in NUMERIC_TYPES:
+        if operator in ORDERING_OPERATORS:
+            return BOOL
+        if operator == '/' or FLOAT in (left, right):
+            return FLOAT
+        return INT if left == right == INT else NUMBER
+    if left == ANY or right == ANY:
+        if operator in ORDERING_OPERATORS:
+            return BOOL
+        return FLOAT if operator == '/' else ANY
+    if left == right == STRING and (operator == '+' or operator in ORDERING_OPERATORS):
+        return BOOL if operator in ORDERING_OPERATORS else STRING
+    if operator == '+' and is_array(left) and is_array(right):
+        return join(left, right)
+    raise TypeError(f"Unsupported operand types for '{operator}': {left} and {right}")
+
+def unary_type(operator, operand):
+    if operator == '!':
+        return BOOL
+    if operand is None or operand == ANY or operand in NUMERIC_TYPES:
+        return operand
+    raise TypeError(f"Unsupported operand type for '{operator}': {operand}")
+
+def iterated_type(collection):
+    """Type of the values a for loop over collection takes."""
+    if is_array(collection):
+        return element_type(collection)
+    if collection is None or collection in (ANY, STRING):
+        return collection
+    raise TypeError(f"Cannot iterate over {collection}")
+
+def declared_type(name):
+    if name == ARRAY:
+        return array_of(ANY)
+    return name if name in DECLARABLE_TYPES else ANY
+
+# What each builtin returns, and what each of its arguments must be
+BUILTIN_TYPES = {
+    'len': (INT, lambda arg: arg is None or arg in (ANY, STRING) or is_array(arg)),
+    'range': (array_of(INT), lambda arg: accepts(INT, arg)),
+}
+
+class Signature:
+    """Declared parameter and return types of an @ink function."""
+    __slots__ = ('name', 'params', 'returns')
+
+    def __init__(self, name, params, returns):
+        self.name = name
+        self.params = params  # [(parameter name, type)]
+        self.returns = returns
+
+    @classmethod
+    def of(cls, node):
+        params = [(param.value, declared_type(param.children[0].value)) for param in node.children[0].children]
+        return cls(node.value, params, declared_type(node.children[1].value))
+
+    @classmethod
+    def from_interface(cls, name, entry):
+        """Signature of a function an imported module's Interface describes."""
+        return cls(name, [(param, declared_type(type_)) for param, type_, default in entry['params']],
+                   declared_type(entry['returns']))
+
+def calls_function(node, function_names):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.type == ASTNodeType.FUNCTION_CALL and node.value in function_names:
+            return True
+        stack.extend(node.children)
+    return False
+
+def falls_through(statements):
+    """Whether running statements can reach their end, rather than always returning first."""
+    for statement in statements:
+        if statement.type == ASTNodeType.RETURN_STATEMENT:
+            return False
+        if statement.type == ASTNodeType.BLOCK and not falls_through(statement.children):
+            return False
+        if statement.type == ASTNodeType.IF_STATEMENT and len(statement.children) > 2 \
+                and not falls_through([statement.children[1]]) and not falls_through([statement.children[2]]):
+            return False
+    return True
+
+class TypeInference:
+    """Infers a type for every expression of a resolved PROGRAM, and finds its type errors.
+
+    Each variable slot gets the join of every value assigned to it anywhere
+    in its frame, so inference runs over the program until no slot, call or
+    return type changes, then once more to record types (in types, keyed by
+    node) and errors (in errors, in the order found).
+
+    Checking uses the declared signatures: parameters have their declared
+    types, and arguments, default values and returned values must be
+    accepted by them. Operators, for loops and builtins reject operand
+    types no values of which they could handle. The imported Signatures
+    of a module's dependencies may be passed as imports; imported globals
+    are Any.
+
+    With proven=True, nothing is checked. Instead each parameter gets the
+    join of the arguments its calls actually pass (from the whole program)
+    and each call the join of the values its function returns, so types
+    only claim what every run guarantees and code generators may rely on
+    them. A function body may then read a global before the top level
+    assigns it, so such globals are joined with None.
+
+    With lazy=True only the top level is inferred at first and
+    check_function() handles each body later; globals other than constants
+    are Any, since bodies not yet seen may assign anything to them.
+    """
+    def __init__(self, program_node, addresses, imports=(), proven=False, lazy=False):
+        self.program_node = program_node
+        self.addresses = addresses
+        self.proven = proven
+        self.lazy = lazy
+        self.functions = [child for child in program_node.children if child.type == ASTNodeType.FUNCTION_DECLARATION]
+        self.signatures = {signature.name: signature for signature in imports}
+        for function in self.functions:
+            self.signatures[function.value] = Signature.of(function)
+        self.slots = {}  # (frame node, slot) -> type
+        self.params = {}  # Function name -> parameter types
+        self.returns = {}  # Function name -> return type
+        self.defaults = {}  # Function name -> types of its default values
+        self.types = {}  # Expression node -> type
+        self.errors = []
+        self.final = False
+        self.changed = False
+        self.function = None  # The FUNCTION_DECLARATION being inferred, if any
+        for name, signature in self.signatures.items():
+            self.params[name] = [None if proven else type_ for param, type_ in signature.params]
+            self.returns[name] = None if proven else signature.returns
+        self.constant_slots = {self.addresses[child][1] for child in program_node.children
+                               if child.type == ASTNodeType.CONSTANT_DECLARATION}
+        self.initialized_globals = self.globals_assigned_before_calls() if proven else None
+
+    def globals_assigned_before_calls(self):
+        """Global slots the top level assigns before any statement that can call a function."""
+        names = {function.value for function in self.functions}
+        slots = set()
+        for child in self.program_node.children:
+            if child.type == ASTNodeType.FUNCTION_DECLARATION:
+                continue
+            if calls_function(child, names):
+                break
+            if child.type in (ASTNodeType.VARIABLE_DECLARATION, ASTNodeType.CONSTANT_DECLARATION):
+                slots.add(self.addresses[child][1])
+        return slots
+
+    def check(self):
+        """Raise the first error found, if any."""
+        if self.errors:
+            raise self.errors[0]
+
+    def run(self):
+        """Infer the top level and, unless lazy, every function body."""
+        self.settle([None] if self.lazy else [None, *self.functions])
+        return self
+
+    def check_function(self, node):
+        """Infer a lazily compiled body, raising its first type error."""
+        count = len(self.errors)
+        self.settle([node])
+        if len(self.errors) > count:
+            raise self.errors[count]
+
+    def settle(self, units):
+        self.final = False
+        self.changed = True
+        while self.changed:
+            self.changed = False
+            for unit in units:
+                self.infer_unit(unit)
+        self.final = True
+        for unit in units:
+            self.infer_unit(unit)
+        self.final = False
+
+    def infer_unit(self, function):
+        """Infer the top level (function None) or one @ink body."""
+        self.function = function
+        if function is None:
+            for child in self.program_node.children:
+                if child.type == ASTNodeType.FUNCTION_DECLARATION:
+                    self.infer_defaults(child)
+                elif child.type != ASTNodeType.IMPORT:
+                    self.statement(child)
+            return
+        name = function.value
+        for slot, type_ in enumerate(self.params[name]):
+            self.store_slot((function, slot), type_)
+        body = function.children[2]
+        self.statement(body)
+        if self.proven and falls_through(body.children):
+            self.returned(NONE)
+        self.function = None
+
+    def infer_defaults(self, function):
+        # Callers evaluate defaults, so in a body too; infer them as a body would see them
+        self.function = function
+        signature = self.signatures[function.value]
+        types = []
+        for (param, declared), node in zip(signature.params, function.children[0].children):
+            if len(node.children) > 1:
+                type_ = self.expression(node.children[1])
+                if not accepts(declared, type_):
+                    self.error(TypeError(f"Default value of parameter '{param}' of {function.value}() "
+                                         f"must be {declared}, not {type_}"))
+                types.append(type_)
+        self.defaults[function.value] = types
+        self.function = None
+
+    def error(self, exception):
+        if self.final and not self.proven:
+            self.errors.append(exception)
+
+    def store_slot(self, key, type_):
+        old = self.slots.get(key)
+        new = join(old, type_)
+        if new != old:
+            self.slots[key] = new
+            self.changed = True
+
+    def slot_key(self, node):
+        depth, slot = self.addresses[node]
+        return (self.program_node if depth == GLOBAL_DEPTH else self.function, slot)
+
+    def load(self, node):
+        key = self.slot_key(node)
+        if key[0] is self.program_node:
+            slot = key[1]
+            if self.lazy and slot not in self.constant_slots:
+                return ANY
+            if self.proven and self.function is not None and slot not in self.initialized_globals:
+                return join(self.slots.get(key), NONE)
+        return self.slots.get(key)
+
+    def store(self, node, type_):
+        self.store_slot(self.slot_key(node), type_)
+
+    def returned(self, type_):
+        name = self.function.value
+        old = self.returns[name]
+        new = join(old, type_)
+        if new != old:
+            self.returns[name] = new
+            self.changed = True
+
+    def statement(self, node):
+        node_type = node.type
+        if node_type == ASTNodeType.BLOCK:
+            for child in node.children:
+                self.statement(child)
+        elif node_type in (ASTNodeType.VARIABLE_DECLARATION, ASTNodeType.CONSTANT_DECLARATION):
+            self.store(node, self.expression(node.children[0]))
+        elif node_type == ASTNodeType.PRINT_STATEMENT:
+            self.expression(node.children[0])
+        elif node_type == ASTNodeType.RETURN_STATEMENT:
+            type_ = self.expression(node.children[0])
+            if self.function is None:
+                return  # A top-level return ends the program
+            if self.proven:
+                self.returned(type_)
+            else:
+                declared = self.signatures[self.function.value].returns
+                if not accepts(declared, type_):
+                    self.error(TypeError(f"{self.function.value}() must return {declared}, not {type_}"))
+        elif node_type == ASTNodeType.IF_STATEMENT:
+            self.expression(node.children[0])
+            for branch in node.children[1:]:
+                self.statement(branch)
+        elif node_type == ASTNodeType.FOR_LOOP:
+            variable, collection, body = node.children
+            collection_type = self.expression(collection)
+            try:
+                self.store(variable, iterated_type(collection_type))
+            except TypeError as e:
+                self.error(e)
+                self.store(variable, ANY)
+            self.statement(body)
+        else:
+            self.expression(node)
+
+    def expression(self, node):
+        node_type = node.type
+        if node_type == ASTNodeType.EXPRESSION:
+            type_ = self.load(node) if is_name(node.value) else literal_type(node.value)
+        elif node_type == ASTNodeType.BINARY_OPERATION:
+            left, right = node.children
+            left_type = self.expression(left)
+            right_type = self.expression(right)
+            try:
+                type_ = binary_type(node.value, left_type, right_type)
+            except TypeError as e:
+                self.error(e)
+                type_ = ANY
+        elif node_type == ASTNodeType.UNARY_OPERATION:
+            try:
+                type_ = unary_type(node.value, self.expression(node.children[0]))
+            except TypeError as e:
+                self.error(e)
+                type_ = ANY
+        elif node_type == ASTNodeType.ASSIGNMENT:
+            target, value = node.children
+            type_ = self.expression(value)
+            self.store(target, type_)
+        elif node_type == ASTNodeType.FUNCTION_CALL:
+            type_ = self.call(node)
+        elif node_type == ASTNodeType.ARRAY_LITERAL:
+            element = None
+            for child in node.children:
+                element = join(element, self.expression(child))
+            type_ = array_of(element)
+        elif node_type == ASTNodeType.TEMPLATE_STRING:
+            for child in node.children:
+                self.expression(child)
+            type_ = STRING
+        else:
+            type_ = ANY
+        if self.final:
+            self.types[node] = type_
+        return type_
+
+    def call(self, node):
+        name = node.value
+        arg_types = [self.expression(arg) for arg in node.children]
+        if name in BUILTIN_TYPES and name not in self.signatures:
+            returns, accepted = BUILTIN_TYPES[name]
+            for arg_type in arg_types:
+                if not accepted(arg_type):
+                    self.error(TypeError(f"{name}() does not accept {arg_type}"))
+            return returns
+        signature = self.signatures.get(name)
+        if signature is None:
+            return ANY
+        if self.proven:
+            params = self.params[name]
+            missing = len(params) - len(arg_types)
+            if missing > 0:  # Left-out trailing arguments are the defaults
+                arg_types += self.defaults[name][-missing:]
+            for index, type_ in enumerate(arg_types[:len(params)]):
+                new = join(params[index], type_)
+                if new != params[index]:
+                    params[index] = new
+                    self.changed = True
+        else:
+            for (param, declared), arg_type in zip(signature.params, arg_types):
+                if not accepts(declared, arg_type):
+                    self.error(TypeError(f"{name}() expects {declared} for parameter '{param}', got {arg_type}"))
+        return self.returns[name]
+
+def check_types(program_node, addresses, imports=(), lazy=False):
+    """TypeInference of a resolved PROGRAM against its declared signatures; call check() to raise its first error."""
+    return TypeInference(program_node, addresses, imports, lazy=lazy).run()
+
+def infer_types(program_node, addresses):
+    """TypeInference with proven types, which code generators may specialize on."""
+    return TypeInference(program_node, addresses, proven=True).run()
@@ -0,0 +1,388 @@
+import operator
+from itertools import repeat
+import numpy
+from ast_nodes import ASTNodeType, is_name, literal_value
+from resolver import GLOBAL_DEPTH, LOCAL_DEPTH
+from vm import format_value
+
+# Integers up to this magnitude convert to float64 exactly, so mixing them
+# with floats gives NumPy the same result Python gets
+EXACT_FLOAT_INTEGER = 2 ** 53
+# int64 arithmetic wraps around here; Python integers never do
+INT64_LIMIT = 2 ** 63
+
+ELEMENTWISE_OPERATORS = {
+    '+': (operator.add, numpy.add),
+    '-': (operator.sub, numpy.subtract),
+    '*': (operator.mul, numpy.multiply),
+    '/': (operator.truediv, numpy.true_divide),
+}
+
+# total = total + x and friends; subtraction accumulates the negated values
+REDUCTION_OPERATORS = frozenset(['+', '-', '*'])
+
+NUMBER_CLASSES = (int, float)
+
+class Unsupported(Exception):
+    """A loop uses something other than element-wise arithmetic, prints and stores."""
+
+class Fallback(Exception):
+    """Values met at run time that NumPy cannot handle with the VM's exact semantics."""
+
+def magnitude(value):
+    """Largest absolute value of an int or an int64 array."""
+    if isinstance(value, numpy.ndarray):
+        return max(-int(value.min()), int(value.max())) if value.size else 0
+    return abs(value)
+
+def is_float(value):
+    if isinstance(value, numpy.ndarray):
+        return value.dtype.kind == 'f'
+    return value.__class__ is float
+
+def check_number(value):
+    if not isinstance(value, numpy.ndarray) and value.__class__ not in NUMBER_CLASSES:
+        raise Fallback(f"Cannot vectorize arithmetic on {format_value(value)}")
+
+def check_float_conversion(*values):
+    """Ints that meet a float (or a division) are converted; only exact conversions are allowed."""
+    for value in values:
+        if not is_float(value) and magnitude(value) >= EXACT_FLOAT_INTEGER:
+            raise Fallback("Integer too large to convert to float64 exactly")
+
+def apply_binary(symbol, left, right):
+    scalar_operator, array_operator = ELEMENTWISE_OPERATORS[symbol]
+    check_number(left)
+    check_number(right)
+    right_is_array = isinstance(right, numpy.ndarray)
+    # The scalar loop raises ZeroDivisionError at the offending element; leave that to it
+    if symbol == '/' and ((right == 0).any() if right_is_array else right == 0):
+        raise Fallback("Division by zero")
+    if not (right_is_array or isinstance(left, numpy.ndarray)):
+        return scalar_operator(left, right)
+    if symbol == '/' or is_float(left) or is_float(right):
+        check_float_conversion(left, right)
+    elif symbol == '*':
+        if magnitude(left) * magnitude(right) >= INT64_LIMIT:
+            raise Fallback("Integer product may overflow int64")
+    elif magnitude(left) + magnitude(right) >= INT64_LIMIT:
+        raise Fallback("Integer sum may overflow int64")
+    return array_operator(left, right)
+
+def negate(value):
+    check_number(value)
+    # Python integers negate freely; only -2**63 has no int64 negation
+    if isinstance(value, numpy.ndarray) and not is_float(value) and magnitude(value) >= INT64_LIMIT:
+        raise Fallback("Integer negation overflows int64")
+    return -value
+
+def broadcast(value, count):
+    if isinstance(value, numpy.ndarray):
+        return value
+    if value.__class__ is int and magnitude(value) >= INT64_LIMIT:
+        raise Fallback("Integer does not fit in int64")
+    return numpy.full(count, value)
+
+def accumulate(symbol, start, values, count):
+    """Value of the reduction variable after each iteration, summed in loop order.
+
+    ufunc.accumulate adds strictly left to right, unlike sum(), so float
+    results are the ones the scalar loop computes.
+    """
+    check_number(start)
+    check_number(values)
+    values = broadcast(values, count)
+    start = broadcast(start, 1)
+    if symbol == '-':
+        values = negate(values)
+    if is_float(start) or is_float(values):
+        check_float_conversion(start, values)
+    elif symbol == '*':
+        raise Fallback("Integer products overflow int64 too easily to bound")
+    elif magnitude(start) + count * magnitude(values) >= INT64_LIMIT:
+        raise Fallback("Integer sum may overflow int64")
+    ufunc = numpy.multiply if symbol == '*' else numpy.add
+    return ufunc.accumulate(numpy.concatenate((start, values)))[1:]
+
+def evaluate(expression, read):
+    kind = expression[0]
+    if kind == 'const':
+        return expression[1]
+    if kind == 'load':
+        return read(expression[1])
+    if kind == 'neg':
+        return negate(evaluate(expression[1], read))
+    return apply_binary(expression[1], evaluate(expression[2], read), evaluate(expression[3], read))
+
+def last(value):
+    return value[-1].item() if isinstance(value, numpy.ndarray) else value
+
+def to_array(values):
+    """Contiguous array for a list of all-float or all-int values."""
+    classes = set(map(type, values))
+    if classes == {float}:
+        return numpy.array(values, dtype=numpy.float64)
+    if classes == {int}:
+        return numpy.array(values, dtype=numpy.int64)
+    if not classes:
+        return numpy.array([], dtype=numpy.float64)
+    # Mixed lists keep int and float arithmetic apart element by element
+    raise Fallback("Only lists of all floats or all integers are vectorized")
+
+class LiteralCollection:
+    """An array literal of numbers, converted once at compile time."""
+    def __init__(self, values):
+        self.array = to_array(values)
+
+    def evaluate(self, read):
+        return self.array
+
+class NameCollection:
+    def __init__(self, address):
+        self.address = address
+
+    def evaluate(self, read):
+        value = read(self.address)
+        if value.__class__ is not list:
+            raise Fallback("Only lists are vectorized")
+        return to_array(value)
+
+class RangeCollection:
+    def __init__(self, args):
+        self.args = args
+
+    def evaluate(self, read):
+        args = [evaluate(arg, read) for arg in self.args]
+        if any(arg.__class__ is not int or magnitude(arg) >= INT64_LIMIT for arg in args):
+            raise Fallback("range() arguments must be int64 integers")
+        if len(args) == 3 and args[2] == 0:
+            raise Fallback("range() step is zero")
+        return numpy.arange(*args, dtype=numpy.int64)
+
+class LoopPlan:
+    """One for loop's body as a list of steps over whole arrays.
+
+    Steps are ('store', address, expression), ('reduce', address, operator,
+    expression) and ('print', expression); expressions are nested tuples of
+    ('const', value), ('load', address), ('neg', operand) and ('binary',
+    operator, left, right).
+    """
+    __slots__ = ('variable', 'steps', 'writes')
+
+    def __init__(self, variable, steps, writes):
+        self.variable = variable
+        self.steps = steps
+        self.writes = writes
+
+class LoopKernel:
+    """Adjacent for loops over one collection, run as NumPy array operations.
+
+    run() computes everything before it prints or stores anything, so when
+    the values it meets cannot be vectorized exactly (a list of strings, a
+    zero divisor, integers that could overflow int64) it returns False
+    without side effects and the VM runs the scalar loops that follow.
+    """
+    def __init__(self, collection, loops):
+        self.collection = collection
+        self.loops = loops
+        self.end = None  # Offset just past the scalar loops
+        self.runs = 0
+        self.fallbacks = 0
+
+    def run(self, locals_, globals_, write):
+        frames = {GLOBAL_DEPTH: globals_, LOCAL_DEPTH: locals_}
+        finals = {}
+
+        def load(address):
+            if address in finals:
+                return finals[address]
+            depth, slot = address
+            return frames[depth][slot]
+
+        output = []
+        try:
+            with numpy.errstate(all='ignore'):
+                elements = self.collection.evaluate(load)
+                if len(elements):
+                    for loop in self.loops:
+                        self.run_loop(loop, elements, load, finals, output)
+        except (Fallback, OverflowError, TypeError, ValueError):
+            self.fallbacks += 1
+            return False
+        for (depth, slot), value in finals.items():
+            frames[depth][slot] = value
+        if output:
+            write("".join(output))
+        self.runs += 1
+        return True
+
+    def run_loop(self, loop, elements, load, finals, output):
+        count = len(elements)
+        values = {loop.variable: elements}
+
+        def read(address):
+            if address in values:
+                return values[address]
+            return load(address)
+
+        columns = []
+        for step in loop.steps:
+            kind = step[0]
+            if kind == 'print':
+                value = evaluate(step[1], read)
+                if isinstance(value, numpy.ndarray):
+                    # Numeric elements format as str() does in format_value
+                    columns.append(list(map(str, value.tolist())))
+                else:
+                    columns.append(repeat(format_value(value), count))
+            elif kind == 'store':
+                values[step[1]] = evaluate(step[2], read)
+            else:
+                address, symbol, expression = step[1:]
+                values[address] = accumulate(symbol, read(address), evaluate(expression, read), count)
+        if columns:
+            # Lines come out iteration by iteration, as the scalar loop prints them
+            output.append("".join(line + "\n" for row in zip(*columns) for line in row))
+        for address, value in values.items():
+            finals[address] = last(value)
+
+class LoopVectorizer:
+    """Finds for loops the VM can run as LoopKernels.
+
+    A loop qualifies when its collection is a name, a numeric array literal
+    or a range() call, and its body only declares, assigns and prints
+    element-wise + - * / arithmetic. A variable the body writes may only be
+    read after it is written in the same iteration, except for reductions
+    (total = total + x), which are computed as running sums or products.
+    """
+    def __init__(self, addresses, functions):
+        self.addresses = addresses
+        self.functions = functions
+
+    def plan(self, statements, index):
+        """Kernel for the loop at statements[index] and the loops over the same
+        collection that directly follow it, or None."""
+        try:
+            collection, key, dependencies = self.plan_collection(statements[index].children[1])
+            loops = [self.plan_loop(statements[index])]
+        except (Unsupported, RecursionError):
+            return None
+        written = set(loops[0].writes)
+        for statement in statements[index + 1:]:
+            if statement.type != ASTNodeType.FOR_LOOP:
+                break
+            try:
+                following_key, following_dependencies = self.plan_collection(statement.children[1])[1:]
+                loop = self.plan_loop(statement)
+            except (Unsupported, RecursionError):
+                break
+            # The collection is evaluated once, so earlier loops must not change it
+            if following_key != key or following_dependencies & written:
+                break
+            loops.append(loop)
+            written.update(loop.writes)
+        return LoopKernel(collection, loops)
+
+    def plan_collection(self, node):
+        """Return the collection, a key equal for identical collections, and the addresses it reads."""
+        if node.type == ASTNodeType.EXPRESSION and is_name(node.value):
+            address = self.addresses[node]
+            return NameCollection(address), ('name', address), {address}
+        if node.type == ASTNodeType.ARRAY_LITERAL:
+            values = [self.constant(element) for element in node.children]
+            try:
+                collection = LiteralCollection(values)
+            except (Fallback, OverflowError):
+                raise Unsupported("Array literal is not all floats or all integers")
+            return collection, ('array', tuple((value.__class__, value) for value in values)), set()
+        if node.type == ASTNodeType.FUNCTION_CALL and node.value == 'range' \
+                and node.value not in self.functions and 1 <= len(node.children) <= 3:
+            reads = []
+            args = tuple(self.plan_expression(arg, reads) for arg in node.children)
+            return RangeCollection(args), ('range', args), set(reads)
+        raise Unsupported(f"Cannot vectorize a loop over {node.type}")
+
+    def constant(self, node):
+        if node.type == ASTNodeType.UNARY_OPERATION and node.value == '-':
+            return -self.constant(node.children[0])
+        if node.type == ASTNodeType.EXPRESSION and not is_name(node.value):
+            value = literal_value(node.value)
+            if value.__class__ in NUMBER_CLASSES:
+                return value
+        raise Unsupported("Array literal elements must be numbers")
+
+    def plan_loop(self, node):
+        variable, collection, body = node.children
+        statements = []
+        self.flatten(body, statements)
+        targets = [self.target(statement)[0] for statement in statements
+                   if statement.type != ASTNodeType.PRINT_STATEMENT]
+        writes = set(targets)
+        written = {self.addresses[variable]}
+        steps = []
+        for statement in statements:
+            reads = []
+            if statement.type == ASTNodeType.PRINT_STATEMENT:
+                steps.append(('print', self.plan_expression(statement.children[0], reads)))
+            else:
+                address, value = self.target(statement)
+                reduction = self.reduction(address, value)
+                if reduction is not None and address not in written and targets.count(address) == 1:
+                    symbol, operand = reduction
+                    steps.append(('reduce', address, symbol, self.plan_expression(operand, reads)))
+                    if address in reads:
+                        raise Unsupported("Reduction operand reads the reduction variable")
+                else:
+                    steps.append(('store', address, self.plan_expression(value, reads)))
+            for read in reads:
+                if read in writes and read not in written:
+                    raise Unsupported("Value carried over from the previous iteration")
+            if statement.type != ASTNodeType.PRINT_STATEMENT:
+                written.add(address)
+        return LoopPlan(self.addresses[variable], steps, writes | {self.addresses[variable]})
+
+    def flatten(self, node, statements):
+        for statement in node.children:
+            if statement.type == ASTNodeType.BLOCK:
+                self.flatten(statement, statements)
+            elif statement.type in (ASTNodeType.PRINT_STATEMENT, ASTNodeType.VARIABLE_DECLARATION,
+                                    ASTNodeType.CONSTANT_DECLARATION, ASTNodeType.ASSIGNMENT):
+                statements.append(statement)
+            else:
+                raise Unsupported(f"Cannot vectorize {statement.type} in a loop body")
+
+    def target(self, statement):
+        """Address written by a declaration or assignment, and the value written."""
+        if statement.type == ASTNodeType.ASSIGNMENT:
+            target, value = statement.children
+            return self.addresses[target], value
+        return self.addresses[statement], statement.children[0]
+
+    def reduction(self, address, value):
+        """(operator, operand) if value is address <op> operand, or operand <op> address for + and *."""
+        if value.type != ASTNodeType.BINARY_OPERATION or value.value not in REDUCTION_OPERATORS:
+            return None
+        left, right = value.children
+        if self.is_reference(left, address):
+            return value.value, right
+        if value.value != '-' and self.is_reference(right, address):
+            return value.value, left
+        return None
+
+    def is_reference(self, node, address):
+        return node.type == ASTNodeType.EXPRESSION and is_name(node.value) and self.addresses.get(node) == address
+
+    def plan_expression(self, node, reads):
+        node_type = node.type
+        if node_type == ASTNodeType.EXPRESSION:
+            if is_name(node.value):
+                address = self.addresses[node]
+                reads.append(address)
+                return ('load', address)
+            return ('const', literal_value(node.value))
+        if node_type == ASTNodeType.BINARY_OPERATION and node.value in ELEMENTWISE_OPERATORS:
+            left, right = node.children
+            return ('binary', node.value, self.plan_expression(left, reads), self.plan_expression(right, reads))
+        if node_type == ASTNodeType.UNARY_OPERATION and node.value == '-':
+            return ('neg', self.plan_expression(node.children[0], reads))
+        raise Unsupported(f"Cannot vectorize {node_type} {node.value}")
@@ -0,0 +1,97 @@
+from ast_nodes import ASTNodeType
+
+def walk(root):
+    """Yield (node, depth) for every node in preorder without recursion."""
+    stack = [(root, 0)]
+    pop = stack.pop
+    push = stack.append
+    while stack:
+        node, depth = pop()
+        yield node, depth
+        children = node.children
+        for index in range(len(children) - 1, -1, -1):
+            push((children[index], depth + 1))
+
+def handler_table(instance, prefix):
+    """Map node types to the instance's '<prefix><type name in lowercase>' methods."""
+    table = {}
+    for node_type in ASTNodeType:
+        method = getattr(instance, prefix + node_type.name.lower(), None)
+        if method is not None:
+            table[node_type] = method
+    return table
+
+class NodeVisitor:
+    """Explicit-stack AST traversal, safe for trees of any depth.
+
+    Subclasses define enter_<type> and/or leave_<type> methods named after
+    the lowercase node type (enter_function_call, leave_block, ...);
+    enter_node and leave_node catch every type without a specific method.
+    Returning False from an enter method skips that node's children.
+    """
+    def __init__(self):
+        self.enter_handlers = handler_table(self, "enter_")
+        self.leave_handlers = handler_table(self, "leave_")
+
+    def enter_node(self, node):
+        return None
+
+    def leave_node(self, node):
+        return None
+
+    def visit(self, root):
+        enter_handlers = self.enter_handlers
+        leave_handlers = self.leave_handlers
+        enter_default = self.enter_node
+        leave_default = self.leave_node
+        # (node, leaving) pairs; a node is pushed again to be left after its children
+        stack = [(root, False)]
+        pop = stack.pop
+        push = stack.append
+        while stack:
+            node, leaving = pop()
+            if leaving:
+                leave_handlers.get(node.type, leave_default)(node)
+                continue
+            if enter_handlers.get(node.type, enter_default)(node) is False:
+                continue
+            push((node, True))
+            children = node.children
+            for index in range(len(children) - 1, -1, -1):
+                push((children[index], False))
+
+class NodeTransformer:
+    """Explicit-stack bottom-up rewriting of an ASTNode tree.
+
+    transform_<type> methods (or transform_node for every other type) get a
+    node whose children have already been transformed, and return its
+    replacement: the node itself, a new node, a list of nodes to splice in
+    its place, or None to drop it. Children lists are updated in place.
+    """
+    def __init__(self):
+        self.handlers = handler_table(self, "transform_")
+
+    def transform_node(self, node):
+        return node
+
+    def transform(self, root):
+        handlers = self.handlers
+        default = self.transform_node
+        # [node, index of the next child to descend into, transformed children]
+        stack = [[root, 0, []]]
+        while True:
+            frame = stack[-1]
+            node, index, children = frame
+            if index < len(node.children):
+                frame[1] += 1
+                stack.append([node.children[index], 0, []])
+                continue
+            stack.pop()
+            node.children = children
+            result = handlers.get(node.type, default)(node)
+            if not stack:
+                return result
+            if isinstance(result, list):
+                stack[-1][2].extend(result)
+            elif result is not None:
+                stack[-1][2].append(result)
@@ -0,0 +1,366 @@
+import os
+import sys
+import time
+from functools import partial
+from bytecode import Opcode, BUILTINS, BUILTIN_ARGC_BITS, compile_program
+from memoize import MemoCache, DEFAULT_MEMO_SIZE
+
+# Deepest KrakenScript call stack before the VM gives up
+MAX_CALL_DEPTH = 10000
+
+def format_value(value):
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if value is None:
+        return "none"
+    if isinstance(value, list):
+        return "[" + ", ".join(format_value(item) for item in value) + "]"
+    return str(value)
+
+class VM:
+    """Stack-based interpreter for a compiled Program.
+
+    Each frame is a code array, a program counter and a list of local slots.
+    All frames share one value stack; a frame remembers where its part of
+    the stack starts so returning discards whatever the callee left behind.
+
+    Functions the compiler marked for memoization get a MemoCache of
+    memo_size entries (0 turns memoization off): a call with cached
+    arguments pushes the cached result without entering the function, and
+    a call that misses stores its result when it returns.
+
+    A RuntimeProfile collects what the LINE, ENTER and LEAVE instructions of
+    a program compiled for it report, or samples the running program.
+    """
+    def __init__(self, program, write=None, memo_size=DEFAULT_MEMO_SIZE, profile=None):
+        self.program = program
+        self.profile = profile
+        self.write = write or sys.stdout.write
+        self.globals = [None] * len(program.global_names)
+        self.memo_size = memo_size
+        self.memos = [MemoCache(function.name, memo_size, function.exact_args) if function.memoize and memo_size > 0 else None
+                      for function in program.functions]
+        self.instructions = 0
+        self.elapsed = 0.0
+        self.result = None
+
+    @property
+    def instructions_per_second(self):
+        return self.instructions / self.elapsed if self.elapsed else 0.0
+
+    def run(self):
+        profile = self.profile
+        if profile is None:
+            return self.execute()
+        profile.start(self)
+        try:
+            return self.execute()
+        finally:
+            profile.stop(self)
+
+    def execute(self):
+        LOAD_CONST = int(Opcode.LOAD_CONST)
+        LOAD_LOCAL = int(Opcode.LOAD_LOCAL)
+        STORE_LOCAL = int(Opcode.STORE_LOCAL)
+        LOAD_GLOBAL = int(Opcode.LOAD_GLOBAL)
+        STORE_GLOBAL = int(Opcode.STORE_GLOBAL)
+        ADD = int(Opcode.ADD)
+        SUB = int(Opcode.SUB)
+        MUL = int(Opcode.MUL)
+        DIV = int(Opcode.DIV)
+        LT = int(Opcode.LT)
+        GT = int(Opcode.GT)
+        LE = int(Opcode.LE)
+        GE = int(Opcode.GE)
+        EQ = int(Opcode.EQ)
+        NE = int(Opcode.NE)
+        NEG = int(Opcode.NEG)
+        NOT = int(Opcode.NOT)
+        JUMP = int(Opcode.JUMP)
+        JUMP_IF_FALSE = int(Opcode.JUMP_IF_FALSE)
+        JUMP_IF_FALSE_OR_POP = int(Opcode.JUMP_IF_FALSE_OR_POP)
+        JUMP_IF_TRUE_OR_POP = int(Opcode.JUMP_IF_TRUE_OR_POP)
+        GET_ITER = int(Opcode.GET_ITER)
+        FOR_ITER = int(Opcode.FOR_ITER)
+        VECTOR_LOOP = int(Opcode.VECTOR_LOOP)
+        CALL = int(Opcode.CALL)
+        COMPILE_FUNCTION = int(Opcode.COMPILE_FUNCTION)
+        CALL_BUILTIN = int(Opcode.CALL_BUILTIN)
+        RETURN = int(Opcode.RETURN)
+        PRINT = int(Opcode.PRINT)
+        PRINT_STR = int(Opcode.PRINT_STR)
+        POP = int(Opcode.POP)
+        DUP = int(Opcode.DUP)
+        BUILD_ARRAY = int(Opcode.BUILD_ARRAY)
+        BUILD_STRING = int(Opcode.BUILD_STRING)
+        HALT = int(Opcode.HALT)
+        LINE = int(Opcode.LINE)
+        ENTER = int(Opcode.ENTER)
+        LEAVE = int(Opcode.LEAVE)
+        argc_mask = (1 << BUILTIN_ARGC_BITS) - 1
+
+        program = self.program
+        constants = program.constants
+        functions = program.functions
+        memos = self.memos
+        kernels = program.kernels
+        globals_ = self.globals
+        write = self.write
+        profile = self.profile
+        if profile is not None:
+            line_counts = profile.line_counts
+            enter = profile.enter
+            leave = profile.leave
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        frames = []
+        code = program.main.code
+        locals_ = []
+        pc = 0
+        executed = 0
+        exhausted = object()
+        missing = object()
+        start = time.perf_counter()
+
+        while True:
+            op = code[pc]
+            arg = code[pc + 1]
+            pc += 2
+            executed += 1
+            if op == LOAD_LOCAL:
+                push(locals_[arg])
+            elif op == LOAD_CONST:
+                push(constants[arg])
+            elif op == STORE_LOCAL:
+                locals_[arg] = pop()
+            elif op == ADD:
+                right = pop()
+                stack[-1] = stack[-1] + right
+            elif op == SUB:
+                right = pop()
+                stack[-1] = stack[-1] - right
+            elif op == MUL:
+                right = pop()
+                stack[-1] = stack[-1] * right
+            elif op == DIV:
+                right = pop()
+                stack[-1] = stack[-1] / right
+            elif op == LOAD_GLOBAL:
+                push(globals_[arg])
+            elif op == STORE_GLOBAL:
+                globals_[arg] = pop()
+            elif op == JUMP_IF_FALSE:
+                if not pop():
+                    pc = arg
+            elif op == JUMP:
+                pc = arg
+            elif op == FOR_ITER:
+                value = next(stack[-1], exhausted)
+                if value is exhausted:
+                    pop()
+                    pc = arg
+                else:
+                    push(value)
+            elif op == VECTOR_LOOP:
+                kernel = kernels[arg]
+                if kernel.run(locals_, globals_, write):
+                    pc = kernel.end
+            elif op == CALL:
+                function = functions[arg]
+                base = len(stack) - function.param_count
+                new_locals = stack[base:]
+                del stack[base:]
+                memo = memos[arg]
+                key = None
+                if memo is not None:
+                    key = memo.key(new_locals)
+                    if key is not None:
+                        value = memo.lookup(key, missing)
+                        if value is not missing:
+                            push(value)
+                            continue
+                if len(frames) >= MAX_CALL_DEPTH:
+                    raise RecursionError(f"Maximum call depth exceeded in {function.name}")
+                if function.local_count > function.param_count:
+                    new_locals.extend([None] * (function.local_count - function.param_count))
+                frames.append((code, pc, locals_, base, memo, key))
+                code = function.code
+                locals_ = new_locals
+                pc = 0
+            elif op == COMPILE_FUNCTION:
+                # First call of a lazily compiled function, whose frame already holds the arguments
+                function = functions[arg]
+                function.compile_body()
+                if function.memoize and self.memo_size > 0:
+                    memo = memos[arg] = MemoCache(function.name, self.memo_size)
+                    # CALL found no cache to consult, so record this call as a miss whose result RETURN stores
+                    key = memo.key(locals_)
+                    if key is not None:
+                        memo.misses += 1
+                        frames[-1] = (*frames[-1][:4], memo, key)
+                locals_.extend([None] * (function.local_count - len(locals_)))
+                code = function.code
+                pc = 0
+                if profile is not None:
+                    line_counts.extend([0] * (len(program.lines) - len(line_counts)))
+            elif op == RETURN:
+                value = pop()
+                if not frames:
+                    self.result = value
+                    break
+                code, pc, locals_, base, memo, key = frames.pop()
+                if key is not None:
+                    memo.store(key, value)
+                del stack[base:]
+                push(value)
+            elif op == LT:
+                right = pop()
+                stack[-1] = stack[-1] < right
+            elif op == GT:
+                right = pop()
+                stack[-1] = stack[-1] > right
+            elif op == LE:
+                right = pop()
+                stack[-1] = stack[-1] <= right
+            elif op == GE:
+                right = pop()
+                stack[-1] = stack[-1] >= right
+            elif op == EQ:
+                right = pop()
+                stack[-1] = stack[-1] == right
+            elif op == NE:
+                right = pop()
+                stack[-1] = stack[-1] != right
+            elif op == JUMP_IF_FALSE_OR_POP:
+                if stack[-1]:
+                    pop()
+                else:
+                    pc = arg
+            elif op == JUMP_IF_TRUE_OR_POP:
+                if stack[-1]:
+                    pc = arg
+                else:
+                    pop()
+            elif op == NOT:
+                stack[-1] = not stack[-1]
+            elif op == NEG:
+                stack[-1] = -stack[-1]
+            elif op == PRINT:
+                write(format_value(pop()) + "\n")
+            elif op == PRINT_STR:
+                write(str(pop()) + "\n")
+            elif op == POP:
+                pop()
+            elif op == DUP:
+                push(stack[-1])
+            elif op == GET_ITER:
+                stack[-1] = iter(stack[-1])
+            elif op == CALL_BUILTIN:
+                argc = arg & argc_mask
+                base = len(stack) - argc
+                args = stack[base:]
+                del stack[base:]
+                push(BUILTINS[arg >> BUILTIN_ARGC_BITS][1](*args))
+            elif op == BUILD_ARRAY:
+                base = len(stack) - arg
+                items = stack[base:]
+                del stack[base:]
+                push(items)
+            elif op == BUILD_STRING:
+                base = len(stack) - arg
+                pieces = [piece if piece.__class__ is str else format_value(piece) for piece in stack[base:]]
+                del stack[base:]
+                push("".join(pieces))
+            elif op == HALT:
+                break
+            elif op == LINE:
+                line_counts[arg] += 1
+            elif op == ENTER:
+                enter(arg)
+            elif op == LEAVE:
+                leave()
+            else:
+                raise RuntimeError(f"Unknown opcode {op} at offset {pc - 2}")
+
+        self.elapsed = time.perf_counter() - start
+        self.instructions = executed
+        return self.result
+
+def run(program_node, write=None, vectorize=False, memo_size=DEFAULT_MEMO_SIZE, lazy=False, profile=None):
+    """Compile a parsed PROGRAM node and execute it, returning the VM."""
+    vm = VM(compile_program(program_node, vectorize, lazy, profile), write, memo_size, profile)
+    vm.run()
+    return vm
+
+def parsed_uncalled_bodies(program_node, program):
+    """Names of the functions of a lazily compiled program whose bodies were parsed without being called."""
+    from ast_nodes import ASTNodeType
+    from parser import LazyBlock
+
+    uncompiled = {function.name for function in program.functions if function.compile_body is not None}
+    return [child.value for child in program_node.children
+            if child.type == ASTNodeType.FUNCTION_DECLARATION and child.value in uncompiled
+            and isinstance(child.children[2], LazyBlock) and child.children[2].parsed]
+
+def run_corpus(directory, optimize=False, vectorize=False, lazy=False, backend="vm"):
+    """Run every .ks file in directory and compare its output with the .out file next to it.
+
+    backend="python" runs each program as transpiled CPython code instead.
+    Returns a list of (name, expected, actual) for the programs that differ.
+    """
+    from parser import parse
+    from optimizer import PassManager
+    from modules import load_program
+    from transpiler import compile_python, execute
+
+    failures = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".ks"):
+            continue
+        path = os.path.join(directory, name)
+        with open(path) as f:
+            source = f.read()
+        with open(path[:-3] + ".out") as f:
+            expected = f.read()
+        output = []
+        try:
+            ast = load_program(path, parse(source, lazy=lazy), partial(parse, lazy=lazy), lazy)
+            if optimize:
+                ast = PassManager().run(ast)
+            if backend == "python":
+                execute(compile_python(ast, path), output.append)
+            else:
+                vm = run(ast, output.append, vectorize, lazy=lazy)
+                if lazy:
+                    output.extend(f"error: the body of {name}() was parsed but never called\n"
+                                  for name in parsed_uncalled_bodies(ast, vm.program))
+            actual = "".join(output)
+        except Exception as e:
+            actual = "".join(output) + f"error: {type(e).__name__}: {e}\n"
+        if actual != expected:
+            failures.append((name, expected, actual))
+    return failures
+
+# Run the VM test corpus
+if __name__ == "__main__":
+    import importlib.util
+    corpus = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples", "vm")
+    total = len([name for name in os.listdir(corpus) if name.endswith(".ks")])
+    # (optimize, vectorize, lazy, backend, label); vectorized loops need the optional numpy
+    modes = [(False, False, False, "vm", ""), (True, False, False, "vm", " with optimizations"),
+             (False, False, True, "vm", " with lazy function bodies"),
+             (False, False, False, "python", " on the python backend"),
+             (True, False, False, "python", " on the python backend with optimizations")]
+    if importlib.util.find_spec("numpy") is not None:
+        modes.append((False, True, False, "vm", " with vectorized loops"))
+    failed = False
+    for optimize, vectorize, lazy, backend, label in modes:
+        failures = run_corpus(corpus, optimize, vectorize, lazy, backend)
+        for name, expected, actual in failures:
+            print(f"FAIL {name}{label}\n--- expected\n{expected}--- actual\n{actual}")
+        print(f"{total - len(failures)}/{total} corpus programs passed{label}")
+        failed = failed or bool(failures)
+    sys.exit(1 if failed else 0)